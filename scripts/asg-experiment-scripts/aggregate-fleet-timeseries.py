@@ -0,0 +1,66 @@
+import math
+import argparse
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from clients import load_client_details, create_opensearch_client
+from steady_state import get_request_counts
+from tracing import span, trace_run, add_tracing_arguments
+
+DEFAULT_BUCKET_SECONDS = "1,10"
+
+# Build the ops/s the whole fleet generated over time from the request counts of every node per time bucket.
+# Each request has one service_time sample, so counting those per bucket gives the fleet's throughput in that bucket.
+# The MDS counts them with the composite aggregation of steady_state.py, so only one row per node and bucket is
+# downloaded (e.g. 600,000 rows for 1000 nodes over 600s in 1s buckets) instead of every sample.
+def aggregate_fleet_timeseries(client_details, output_name, test_execution_id, bucket_widths):
+    client = create_opensearch_client(client_details)
+
+    # Counted once with the greatest common divisor of the widths, whose buckets add up to the buckets of every width
+    base_seconds = reduce(math.gcd, bucket_widths)
+    with span("get_request_counts", bucket_seconds=base_seconds):
+        request_counts = get_request_counts(client, test_execution_id, base_seconds)
+    if request_counts.empty:
+        raise Exception(f"No service_time samples found for {test_execution_id}")
+    print(f"Counting requests from {request_counts['node'].nunique()} nodes")
+
+    for bucket_seconds in bucket_widths:
+        file_name = f"{output_name}-{bucket_seconds}s.csv"
+        with span("write_timeseries", bucket_seconds=bucket_seconds):
+            build_timeseries(request_counts, bucket_seconds).to_csv(file_name, index=False)
+        print("Writing to file: ", file_name)
+
+def build_timeseries(request_counts, bucket_seconds):
+    # One row per bucket of bucket_seconds from the first request to the last one. Buckets without any request are
+    # written with zero requests so the time axis has no gaps. A node is active in a bucket when it sent a request in it.
+    bucket_ms = bucket_seconds * 1000
+    buckets = request_counts["time"] - request_counts["time"] % bucket_ms
+    grouped = request_counts.groupby(buckets)
+    timestamps = np.arange(buckets.min(), buckets.max() + bucket_ms, bucket_ms)
+    requests = grouped["requests"].sum().reindex(timestamps, fill_value=0).to_numpy()
+
+    return pd.DataFrame({
+        "time": (timestamps - timestamps[0]) / 1000,
+        "timestamp": timestamps,
+        "requests": requests,
+        "ops_per_second": requests / bucket_seconds,
+        "active_nodes": grouped["node"].nunique().reindex(timestamps, fill_value=0).to_numpy()
+    })
+
+def comma_separated_ints(input: str):
+    return [int(value) for value in input.split(',')]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the fleet-wide throughput time series of a round from the MDS')
+    parser.add_argument('--output-name', '-n', required=True, help="Output filename to use. One CSV is written per bucket width")
+    parser.add_argument('--id', '-i', required=True, help='Test-execution-id pattern of the round (e.g. 8-clients-2*)')
+    parser.add_argument('--bucket-seconds', '-b', type=comma_separated_ints, default=DEFAULT_BUCKET_SECONDS, help=f'Comma-separated bucket widths in seconds. Default: {DEFAULT_BUCKET_SECONDS}')
+    add_tracing_arguments(parser)
+    args = parser.parse_args()
+
+    client_details = load_client_details()
+
+    with trace_run("aggregate-fleet-timeseries", args.trace, args.profile):
+        aggregate_fleet_timeseries(client_details, args.output_name, args.id, args.bucket_seconds)
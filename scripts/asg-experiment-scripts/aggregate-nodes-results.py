@@ -7,9 +7,16 @@ import numpy as np
 
 import pandas as pd
 import tabulate
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, exceptions
-import boto3
-from dotenv import load_dotenv
+
+from clients import load_client_details, create_opensearch_client
+from mds import DocumentStream, build_results_query, get_latest_results
+from cache import ResultCache
+from histogram import get_sketches, merge_sketches, calculate_percentiles
+from steady_state import get_request_counts, calculate_steady_state_throughput, DEFAULT_BUCKET_SECONDS
+from results_files import load_results_dir
+from outliers import find_outlier_nodes, DEFAULT_Z_THRESHOLD
+from lg_resources import load_resource_summaries, build_load_generator_report, DEFAULT_CPU_BOUND_PERCENT
+from tracing import span, trace_run, add_tracing_arguments
 
 THROUGHPUT = 'throughput'
 SERVICE_TIME = 'service_time'
@@ -17,11 +24,46 @@ LATENCY = 'latency'
 
 # Aggregate results in a round: with a specific test_execution_id pattern (e.g. 8-clients-2) because we need to aggregate results from all nodes in a round
 # Aggregate all rounds at the end
-def aggregate_results(client_details, output_name, test_execution_id):
+def aggregate_results(client_details, output_name, test_execution_id, server_side=False, cache=None, histograms=False, steady_state=False, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                      resources=None, exclude_cpu_bound=False, cpu_bound_percent=DEFAULT_CPU_BOUND_PERCENT, results_dir=None,
+                      outliers=False, exclude_outliers=False, exclude_ips=None, z_threshold=DEFAULT_Z_THRESHOLD):
     client = create_opensearch_client(client_details)
-    documents = get_documents(client, test_execution_id)
+    exclude_ips = exclude_ips or []
+
+    # Flag load generators that were CPU-bound during the round, from the files written by sample-lg-resources.sh
+    load_generators = None
+    excluded_nodes = set()
+    if resources is not None:
+        load_generators = build_load_generator_report(load_resource_summaries(resources, [test_execution_id]), cpu_bound_percent)
+        if exclude_cpu_bound:
+            excluded_nodes = set(load_generators["cpu-bound-nodes"])
+            load_generators["excluded-nodes"] = sorted(excluded_nodes)
+            if excluded_nodes and len(excluded_nodes) == len(load_generators["nodes"]):
+                print("WARNING: every node with resource samples was CPU-bound and is excluded")
 
-    throughput_metrics, service_time_metrics, latency_metrics = filter_results(documents)
+    # Average results
+    throughput_agg = {"min": None, "mean": None, "median": None, "units": "ops/s"}
+    service_time_agg = {"50_0": None, "90_0": None, "99_0": None, "99_9": None, "99_99": None, "100_0": None, "units": "ms"}
+    latency_agg = {"50_0": None, "90_0": None, "99_0": None, "99_9": None, "99_99": None, "100_0": None, "units": "ms"}
+
+    outlier_report = None
+    if server_side and results_dir is not None:
+        raise Exception("--server-side picks the results in the MDS, so it cannot be used with --results-dir")
+    if results_dir is not None:
+        # Parse the results files collected from the instances instead of querying the MDS
+        with span("load_results_dir") as counters:
+            node_results = load_results_dir(results_dir, test_execution_id)
+            counters["nodes"] = len(node_results[0])
+    else:
+        with span("get_documents"):
+            # With server_side the MDS picks the document filter_results would keep, so only one per node and name is downloaded
+            documents = get_latest_results(client, test_execution_id) if server_side else get_documents(client, test_execution_id, cache)
+        # Documents are streamed, so the MDS pages are fetched inside this span
+        with span("filter_results") as counters:
+            node_results = filter_results(documents)
+            counters["nodes"] = len(node_results[0])
+
+    throughput_metrics, service_time_metrics, latency_metrics = [exclude_nodes(metrics, excluded_nodes) for metrics in node_results]
 
     # Create dataframes
     throughput_df = pd.DataFrame.from_dict(throughput_metrics, orient='index')
@@ -33,15 +75,45 @@ def aggregate_results(client_details, output_name, test_execution_id):
     print(tabulate.tabulate(service_time_df, headers='keys', tablefmt='grid', showindex=True))
     print(tabulate.tabulate(latency_df, headers='keys', tablefmt='grid', showindex=True))
 
-    # Average results
-    throughput_agg = {"min": None, "mean": None, "median": None, "units": "ops/s"}
-    service_time_agg = {"50_0": None, "90_0": None, "99_0": None, "99_9": None, "99_99": None, "100_0": None, "units": "ms"}
-    latency_agg = {"50_0": None, "90_0": None, "99_0": None, "99_9": None, "99_99": None, "100_0": None, "units": "ms"}
+    if outliers or exclude_outliers or exclude_ips:
+        # Report the raw averages next to the averages without the outlier nodes and the nodes excluded by IP
+        outlier_report = find_outlier_nodes({THROUGHPUT: throughput_metrics, SERVICE_TIME: service_time_metrics}, get_node_ip_address, z_threshold)
+        outlier_report["raw-averaged-throughput"] = calculate_arithmetic_mean(throughput_metrics, dict(throughput_agg))
+        outlier_report["raw-averaged-service-time"] = calculate_arithmetic_mean(service_time_metrics, dict(service_time_agg))
+        outlier_report["raw-averaged-latency"] = calculate_arithmetic_mean(latency_metrics, dict(latency_agg))
+
+        excluded_outliers = {node for node in throughput_metrics if get_node_ip_address(node) in exclude_ips}
+        if exclude_outliers:
+            excluded_outliers.update(outlier["node"] for outlier in outlier_report["outlier-nodes"])
+        outlier_report["excluded-nodes"] = [{"node": node, "ip": get_node_ip_address(node)} for node in sorted(excluded_outliers)]
+        excluded_nodes = excluded_nodes | excluded_outliers
+        throughput_metrics, service_time_metrics, latency_metrics = [exclude_nodes(metrics, excluded_nodes) for metrics in [throughput_metrics, service_time_metrics, latency_metrics]]
 
     populated_throughput_agg = calculate_arithmetic_mean(throughput_metrics, throughput_agg)
     populated_service_time_agg = calculate_arithmetic_mean(service_time_metrics, service_time_agg)
     populated_latency_agg = calculate_arithmetic_mean(latency_metrics, latency_agg)
     print(f"Throughput Metrics: {len(throughput_metrics)}, Service Time Metrics: {len(service_time_metrics)}, Latency Metrics: {len(latency_metrics)}")
+
+    sketches = {}
+    if histograms:
+        # Replace the averaged percentiles with true fleet-wide percentiles from the merged raw samples of every node
+        with span("get_sketches"):
+            node_sketches = get_sketches(client, test_execution_id)
+        sketches[SERVICE_TIME] = merge_sketches(exclude_nodes(node_sketches[SERVICE_TIME], excluded_nodes).values())
+        sketches[LATENCY] = merge_sketches(exclude_nodes(node_sketches[LATENCY], excluded_nodes).values())
+        populated_service_time_agg = calculate_percentiles(sketches[SERVICE_TIME], service_time_agg)
+        populated_latency_agg = calculate_percentiles(sketches[LATENCY], latency_agg)
+        print(f"Service Time Samples: {sketches[SERVICE_TIME].count}, Latency Samples: {sketches[LATENCY].count}")
+
+    steady_state_window = None
+    if steady_state:
+        # Replace the node summaries with throughput over the window in which every node was generating load
+        with span("get_request_counts"):
+            request_counts = get_request_counts(client, test_execution_id, bucket_seconds)
+        request_counts = request_counts[~request_counts["node"].isin(excluded_nodes)]
+        populated_throughput_agg, steady_state_window = calculate_steady_state_throughput(request_counts, bucket_seconds)
+        print(f"Steady-state window: {steady_state_window['window-seconds']}s, trimmed {steady_state_window['trimmed-start-seconds']}s at the start and {steady_state_window['trimmed-end-seconds']}s at the end")
+
     print(populated_throughput_agg)
     print(populated_service_time_agg)
     print(populated_latency_agg)
@@ -56,6 +128,16 @@ def aggregate_results(client_details, output_name, test_execution_id):
         "averaged-service-time": populated_service_time_agg,
         "averaged-latency": populated_latency_agg
     }
+    if steady_state:
+        averaged_results_from_nodes["steady-state-window"] = steady_state_window
+    if load_generators is not None:
+        averaged_results_from_nodes["load-generators"] = load_generators
+    if outlier_report is not None:
+        averaged_results_from_nodes["outliers"] = outlier_report
+    # Keep the merged sketches so aggregate-rounds-results.py can merge them across rounds
+    if histograms:
+        averaged_results_from_nodes["service-time-sketch"] = sketches[SERVICE_TIME].to_dict()
+        averaged_results_from_nodes["latency-sketch"] = sketches[LATENCY].to_dict()
 
     new_output_name = ""
     if output_name[-1] == "*":
@@ -66,6 +148,9 @@ def aggregate_results(client_details, output_name, test_execution_id):
     write_to_file(averaged_results_from_nodes, new_output_name)
     print("Wrote to file: ", new_output_name)
 
+def exclude_nodes(nodes, excluded_nodes):
+    return {node: value for node, value in nodes.items() if node not in excluded_nodes}
+
 def filter_results(documents):
     throughput = {}
     service_time = {}
@@ -82,108 +167,42 @@ def filter_results(documents):
         value["operation"] = operation
 
         if document_name == THROUGHPUT:
-            throughput[document_id] = value
+            keep_last_operation(throughput, document_id, value)
         elif document_name == SERVICE_TIME:
-            service_time[document_id] = value
+            keep_last_operation(service_time, document_id, value)
         elif document_name == LATENCY:
-            latency[document_id] = value
+            keep_last_operation(latency, document_id, value)
 
     return throughput, service_time, latency
 
-# TODO: Need to address this and add to README
-# session = boto3.Session(
-#     aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-#     aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-#     region_name=os.getenv('AWS_REGION')
-# )
-
-# credentials = boto3.Session().get_credentials()
-# auth = AWSV4SignerAuth(credentials, region)
-def create_opensearch_client(client_details):
-    client = OpenSearch(
-        hosts = [f'{host}:{port}'],
-        http_auth = (username, password),
-        use_ssl = True,
-        verify_certs = True,
-        connection_class = RequestsHttpConnection
-    )
-    return client
-
-def get_documents(client, test_execution_id):
-    INDEX_PATTERN = 'benchmark-results-*'
-    SIZE = 10000
-
-    query = {
-        "query": {
-            "terms": {
-                "name": ["throughput", "service_time", "latency"]
-            }
-        }
-    }
+# Documents are streamed in no particular order, so when a node has one document per operation the one of the last
+# operation by name is kept. get_latest_results picks the same one in the MDS.
+def keep_last_operation(results, document_id, value):
+    if document_id not in results or value["operation"] >= results[document_id]["operation"]:
+        results[document_id] = value
 
-    if test_execution_id != None and len(test_execution_id) > 0:
-        # For regex patterns
-        if "*" in test_execution_id:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "terms": {
-                                    "name": ["throughput", "service_time", "latency"]
-                                }
-                            },
-                            {
-                                "wildcard": {
-                                    "test-execution-id": test_execution_id
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-        else:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "terms": {
-                                    "name": ["throughput", "service_time", "latency"]
-                                }
-                            },
-                            {
-                                "term": {
-                                    "test-execution-id": test_execution_id
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-
-
-    query_response = client.search(body=query, index=INDEX_PATTERN, size=SIZE)
-    # print(query_response)
-    print("Number of documents returned: ", query_response['hits']['total']['value'])
-    documents = query_response['hits']['hits']
-
-    return documents
+def get_documents(client, test_execution_id, cache=None):
+    query = build_results_query(test_execution_id)
+    if cache is not None:
+        return cache.get_documents(client, query, label=test_execution_id)
 
-def calculate_arithmetic_mean(nodes, metrics_to_average):
+    # Streams every matching document instead of stopping at the first 10,000 hits
+    return DocumentStream(client, query, label=test_execution_id)
 
-    for metric in metrics_to_average:
-        if metric == "test-pattern" or metric == "units":
-            continue
+def calculate_arithmetic_mean(nodes, metrics_to_average):
+    with span("calculate_arithmetic_mean", nodes=len(nodes)):
+        for metric in metrics_to_average:
+            if metric == "test-pattern" or metric == "units":
+                continue
 
-        try:
-            metrics_from_nodes = [nodes[node][metric] for node in nodes]
-            metric_mean = statistics.mean(metrics_from_nodes)
-            # calculate_relative_stdev(metrics_from_nodes, metric_mean)
-            metrics_to_average[metric] = metric_mean
-        except:
-            print("Error. Unable to get this metric: ", metric)
-            continue
+            try:
+                metrics_from_nodes = [nodes[node][metric] for node in nodes]
+                metric_mean = statistics.mean(metrics_from_nodes)
+                # calculate_relative_stdev(metrics_from_nodes, metric_mean)
+                metrics_to_average[metric] = metric_mean
+            except:
+                print("Error. Unable to get this metric: ", metric)
+                continue
 
 
     return metrics_to_average
@@ -193,8 +212,9 @@ def calculate_relative_stdev(metrics_from_nodes, metric_average):
     return np.round(stdev / metric_average, decimals=2)
 
 def get_node_ip_address(document_id):
-    # Define the regular expression pattern
-    pattern = r'-(\d+\.\d+\.\d+\.\d+)-'
+    # run-osb-with-term.sh ends test-execution-ids with the IP (older ids had a uuid after it), and so do the
+    # node ids taken from <test-execution-id>.results file names with --results-dir
+    pattern = r'-(\d+\.\d+\.\d+\.\d+)(?:-|$)'
 
     # Search for the pattern in the string
     match = re.search(pattern, document_id)
@@ -206,30 +226,41 @@ def get_node_ip_address(document_id):
         raise Exception("No IP Address found")
 
 def write_to_file(averaged_results_from_nodes, file_name):
-    formatted_averaged_results_from_nodes = json.dumps(averaged_results_from_nodes, indent=4)
+    with span("write_to_file") as counters:
+        formatted_averaged_results_from_nodes = json.dumps(averaged_results_from_nodes, indent=4)
+        counters["bytes"] = len(formatted_averaged_results_from_nodes)
 
-    with open(file_name, "w") as output_json:
-        print(formatted_averaged_results_from_nodes, file=output_json)
+        with open(file_name, "w") as output_json:
+            print(formatted_averaged_results_from_nodes, file=output_json)
+
+def comma_separated_list(input: str):
+    return input.split(',')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Aggregate Results from Nodes from MDS')
     parser.add_argument('--output-name', '-n', required=True, help="Output filename to use")
     parser.add_argument('--id', '-i', required=True, help='Test-execution-id or test-execution-id pattern for specific documents.')
+    parser.add_argument('--server-side', '-s', action='store_true', help='Have the MDS pick the results document of every node with an aggregation instead of downloading every document. Default: False')
+    parser.add_argument('--cache', action='store_true', help='Keep fetched documents in a local cache and only fetch runs that are new or were still in progress. Default: False')
+    parser.add_argument('--offline', action='store_true', help='Only use documents from the local cache without contacting the MDS. Default: False')
+    parser.add_argument('--histograms', action='store_true', help='Report service time and latency percentiles from merged per-node histograms of the raw samples instead of averaging each node\'s percentiles. Default: False')
+    parser.add_argument('--steady-state', action='store_true', help='Report throughput only over the window in which every node was generating load, from per-sample timestamps. Default: False')
+    parser.add_argument('--bucket-seconds', type=int, default=DEFAULT_BUCKET_SECONDS, help=f'Width of the time buckets used with --steady-state. Default: {DEFAULT_BUCKET_SECONDS}')
+    parser.add_argument('--resources', help='Folder of <test-execution-id>.resources.csv files from sample-lg-resources.sh. Flags the load generators that were CPU-bound in the output. Default: none')
+    parser.add_argument('--exclude-cpu-bound', action='store_true', help='Leave the CPU-bound load generators found with --resources out of the averages. Default: False')
+    parser.add_argument('--cpu-bound-percent', type=float, default=DEFAULT_CPU_BOUND_PERCENT, help=f'Mean CPU busy percent from which a load generator counts as CPU-bound. Default: {DEFAULT_CPU_BOUND_PERCENT}')
+    parser.add_argument('--results-dir', help='Folder of <test-execution-id>.results files from collect-nodes-results.py to average instead of the MDS documents. Default: none')
+    parser.add_argument('--outliers', action='store_true', help='Report nodes whose throughput or p99 service time is an outlier by modified z-score, along with the averages of all nodes. Default: False')
+    parser.add_argument('--exclude-outliers', action='store_true', help='Leave the outlier nodes out of the averages. Implies --outliers. Default: False')
+    parser.add_argument('--exclude-ips', type=comma_separated_list, default=None, help='Comma-separated IPs of nodes to leave out of the averages. Implies --outliers. Default: none')
+    parser.add_argument('--z-threshold', type=float, default=DEFAULT_Z_THRESHOLD, help=f'Modified z-score above which a node is an outlier. Default: {DEFAULT_Z_THRESHOLD}')
+    add_tracing_arguments(parser)
     args = parser.parse_args()
 
-    load_dotenv()
-    host = os.getenv('MDS')
-    port = 443
-    region = os.getenv('AWS_REGION')
-    username = os.getenv('MDS_USERNAME')
-    password = os.getenv('MDS_PASSWORD')
-
-    client_details = {
-        "host": os.getenv('MDS'),
-        "port": 443,
-        "region": os.getenv('AWS_REGION'),
-        "username": os.getenv('MDS_USERNAME'),
-        "password": os.getenv('MDS_PASSWORD')
-    }
+    client_details = load_client_details()
 
-    aggregate_results(client_details, args.output_name, args.id)
+    cache = ResultCache(offline=args.offline) if args.cache or args.offline else None
+    with trace_run("aggregate-nodes-results", args.trace, args.profile):
+        aggregate_results(client_details, args.output_name, args.id, args.server_side, cache, args.histograms, args.steady_state, args.bucket_seconds,
+                          args.resources, args.exclude_cpu_bound, args.cpu_bound_percent, args.results_dir,
+                          args.outliers, args.exclude_outliers, args.exclude_ips, args.z_threshold)
@@ -8,14 +8,14 @@ from dataclasses import asdict
 
 import pandas as pd
 import tabulate
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, exceptions
-import boto3
-from dotenv import load_dotenv
 
-from config import TestResult, AveragedThroughput, AveragedServiceTime, AveragedLatency
+from clients import load_client_details, create_opensearch_client
+from config import TestResult, AveragedServiceTime, AveragedLatency, summarize_rounds, build_averaged_classes
+from histogram import LatencySketch, build_percentiles_from_sketches
+from tracing import span, trace_run, add_tracing_arguments
 
 
-def aggregate_rounds_results(client_details: dict, folder_path: str, output_name: str):
+def aggregate_rounds_results(client_details: dict, folder_path: str, output_name: str, histograms: bool = False):
     # Client Creation
     client = create_opensearch_client(client_details)
 
@@ -23,143 +23,51 @@ def aggregate_rounds_results(client_details: dict, folder_path: str, output_name
     all_results = []
 
     # Read the files in the folder and load them into memory
-    for file_name in file_paths:
-        result_dict = get_data(file_name)
-        all_results.append(result_dict)
+    with span("get_data", files=len(file_paths)):
+        for file_name in file_paths:
+            result_dict = get_data(file_name)
+            all_results.append(result_dict)
 
     total_rounds = len(all_results)
     unique_test_ids = [result["test-pattern"] for result in all_results]
-    # Get average throughput from all rounds
-    average_throughput_class = build_average_throughput_class(all_results)
-    # print(asdict(average_throughput_class))
-    # Get average service time from all rounds
-    average_service_time_class = build_average_service_time_class(all_results)
-    # print(asdict(average_service_time_class))
-    # Get average latency form all rounds
-    average_latency_class = build_average_latency_class(all_results)
-    # print(asdict(average_latency_class))
+    # Get average throughput, service time and latency from all rounds in one pass
+    with span("build_averaged_classes", rounds=total_rounds):
+        summary = summarize_rounds(
+            [result["averaged-throughput"] for result in all_results],
+            [result["averaged-service-time"] for result in all_results],
+            [result["averaged-latency"] for result in all_results]
+        )
+        average_throughput_class, average_service_time_class, average_latency_class = build_averaged_classes(summary.iloc[0])
+
+    if histograms:
+        # Get service time and latency percentiles from the sketches of all rounds merged together
+        average_service_time_class = build_percentile_class_from_sketches(all_results, "service-time-sketch", AveragedServiceTime)
+        average_latency_class = build_percentile_class_from_sketches(all_results, "latency-sketch", AveragedLatency)
 
     # Generate dataclass and save as a json
     test_result = TestResult(unique_test_ids, average_throughput_class, average_service_time_class, average_latency_class)
     test_result_dict = asdict(test_result)
     print(test_result_dict)
 
-    with open(f"{output_name}.json", "w") as file:
-        json.dump(test_result_dict, file, indent=4)
+    with span("write_to_file") as counters:
+        formatted_test_result = json.dumps(test_result_dict, indent=4)
+        counters["bytes"] = len(formatted_test_result)
+        with open(f"{output_name}.json", "w") as file:
+            file.write(formatted_test_result)
 
     print(f"Outputted to file called {output_name}.json")
 
 
-def build_average_throughput_class(all_round_results):
-    AVERAGED_THROUGHPUT = "averaged-throughput"
-    MIN = "min"
-    MEAN = "mean"
-    MEDIAN = "median"
-    units = "ops/s"
-
-    cumulative_min = []
-    cumulative_mean = []
-    cumulative_median = []
-
-    for round_result in all_round_results:
-        cumulative_min.append(round_result[AVERAGED_THROUGHPUT][MIN])
-        cumulative_mean.append(round_result[AVERAGED_THROUGHPUT][MEAN])
-        cumulative_median.append(round_result[AVERAGED_THROUGHPUT][MEDIAN])
-
-    avg_min = statistics.mean(cumulative_min)
-    avg_mean = statistics.mean(cumulative_mean)
-    avg_median = statistics.mean(cumulative_median)
-
-    rsd_min = (statistics.stdev(cumulative_min) / avg_min) * 100
-    rsd_mean = (statistics.stdev(cumulative_mean) / avg_mean) * 100
-    rsd_median = (statistics.stdev(cumulative_median) / avg_median) * 100
-
-    # print(cumulative_min, cumulative_mean, cumulative_median)
-    return AveragedThroughput(avg_min, rsd_min, avg_mean, rsd_mean, avg_median, rsd_median, units)
-
-def build_average_service_time_class(all_round_results):
-    AVERAGED_SERVICE_TIME = "averaged-service-time"
-    P50_SERVICE_TIME = "50_0"
-    P90_SERVICE_TIME = "90_0"
-    P99_SERVICE_TIME = "99_0"
-    P99_9_SERVICE_TIME = "99_9"
-    P99_99_SERVICE_TIME = "99_99"
-    P100_SERVICE_TIME = "100_0"
+def build_percentile_class_from_sketches(all_round_results, sketch_key, averaged_class):
     units = "ms"
 
-    cumulative_p50_service_time = []
-    cumulative_p90_service_time = []
-    cumulative_p99_service_time = []
-    cumulative_p99_9_service_time = []
-    cumulative_p99_99_service_time = []
-    cumulative_p100_service_time = []
-
+    sketches = []
     for round_result in all_round_results:
-        cumulative_p50_service_time.append(round_result[AVERAGED_SERVICE_TIME][P50_SERVICE_TIME])
-        cumulative_p90_service_time.append(round_result[AVERAGED_SERVICE_TIME][P90_SERVICE_TIME])
-        cumulative_p99_service_time.append(round_result[AVERAGED_SERVICE_TIME][P99_SERVICE_TIME])
-        cumulative_p99_9_service_time.append(round_result[AVERAGED_SERVICE_TIME][P99_9_SERVICE_TIME])
-        cumulative_p99_99_service_time.append(round_result[AVERAGED_SERVICE_TIME][P99_99_SERVICE_TIME])
-        cumulative_p100_service_time.append(round_result[AVERAGED_SERVICE_TIME][P100_SERVICE_TIME])
-
-    avg_p50_service_time = statistics.mean(cumulative_p50_service_time)
-    avg_p90_service_time = statistics.mean(cumulative_p90_service_time)
-    avg_p99_service_time = statistics.mean(cumulative_p99_service_time)
-    avg_p99_9_service_time = statistics.mean(cumulative_p99_9_service_time)
-    avg_p99_99_service_time = statistics.mean(cumulative_p99_99_service_time)
-    avg_p100_service_time = statistics.mean(cumulative_p100_service_time)
-
-    rsd_p50_service_time = (statistics.stdev(cumulative_p50_service_time) / avg_p50_service_time) * 100
-    rsd_p90_service_time = (statistics.stdev(cumulative_p90_service_time) / avg_p90_service_time) * 100
-    rsd_p99_service_time = (statistics.stdev(cumulative_p99_service_time) / avg_p99_service_time) * 100
-    rsd_p99_9_service_time = (statistics.stdev(cumulative_p99_9_service_time) / avg_p99_9_service_time) * 100
-    rsd_p99_99_service_time = (statistics.stdev(cumulative_p99_99_service_time) / avg_p99_99_service_time) * 100
-    rsd_p100_service_time = (statistics.stdev(cumulative_p100_service_time) / avg_p100_service_time) * 100
-
-    # print(cumulative_p50_service_time, cumulative_p90_service_time)
-    return AveragedServiceTime(avg_p50_service_time, rsd_p50_service_time, avg_p90_service_time, rsd_p90_service_time, avg_p99_service_time, rsd_p99_service_time, avg_p99_9_service_time, rsd_p99_9_service_time, avg_p99_99_service_time, rsd_p99_99_service_time, avg_p100_service_time, rsd_p100_service_time, units)
-
-def build_average_latency_class(all_round_results):
-    AVERAGED_LATENCY = "averaged-latency"
-    P50_LATENCY = "50_0"
-    P90_LATENCY = "90_0"
-    P99_LATENCY = "99_0"
-    P99_9_LATENCY = "99_9"
-    P99_99_LATENCY = "99_99"
-    P100_LATENCY = "100_0"
-    units = "ms"
+        if sketch_key not in round_result:
+            raise Exception(f"Round {round_result['test-pattern']} has no {sketch_key}. Aggregate its nodes with --histograms first.")
+        sketches.append(LatencySketch.from_dict(round_result[sketch_key]))
 
-    cumulative_p50_latency = []
-    cumulative_p90_latency = []
-    cumulative_p99_latency = []
-    cumulative_p99_9_latency = []
-    cumulative_p99_99_latency = []
-    cumulative_p100_latency = []
-
-    for round_result in all_round_results:
-        cumulative_p50_latency.append(round_result[AVERAGED_LATENCY][P50_LATENCY])
-        cumulative_p90_latency.append(round_result[AVERAGED_LATENCY][P90_LATENCY])
-        cumulative_p99_latency.append(round_result[AVERAGED_LATENCY][P99_LATENCY])
-        cumulative_p99_9_latency.append(round_result[AVERAGED_LATENCY][P99_9_LATENCY])
-        cumulative_p99_99_latency.append(round_result[AVERAGED_LATENCY][P99_99_LATENCY])
-        cumulative_p100_latency.append(round_result[AVERAGED_LATENCY][P100_LATENCY])
-
-    avg_p50_latency = statistics.mean(cumulative_p50_latency)
-    avg_p90_latency = statistics.mean(cumulative_p90_latency)
-    avg_p99_latency = statistics.mean(cumulative_p99_latency)
-    avg_p99_9_latency = statistics.mean(cumulative_p99_9_latency)
-    avg_p99_99_latency = statistics.mean(cumulative_p99_99_latency)
-    avg_p100_latency = statistics.mean(cumulative_p100_latency)
-
-    rsd_p50_latency = (statistics.stdev(cumulative_p50_latency) / avg_p50_latency) * 100
-    rsd_p90_latency = (statistics.stdev(cumulative_p90_latency) / avg_p90_latency) * 100
-    rsd_p99_latency = (statistics.stdev(cumulative_p99_latency) / avg_p99_latency) * 100
-    rsd_p99_9_latency = (statistics.stdev(cumulative_p99_9_latency) / avg_p99_9_latency) * 100
-    rsd_p99_99_latency = (statistics.stdev(cumulative_p99_99_latency) / avg_p99_99_latency) * 100
-    rsd_p100_latency = (statistics.stdev(cumulative_p100_latency) / avg_p100_latency) * 100
-
-    # print(cumulative_p50_latency, cumulative_p90_latency)
-    return AveragedLatency(avg_p50_latency, rsd_p50_latency, avg_p90_latency, rsd_p90_latency, avg_p99_latency, rsd_p99_latency, avg_p99_9_latency, rsd_p99_9_latency, avg_p99_99_latency, rsd_p99_99_latency, avg_p100_latency, rsd_p100_latency, units)
+    return averaged_class(*build_percentiles_from_sketches(sketches), units)
 
 
 def get_data(result_file_path: str) -> dict:
@@ -185,35 +93,15 @@ def get_test_execution_file_paths(folder_path: str):
 
     return test_execution_files
 
-def create_opensearch_client(client_details):
-    client = OpenSearch(
-        hosts = [f'{host}:{port}'],
-        http_auth = (username, password),
-        use_ssl = True,
-        verify_certs = True,
-        connection_class = RequestsHttpConnection
-    )
-    return client
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Aggregate Results from Nodes from MDS')
     parser.add_argument('--folder', '-f', required=True, help='Folder of all rounds from autoscaling group tests')
     parser.add_argument('--output-name', '-n', required=True, help="Output filename to use")
+    parser.add_argument('--histograms', action='store_true', help='Merge the service time and latency histograms of every round instead of averaging their percentiles. Rounds must be aggregated with --histograms. Default: False')
+    add_tracing_arguments(parser)
     args = parser.parse_args()
 
-    load_dotenv()
-    host = os.getenv('MDS')
-    port = 443
-    region = os.getenv('AWS_REGION')
-    username = os.getenv('MDS_USERNAME')
-    password = os.getenv('MDS_PASSWORD')
-
-    client_details = {
-        "host": os.getenv('MDS'),
-        "port": 443,
-        "region": os.getenv('AWS_REGION'),
-        "username": os.getenv('MDS_USERNAME'),
-        "password": os.getenv('MDS_PASSWORD')
-    }
-
-    aggregate_rounds_results(client_details, args.folder, args.output_name)
+    client_details = load_client_details()
+
+    with trace_run("aggregate-rounds-results", args.trace, args.profile):
+        aggregate_rounds_results(client_details, args.folder, args.output_name, args.histograms)
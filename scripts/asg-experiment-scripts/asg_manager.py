@@ -1,8 +1,8 @@
 import os
 import argparse
 
-import boto3
-from dotenv import load_dotenv
+from clients import load_environment, get_aws_client
+from tracing import span
 
 # Defaults
 default_launch_config_name = 'osb-big5-term-queries'
@@ -14,36 +14,72 @@ default_desired_capacity = 3
 default_key_name = "hoangia-ee-iad"
 default_security_group = "launch-wizard-53"
 
-def list_asg_instances(ec2_client, autoscaling_client, tags):
-    # ASG API cannot filter based on asg_name, thus we need to use tags
-    # instances = autoscaling_client.describe_auto_scaling_instances()['AutoScalingInstances']
-    # NOTE: As of 8/26/2024, this only lists out autoscaling groups instances with the tag TYPE: OSB_INVESTIGATION
-    # Thus, if we are using two autoscaling groups and both have tag TYPE: OSB_INVESTIGATION on each instance, it will list out instances from both autoscaling groups
-    paginator = autoscaling_client.get_paginator('describe_auto_scaling_instances')
-    instances = []
-    for page in paginator.paginate():
-        instances.extend(page['AutoScalingInstances'])
-
-    # Filter all ASG instances based on tags
-    matched_instances = []
-    for instance in instances:
-        instance_id = instance['InstanceId']
-        instance_tags = {tag['Key']: tag['Value'] for tag in ec2_client.describe_tags(
-            Filters=[{'Name': 'resource-id', 'Values': [instance_id]}]
-        )['Tags']}
+ASG_NAME_TAG = 'aws:autoscaling:groupName'
 
-        if all(instance_tags.get(tag['Key'], None) == tag['Value'] for tag in tags):
-            matched_instances.append(instance_id)
+def list_asg_instances(ec2_client, autoscaling_client, tags, in_service_only=False):
+    with span("list_asg_instances") as counters:
+        instances = describe_asg_instances(ec2_client, autoscaling_client, tags)
+        if in_service_only:
+            instances = [instance for instance in instances if instance['LifecycleState'] == 'InService' and instance['HealthStatus'] == 'Healthy']
+        counters["instances"] = len(instances)
 
+    matched_instances = [instance['InstanceId'] for instance in instances]
     print("Instances to run on: ", matched_instances)
     return matched_instances
 
+def describe_asg_instances(ec2_client, autoscaling_client, tags):
+    # Filters by tag on the server instead of calling describe_tags once per instance. This is one paginated
+    # describe_instances call when tags other than the ASG name are given, plus one paginated
+    # describe_auto_scaling_groups call that returns the lifecycle and health state of every instance.
+    # NOTE: Tags like TYPE: OSB_INVESTIGATION can be on instances of several autoscaling groups, in which case
+    # instances from all of them are listed
+    asg_names = [tag['Value'] for tag in tags if tag['Key'] == ASG_NAME_TAG]
+    other_tags = [tag for tag in tags if tag['Key'] != ASG_NAME_TAG]
+
+    tagged_instance_ids = None
+    if other_tags or not asg_names:
+        filters = [{'Name': f"tag:{tag['Key']}", 'Values': [tag['Value']]} for tag in tags]
+        filters.append({'Name': 'instance-state-name', 'Values': ['pending', 'running']})
+
+        tagged_instance_ids = set()
+        tagged_asg_names = set()
+        paginator = ec2_client.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instance_tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                    if ASG_NAME_TAG in instance_tags:
+                        tagged_instance_ids.add(instance['InstanceId'])
+                        tagged_asg_names.add(instance_tags[ASG_NAME_TAG])
+
+        asg_names = sorted(tagged_asg_names) if not asg_names else asg_names
+        if not asg_names:
+            return []
+
+    instances = []
+    paginator = autoscaling_client.get_paginator('describe_auto_scaling_groups')
+    for page in paginator.paginate(AutoScalingGroupNames=asg_names):
+        for group in page['AutoScalingGroups']:
+            for instance in group['Instances']:
+                if tagged_instance_ids is not None and instance['InstanceId'] not in tagged_instance_ids:
+                    continue
+                instance['AutoScalingGroupName'] = group['AutoScalingGroupName']
+                instances.append(instance)
+
+    states = {}
+    for instance in instances:
+        state = f"{instance['LifecycleState']}/{instance['HealthStatus']}"
+        states[state] = states.get(state, 0) + 1
+    print("Instance states: ", states)
+
+    return instances
+
 def provision_asg(autoscaling_client, asg_name, launch_config_name, instance_type, ami_id, min_size, max_size, desired_capacity, tags, key_name, security_group):
     # Create a launch configuration
     if does_launch_config_exist(autoscaling_client, launch_config_name):
         print("Launch configuraiton already exists. Using existing launch configuration with the same name.")
     else:
-        response_launch_config = autoscaling.create_launch_configuration(
+        response_launch_config = autoscaling_client.create_launch_configuration(
             LaunchConfigurationName=launch_config_name,
             ImageId=ami_id,
             InstanceType=instance_type,
@@ -73,26 +109,29 @@ def provision_asg(autoscaling_client, asg_name, launch_config_name, instance_typ
 
     print("Autoscaling group response: ", response_auto_scaling_group)
 
-def update_asg(autoscaling_client, asg_name, updated_desired_capacity, updated_max_size):
-    if updated_max_size is not None:
-        response = autoscaling_client.update_auto_scaling_group(
-            AutoScalingGroupName=asg_name,
-            MaxSize=updated_max_size,
-            DesiredCapacity=updated_desired_capacity
+def update_asg(autoscaling_client, asg_name, updated_desired_capacity, updated_max_size, updated_min_size=None):
+    # The max and min sizes are only changed when given
+    sizes = {'MaxSize': updated_max_size, 'MinSize': updated_min_size}
+    response = autoscaling_client.update_auto_scaling_group(
+        AutoScalingGroupName=asg_name,
+        DesiredCapacity=updated_desired_capacity,
+        **{key: value for key, value in sizes.items() if value is not None}
     )
-    else:
-        response = autoscaling_client.update_auto_scaling_group(
-            AutoScalingGroupName=asg_name,
-            DesiredCapacity=updated_desired_capacity
-        )
     if response['ResponseMetadata']['HTTPStatusCode'] == 200:
         print(f"Success. Updating autoscaling group to have {updated_desired_capacity} nodes")
     else:
         print("Error: ", response)
 
+def get_asg_sizes(autoscaling_client, asg_name):
+    # Returns (desired capacity, max size, min size), in the order update_asg takes them
+    groups = autoscaling_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])['AutoScalingGroups']
+    if not groups:
+        raise Exception(f"Auto Scaling Group {asg_name} not found")
+    return groups[0]['DesiredCapacity'], groups[0]['MaxSize'], groups[0]['MinSize']
+
 def delete_asg(ec2_client, autoscaling_client, asg_name, launch_config_name):
     # Terminate all instances in the auto scaling group
-    instance_ids = [i['InstanceId'] for i in autoscaling.describe_auto_scaling_instances(AutoScalingGroupName=asg_name)['AutoScalingInstances']]
+    instance_ids = [i['InstanceId'] for i in autoscaling_client.describe_auto_scaling_instances(AutoScalingGroupName=asg_name)['AutoScalingInstances']]
     if instance_ids:
         ec2_client.terminate_instances(InstanceIds=instance_ids)
 
@@ -119,17 +158,6 @@ def does_launch_config_exist(autoscaling_client, launch_config_name):
             raise e
 
 if __name__ == '__main__':
-    load_dotenv()
-
-    # Create clients for Auto Scaling and EC2
-    session = boto3.Session(
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION')
-    )
-    autoscaling = session.client('autoscaling')
-    ec2 = session.client('ec2')
-
     tags = [
         {
             'Key': 'TYPE',
@@ -158,6 +186,7 @@ if __name__ == '__main__':
     scale_parser.add_argument('--asg-name', '-n', required=True, help='Auto Scaling Group Name')
     scale_parser.add_argument('--updated-desired-capacity', '-c', type=int, required=True, help='Updated Desired Capacity')
     scale_parser.add_argument('--updated-max-size', '-max', type=int, default=None, help='Updated max size of auto scaling group')
+    scale_parser.add_argument('--updated-min-size', '-min', type=int, default=None, help='Updated min size of auto scaling group')
 
     # delete-asg command
     delete_parser = subparsers.add_parser('delete', help='Delete an Auto Scaling Group')
@@ -168,10 +197,15 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    # Create clients for Auto Scaling and EC2
+    load_environment()
+    autoscaling = get_aws_client('autoscaling')
+    ec2 = get_aws_client('ec2')
+
     if args.command == 'create':
         provision_asg(autoscaling, args.asg_name, args.launch_config_name, args.instance_type, args.ami_id, args.min_size, args.max_size, args.desired_capacity, tags, args.key_name, args.security_group)
     elif args.command == 'update':
-        update_asg(autoscaling, args.asg_name, args.updated_desired_capacity, args.updated_max_size)
+        update_asg(autoscaling, args.asg_name, args.updated_desired_capacity, args.updated_max_size, args.updated_min_size)
     elif args.command == 'delete':
         delete_asg(ec2, autoscaling, args.asg_name, args.launch_config_name)
     elif args.command == "list-instances":
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import importlib.util
+
+import pandas as pd
+import tabulate
+
+from synthetic_results import write_documents, get_round_id, DEFAULT_OPERATIONS, DEFAULT_ROUNDS, DEFAULT_SAMPLES_PER_NODE, DEFAULT_PREFIX
+
+ASG_DIR = os.path.dirname(os.path.abspath(__file__))
+LG_HOST_DIR = os.path.join(os.path.dirname(ASG_DIR), "lg-host-experiment-scripts")
+DEFAULT_SIZES = "10,100,1000,10000"
+
+# Time and memory-profile every aggregation path against FakeMDS at increasing node counts. Every case runs in
+# its own process, so its peak memory is not mixed up with the other cases, and the script folders (which have
+# modules with the same names) never share an interpreter.
+def run_benchmarks(sizes, cases, work_dir, operations, rounds, samples_per_node, trace_memory, output_name=None):
+    os.makedirs(work_dir, exist_ok=True)
+    rows = []
+    for nodes in sizes:
+        data_path = os.path.join(work_dir, f"synthetic-{nodes}-{operations}-{rounds}-{samples_per_node}.jsonl.gz")
+        if not os.path.exists(data_path):
+            write_documents(data_path, nodes, operations, rounds, samples_per_node)
+
+        for case in cases:
+            print(f"Running {case} with {nodes} nodes")
+            command = [sys.executable, os.path.abspath(__file__), "--run-case", case, "--data", data_path, "--nodes", str(nodes),
+                       "--work-dir", os.path.join(work_dir, f"{case}-{nodes}"), "--rounds", str(rounds)]
+            if trace_memory:
+                command.append("--tracemalloc")
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{case} with {nodes} nodes failed: ", completed.stderr.strip().splitlines()[-1:] or completed.returncode)
+                rows.append({"case": case, "nodes": nodes, "error": completed.stderr.strip().splitlines()[-1:]})
+                continue
+            rows.append({"case": case, "nodes": nodes, **json.loads(completed.stdout.strip().splitlines()[-1])})
+
+    results = pd.DataFrame(rows)
+    print(tabulate.tabulate(results, headers='keys', tablefmt='grid', showindex=False))
+    if output_name is not None:
+        results.to_csv(f"{output_name}.csv", index=False)
+        print(f"Outputted to {output_name}.csv")
+    return results
+
+def run_case(case, data_path, nodes, work_dir, rounds, trace_memory):
+    # Runs in the child process. Prints one JSON line with the measurements of the case.
+    script_dir = LG_HOST_DIR if case.startswith("lg-host") else ASG_DIR
+    sys.path[:0] = [script_dir, ASG_DIR]
+    from fake_mds import FakeMDS
+
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    load_start = time.perf_counter()
+    mds = FakeMDS.from_file(data_path)
+    load_seconds = time.perf_counter() - load_start
+    baseline_rss = get_max_rss_mb()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        benchmark = CASES[case](script_dir, mds, nodes, rounds)
+        searches = mds.searches
+        if trace_memory:
+            tracemalloc.start()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        benchmark()
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else None
+
+    print(json.dumps({
+        "seconds": round(seconds, 4),
+        "cpu-seconds": round(cpu_seconds, 4),
+        "searches": mds.searches - searches,
+        "peak-traced-mb": None if peak_mb is None else round(peak_mb, 2),
+        "rss-growth-mb": round(get_max_rss_mb() - baseline_rss, 2),
+        "documents": sum(len(documents) for documents in mds.indices.values()),
+        "load-seconds": round(load_seconds, 2)
+    }))
+
+def get_max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def load_script(script_dir, script_name, mds):
+    # Script names have dashes, so they cannot be imported with a regular import statement
+    spec = importlib.util.spec_from_file_location(script_name[:-3].replace("-", "_"), os.path.join(script_dir, script_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Every script creates its client through create_opensearch_client, so that is where FakeMDS is plugged in
+    module.create_opensearch_client = lambda *args, **kwargs: mds
+    return module
+
+def nodes_case(**options):
+    def setup(script_dir, mds, nodes, rounds):
+        module = load_script(script_dir, "aggregate-nodes-results.py", mds)
+        return lambda: module.aggregate_results({}, "nodes", f"{get_round_id(DEFAULT_PREFIX, nodes, 1)}-*", **options)
+    return setup
+
+def get_documents_case(script_dir, mds, nodes, rounds):
+    module = load_script(script_dir, "aggregate-nodes-results.py", mds)
+    return lambda: sum(1 for document in module.get_documents(mds, f"{get_round_id(DEFAULT_PREFIX, nodes, 1)}-*"))
+
+def filter_results_case(script_dir, mds, nodes, rounds):
+    module = load_script(script_dir, "aggregate-nodes-results.py", mds)
+    documents = list(module.get_documents(mds, f"{get_round_id(DEFAULT_PREFIX, nodes, 1)}-*"))
+    return lambda: module.filter_results(documents)
+
+def rounds_case(script_dir, mds, nodes, rounds):
+    # The round files are aggregated from the MDS first, then only reading and averaging them is timed
+    nodes_module = load_script(script_dir, "aggregate-nodes-results.py", mds)
+    os.makedirs("rounds", exist_ok=True)
+    for round_number in range(1, rounds + 1):
+        nodes_module.aggregate_results({}, os.path.join("rounds", f"round-{round_number}"), f"{get_round_id(DEFAULT_PREFIX, nodes, round_number)}-*")
+
+    module = load_script(script_dir, "aggregate-rounds-results.py", mds)
+    return lambda: module.aggregate_rounds_results({}, "rounds", "rounds")
+
+def lg_host_case(**options):
+    def setup(script_dir, mds, nodes, rounds):
+        module = load_script(script_dir, "aggregate-lg-host-results.py", mds)
+        return lambda: module.aggregate_rounds_results({}, f"{DEFAULT_PREFIX}-{nodes}-nodes-1-clients-*", "lg-host", **options)
+    return setup
+
+CASES = {
+    "get-documents": get_documents_case,
+    "filter-results": filter_results_case,
+    "nodes": nodes_case(),
+    "nodes-server-side": nodes_case(server_side=True),
+    "nodes-histograms": nodes_case(histograms=True),
+    "nodes-steady-state": nodes_case(steady_state=True),
+    "rounds": rounds_case,
+    "lg-host": lg_host_case(),
+    "lg-host-server-side": lg_host_case(server_side=True),
+    "lg-host-histograms": lg_host_case(histograms=True)
+}
+
+def comma_separated_ints(input: str):
+    return [int(value) for value in input.split(',')]
+
+def comma_separated_cases(input: str):
+    cases = input.split(',')
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown cases {unknown}. Choose from {list(CASES)}")
+    return cases
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the aggregation scripts against a local fake MDS with synthetic results')
+    parser.add_argument('--sizes', '-s', type=comma_separated_ints, default=DEFAULT_SIZES, help=f'Comma-separated node counts to benchmark. Default: {DEFAULT_SIZES}')
+    parser.add_argument('--cases', '-c', type=comma_separated_cases, default=list(CASES), help=f'Comma-separated aggregation paths to benchmark. Default: {",".join(CASES)}')
+    parser.add_argument('--work-dir', '-d', default=os.path.join(tempfile.gettempdir(), "osb-aggregation-benchmark"), help='Folder for the synthetic documents and the outputs of every case. Synthetic documents there are reused. Default: a folder in the temp directory')
+    parser.add_argument('--operations', type=int, default=DEFAULT_OPERATIONS, help=f'Operations of every node. Default: {DEFAULT_OPERATIONS}')
+    parser.add_argument('--rounds', '-r', type=int, default=DEFAULT_ROUNDS, help=f'Rounds of every configuration. Default: {DEFAULT_ROUNDS}')
+    parser.add_argument('--samples-per-node', type=int, default=DEFAULT_SAMPLES_PER_NODE, help=f'Raw samples of every node for the histogram and steady-state cases. Default: {DEFAULT_SAMPLES_PER_NODE}')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also record the peak of Python allocations, which slows every case down. Default: False')
+    parser.add_argument('--output-name', '-n', help='Write the measurements to <output-name>.csv. Default: none')
+    # Used by the child process of every case
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    parser.add_argument('--nodes', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.data, args.nodes, args.work_dir, args.rounds, args.tracemalloc)
+    else:
+        run_benchmarks(args.sizes, args.cases, args.work_dir, args.operations, args.rounds, args.samples_per_node, args.tracemalloc, args.output_name)
@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from tracing import span, count
+
+MDS_PORT = 443
+# botocore's adaptive retry mode backs off on throttling errors and also slows down the sending of requests of a
+# client that is being throttled
+AWS_RETRY_MODE = "adaptive"
+AWS_MAX_ATTEMPTS = 10
+# (service, operation): (requests per second, burst). The service on its own covers its other operations. These
+# stay below the default API rate limits of an account (EC2 refills non-mutating actions at 20/s, SSM throttles
+# SendCommand well before that), so fanning out over a fleet runs as fast as it can without being throttled.
+AWS_RATE_LIMITS = {
+    ("ec2", None): (20, 50),
+    ("autoscaling", None): (10, 20),
+    ("ssm", None): (10, 20),
+    ("ssm", "SendCommand"): (3, 5),
+    ("ssm", "ListCommandInvocations"): (5, 10),
+    ("s3", None): (100, 200)
+}
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'Throttling', 'TooManyUpdates', 'RequestLimitExceeded']
+# Calls, retries, throttled attempts and errors of every AWS client in the process
+AWS_COUNTERS = Counter()
+AWS_COUNTERS_LOCK = threading.Lock()
+
+# Clients are built from .env the first time they are needed and reused after that. boto3 and opensearchpy are
+# imported inside the functions, so scripts (and osb-experiments.py subcommands) that never talk to AWS or the
+# MDS do not pay for importing them.
+@lru_cache(maxsize=None)
+def load_environment():
+    load_dotenv()
+
+def load_client_details():
+    load_environment()
+    return {
+        "host": os.getenv('MDS'),
+        "port": MDS_PORT,
+        "region": os.getenv('AWS_REGION'),
+        "username": os.getenv('MDS_USERNAME'),
+        "password": os.getenv('MDS_PASSWORD')
+    }
+
+def create_opensearch_client(client_details, pool_maxsize=None):
+    from opensearchpy import OpenSearch
+
+    options = {}
+    if pool_maxsize is not None:
+        # One pooled connection per concurrent fetch
+        options["pool_maxsize"] = pool_maxsize
+
+    client = OpenSearch(
+        hosts = [f"{client_details['host']}:{client_details['port']}"],
+        http_auth = (client_details['username'], client_details['password']),
+        use_ssl = True,
+        verify_certs = True,
+        connection_class = get_traced_connection_class(),
+        **options
+    )
+    return client
+
+@lru_cache(maxsize=None)
+def get_traced_connection_class():
+    # Times every MDS request and counts the bytes of its response. Decoding the JSON happens after this, so it
+    # shows up as the rest of the span the request is made in.
+    from opensearchpy import RequestsHttpConnection
+
+    class TracedConnection(RequestsHttpConnection):
+        def perform_request(self, method, url, *args, **kwargs):
+            with span("mds.request", method=method, url=url) as counters:
+                status, headers, data = super().perform_request(method, url, *args, **kwargs)
+                counters["bytes"] = len(data or "")
+            count(mds_requests=1, mds_bytes=len(data or ""))
+            return status, headers, data
+
+    return TracedConnection
+
+@lru_cache(maxsize=None)
+def get_aws_session():
+    import boto3
+
+    load_environment()
+    return boto3.Session(
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION')
+    )
+
+class TokenBucket:
+    '''
+    Lets through rate requests per second on average and up to burst at once. acquire() blocks until a token is
+    free. One bucket is shared by every thread, since the API limits are per account and region, not per client.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+@lru_cache(maxsize=None)
+def get_token_bucket(service_name, operation_name):
+    key = (service_name, operation_name) if (service_name, operation_name) in AWS_RATE_LIMITS else (service_name, None)
+    if key not in AWS_RATE_LIMITS:
+        return None
+    # Operations without a limit of their own share the bucket of their service
+    return TokenBucket(*AWS_RATE_LIMITS[key]) if key[1] == operation_name else get_token_bucket(service_name, None)
+
+@lru_cache(maxsize=None)
+def get_aws_client(service_name, endpoint_url=None):
+    # Clients are thread-safe, so every thread and script in the process shares one client per service
+    from botocore.config import Config
+
+    client = get_aws_session().client(
+        service_name,
+        endpoint_url=endpoint_url,
+        config=Config(retries={"mode": AWS_RETRY_MODE, "total_max_attempts": AWS_MAX_ATTEMPTS})
+    )
+    events = client.meta.events
+    event_name = client.meta.service_model.service_id.hyphenize()
+    events.register(f"before-call.{event_name}", lambda model, **kwargs: wait_for_rate_limit(service_name, model.name))
+    events.register(f"needs-retry.{event_name}", count_throttled_attempt)
+    events.register(f"after-call.{event_name}", count_call)
+    events.register(f"after-call-error.{event_name}", count_error)
+    return client
+
+def wait_for_rate_limit(service_name, operation_name):
+    bucket = get_token_bucket(service_name, operation_name)
+    if bucket is not None:
+        bucket.acquire()
+
+def count_throttled_attempt(response=None, **kwargs):
+    # response is (http response, parsed response), or None when the request failed without one
+    if response is not None and response[1].get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+        count_aws(api_throttles=1)
+
+def count_call(http_response, parsed, **kwargs):
+    # Sent after the last attempt, also when it failed with an error response
+    count_aws(api_calls=1, api_retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0), api_errors=int(http_response.status_code >= 300))
+
+def count_error(exception, **kwargs):
+    # Sent instead of after-call when no response came back, e.g. a connection error
+    count_aws(api_calls=1, api_errors=1)
+
+def count_aws(**counters):
+    with AWS_COUNTERS_LOCK:
+        AWS_COUNTERS.update(counters)
+    count(**counters)
+
+def print_aws_counters():
+    if AWS_COUNTERS:
+        print("AWS API " + ", ".join(f"{counter[4:]}: {AWS_COUNTERS[counter]}" for counter in ["api_calls", "api_retries", "api_throttles", "api_errors"]))
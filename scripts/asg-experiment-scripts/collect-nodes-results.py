@@ -0,0 +1,137 @@
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import load_environment, get_aws_client, print_aws_counters
+from asg_manager import list_asg_instances
+from ssm_commands import send_command_to_batches, wait_for_commands, get_invocation_outputs, DEFAULT_MAX_WORKERS, SUCCESS
+from results_files import RESULTS_SUFFIX
+from lg_resources import RESOURCES_SUFFIX
+from tracing import span, trace_run, add_tracing_arguments
+
+DEFAULT_WAIT_TIMEOUT_SECONDS = 300
+DEFAULT_S3_PREFIX = "osb-results"
+FILE_MARKER = "==> "
+# Only these lines of a results file are needed, which keeps the output of every node under what SSM returns inline
+RESULT_LINES = "Throughput|percentile"
+
+# Fetch the --results-file of every node in a round straight from the instances, so the round can be aggregated
+# with aggregate-nodes-results.py --results-dir without the MDS. SSM returns at most 2500 characters of output per
+# instance, so inline output only has the throughput and percentile lines. With an S3 bucket the full files are
+# written there by SSM and fetched in parallel, which also covers the samples of sample-lg-resources.sh.
+def collect_nodes_results(instance_ids, test_execution_id, output_dir, max_workers=DEFAULT_MAX_WORKERS,
+                          wait_timeout=DEFAULT_WAIT_TIMEOUT_SECONDS, s3_bucket=None, s3_prefix=DEFAULT_S3_PREFIX,
+                          s3_endpoint_url=None, resources=False):
+    if resources and s3_bucket is None:
+        raise Exception("Resource samples are too large for inline SSM output. Collect them with --s3-bucket.")
+
+    ssm_client = get_aws_client('ssm')
+    shell_script_commands = build_collect_commands(test_execution_id, full_files=s3_bucket is not None, resources=resources)
+    send_command_kwargs = {}
+    if s3_bucket is not None:
+        send_command_kwargs = {'OutputS3BucketName': s3_bucket, 'OutputS3KeyPrefix': s3_prefix}
+
+    commands = send_command_to_batches(ssm_client, instance_ids, shell_script_commands, "Collect osb results files from ASG instances", max_workers, **send_command_kwargs)
+    statuses = wait_for_commands(ssm_client, commands, wait_timeout)
+
+    if s3_bucket is None:
+        outputs = get_invocation_outputs(ssm_client, commands)
+    else:
+        s3_client = get_aws_client('s3', s3_endpoint_url)
+        outputs = get_s3_outputs(s3_client, s3_bucket, s3_prefix, commands, statuses, max_workers)
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = 0
+    for instance_id, output in outputs.items():
+        files = split_output(output)
+        if not files:
+            print(f"No results files for {test_execution_id} on {instance_id}")
+        for file_name, content in files.items():
+            with open(os.path.join(output_dir, file_name), "w") as output_file:
+                output_file.write(content)
+            written += 1
+
+    print(f"Wrote {written} files from {len(outputs)} instances to {output_dir}")
+
+def build_collect_commands(test_execution_id, full_files=False, resources=False):
+    # Prints every file of the round on the node after a "==> <name>" line. Results files are named after the
+    # node's test-execution-id and saved locally as <test-execution-id>.results.
+    read_results = 'cat "$f"' if full_files else f'grep -E "{RESULT_LINES}" "$f" | tr -s " "'
+    read_resources = f'echo "{FILE_MARKER}$(basename "$f")"; cat "$f"' if resources else 'true'
+    return [
+        '#!/bin/bash',
+        f'for f in /home/ec2-user/{test_execution_id}-*; do',
+        '    [ -f "$f" ] || continue',
+        '    case "$f" in',
+        f'        *{RESOURCES_SUFFIX}) {read_resources} ;;',
+        '        *.start-offset) ;;',
+        f'        *) echo "{FILE_MARKER}$(basename "$f"){RESULTS_SUFFIX}"; {read_results} ;;',
+        '    esac',
+        'done',
+        ''
+    ]
+
+def split_output(output):
+    # Returns {file name: content} from the output of build_collect_commands
+    files = {}
+    file_name = None
+    for line in output.splitlines(keepends=True):
+        if line.startswith(FILE_MARKER):
+            file_name = os.path.basename(line[len(FILE_MARKER):].strip())
+            files[file_name] = ""
+        elif file_name is not None:
+            files[file_name] += line
+    return files
+
+def get_s3_outputs(s3_client, bucket, prefix, commands, statuses, max_workers=DEFAULT_MAX_WORKERS):
+    # SSM writes the stdout of every instance to <prefix>/<command id>/<instance id>/awsrunShellScript/0.awsrunShellScript/stdout
+    keys = {
+        instance_id: f"{prefix}/{command_id}/{instance_id}/awsrunShellScript/0.awsrunShellScript/stdout"
+        for command_id, batch in commands.items() for instance_id in batch if statuses.get(instance_id) == SUCCESS
+    }
+
+    def get_output(instance_id):
+        with span("s3.get_object") as counters:
+            try:
+                response = s3_client.get_object(Bucket=bucket, Key=keys[instance_id])
+                output = response['Body'].read().decode()
+                counters["bytes"] = len(output)
+                counters["api_retries"] = response['ResponseMetadata'].get('RetryAttempts', 0)
+                return instance_id, output
+            except s3_client.exceptions.NoSuchKey:
+                # No output is written when the command printed nothing
+                return instance_id, ""
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(get_output, sorted(keys)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collect the OSB results files of a round from every ASG instance')
+    parser.add_argument('--id', '-i', required=True, help='Test-execution-id the round was run with in run-osb-on-asg.py')
+    parser.add_argument('--output-dir', '-o', required=True, help='Folder to write the results files to')
+    parser.add_argument('--max-workers', '-w', type=int, default=DEFAULT_MAX_WORKERS, help=f'Max number of batches of instances to send the command to, and of S3 objects to fetch, at the same time. Default: {DEFAULT_MAX_WORKERS}')
+    parser.add_argument('--wait-timeout', '-t', type=int, default=DEFAULT_WAIT_TIMEOUT_SECONDS, help=f'Seconds to wait for every instance to print its files. Default: {DEFAULT_WAIT_TIMEOUT_SECONDS}')
+    parser.add_argument('--s3-bucket', help='Have SSM write the full output to this bucket instead of returning it inline. Default: none')
+    parser.add_argument('--s3-prefix', default=DEFAULT_S3_PREFIX, help=f'Key prefix of the output in the bucket. Default: {DEFAULT_S3_PREFIX}')
+    parser.add_argument('--s3-endpoint-url', help='Endpoint of an S3-compatible store to read the output from. Default: AWS S3')
+    parser.add_argument('--resources', action='store_true', help='Also collect the <test-execution-id>.resources.csv samples of sample-lg-resources.sh. Requires --s3-bucket. Default: False')
+    add_tracing_arguments(parser)
+    args = parser.parse_args()
+
+    load_environment()
+    ec2 = get_aws_client('ec2')
+    autoscaling = get_aws_client('autoscaling')
+
+    tags = [
+        {
+            'Key': 'aws:autoscaling:groupName',
+            'Value': os.getenv('AUTOSCALING_GROUP_NAME'),
+            'PropagateAtLaunch': True
+        }
+    ]
+    with trace_run("collect-nodes-results", args.trace, args.profile):
+        instance_ids = list_asg_instances(ec2, autoscaling, tags)
+
+        collect_nodes_results(instance_ids, args.id, args.output_dir, args.max_workers, args.wait_timeout,
+                              args.s3_bucket, args.s3_prefix, args.s3_endpoint_url, args.resources)
+    print_aws_counters()
@@ -0,0 +1,66 @@
+import math
+import statistics
+
+DEFAULT_RSD_THRESHOLD = 5.0
+DEFAULT_CI_THRESHOLD = 5.0
+# Two-sided 95% critical values of Student's t distribution by degrees of freedom
+T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+    25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980
+}
+Z_CRITICAL_95 = 1.960
+# Values of a round's -averaged.json that have to be stable before the configuration stops repeating
+CONVERGENCE_METRICS = {
+    "throughput mean": ("averaged-throughput", "mean"),
+    "service time p99": ("averaged-service-time", "99_0"),
+}
+
+def t_critical_95(degrees_of_freedom):
+    # Uses the closest tabulated degrees of freedom below, which slightly overestimates the interval in between
+    tabulated = [df for df in T_CRITICAL_95 if df <= degrees_of_freedom]
+    return T_CRITICAL_95[max(tabulated)] if degrees_of_freedom <= 120 else Z_CRITICAL_95
+
+def summarize_convergence(values):
+    # RSD and half-width of the 95% confidence interval of the mean, both as a percentage of the mean
+    count = len(values)
+    mean = statistics.mean(values)
+    if count < 2 or mean == 0:
+        return {"rounds": count, "mean": mean, "rsd": None, "ci": None}
+
+    stdev = statistics.stdev(values)
+    return {
+        "rounds": count,
+        "mean": mean,
+        "rsd": stdev / mean * 100,
+        "ci": t_critical_95(count - 1) * stdev / math.sqrt(count) / mean * 100
+    }
+
+def check_convergence(round_results, rsd_threshold=DEFAULT_RSD_THRESHOLD, ci_threshold=DEFAULT_CI_THRESHOLD):
+    # Returns whether every metric in CONVERGENCE_METRICS has an RSD and confidence interval under the
+    # thresholds across the rounds so far, along with the summary of each metric
+    summaries = {}
+    converged = True
+    for name, (result_key, metric) in CONVERGENCE_METRICS.items():
+        values = [round_result[result_key][metric] for round_result in round_results if round_result[result_key][metric] is not None]
+        if not values:
+            summaries[name] = None
+            converged = False
+            continue
+
+        summary = summarize_convergence(values)
+        summaries[name] = summary
+        if summary["rsd"] is None or summary["rsd"] > rsd_threshold or summary["ci"] > ci_threshold:
+            converged = False
+
+    return converged, summaries
+
+def print_convergence(label, converged, summaries):
+    print(f"{label}: {'converged' if converged else 'not converged'}")
+    for name, summary in summaries.items():
+        if summary is None:
+            print(f"  {name}: no values")
+        elif summary["rsd"] is None:
+            print(f"  {name}: mean {summary['mean']:.3f} over {summary['rounds']} round")
+        else:
+            print(f"  {name}: mean {summary['mean']:.3f}, RSD {summary['rsd']:.2f}%, 95% CI ±{summary['ci']:.2f}% over {summary['rounds']} rounds")
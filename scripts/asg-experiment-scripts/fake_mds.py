@@ -0,0 +1,297 @@
+import re
+import gzip
+import json
+import bisect
+import fnmatch
+import itertools
+
+# Largest from + size a search without a PIT may ask for, like index.max_result_window
+MAX_RESULT_WINDOW = 10000
+TOTAL_HITS_LIMIT = 10000
+INTERVAL_UNITS_MS = {"ms": 1, "s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000}
+
+class FakeMDS:
+    '''
+    In-process stand-in for the OpenSearch client of the MDS, for running the aggregation scripts against
+    documents written by synthetic_results.py. It implements the subset of the API the scripts use:
+    search with bool/term/terms/wildcard/range queries, _source filtering, sort (and _shard_doc in a PIT) with search_after,
+    track_total_hits, the terms, filter, extended_stats, top_hits and composite (with sub-aggregations) aggregations,
+    and create_pit/delete_pit.
+    The matching and sorted hits of a query are kept until documents are added, so paging through a large
+    result costs one filter and sort instead of one per page.
+    '''
+    def __init__(self):
+        self.indices = {}
+        self.pits = {}
+        self.searches = 0
+        self._next_id = itertools.count()
+        self._matches = {}
+
+    @classmethod
+    def from_file(cls, path):
+        # Reads the JSON lines (optionally gzipped) of synthetic_results.py, one {"_index", "_source"} per line
+        mds = cls()
+        open_file = gzip.open if path.endswith(".gz") else open
+        with open_file(path, "rt") as documents_file:
+            for line in documents_file:
+                document = json.loads(line)
+                mds.index(document["_index"], document["_source"])
+        return mds
+
+    def index(self, index, body, id=None):
+        # The position a document is indexed at stands in for its shard and Lucene doc id in _shard_doc sorts
+        position = next(self._next_id)
+        document_id = id if id is not None else f"{position:012d}"
+        self.indices.setdefault(index, []).append({"_index": index, "_id": document_id, "_shard_doc": position, "_source": body})
+        self._matches = {}
+        return {"_index": index, "_id": document_id, "result": "created"}
+
+    def create_pit(self, index, keep_alive=None, **kwargs):
+        pit_id = f"pit-{len(self.pits)}-{next(self._next_id)}"
+        self.pits[pit_id] = index
+        return {"pit_id": pit_id}
+
+    def delete_pit(self, body=None, **kwargs):
+        pit_ids = (body or {}).get("pit_id", [])
+        for pit_id in pit_ids:
+            self.pits.pop(pit_id, None)
+        return {"pits": [{"pit_id": pit_id, "successful": True} for pit_id in pit_ids]}
+
+    def search(self, body=None, index=None, **kwargs):
+        self.searches += 1
+        body = body or {}
+        if "pit" in body:
+            if body["pit"]["id"] not in self.pits:
+                raise Exception(f"No point in time with id {body['pit']['id']}")
+            index = self.pits[body["pit"]["id"]]
+
+        size = body.get("size", 10)
+        if "pit" not in body and "search_after" not in body and body.get("from", 0) + size > MAX_RESULT_WINDOW:
+            raise Exception(f"Result window is too large, from + size must be less than or equal to {MAX_RESULT_WINDOW}")
+
+        if "pit" not in body and "_shard_doc" in parse_sort(body.get("sort")):
+            raise Exception("Sorting on _shard_doc requires a point in time")
+
+        documents, keys = self._match(index, body.get("query"), body.get("sort"))
+        start = body.get("from", 0)
+        if "search_after" in body:
+            start = bisect.bisect_right(keys, tuple(body["search_after"]))
+
+        hits = []
+        for document, key in zip(documents[start:start + size], keys[start:start + size]):
+            hit = {"_index": document["_index"], "_id": document["_id"], "_source": filter_source(document["_source"], body.get("_source"))}
+            if body.get("sort") is not None:
+                hit["sort"] = list(key)
+            hits.append(hit)
+
+        total = len(documents)
+        track_total_hits = body.get("track_total_hits", TOTAL_HITS_LIMIT)
+        if track_total_hits is True or total <= TOTAL_HITS_LIMIT:
+            total_hits = {"value": total, "relation": "eq"}
+        else:
+            total_hits = {"value": TOTAL_HITS_LIMIT, "relation": "gte"}
+
+        response = {"took": 0, "timed_out": False, "hits": {"total": total_hits, "hits": hits}}
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        if "aggs" in body or "aggregations" in body:
+            response["aggregations"] = run_aggregations(documents, body.get("aggs", body.get("aggregations")))
+        return response
+
+    def _match(self, index, query, sort):
+        cache_key = json.dumps([index, query, sort], sort_keys=True)
+        if cache_key not in self._matches:
+            predicate = compile_query(query)
+            documents = [document for document in self._documents(index) if predicate(document["_source"])]
+            sort_fields = parse_sort(sort)
+            keys = [tuple(get_sort_value(document, field) for field in sort_fields) for document in documents]
+            if sort_fields:
+                order = sorted(range(len(documents)), key=keys.__getitem__)
+                documents = [documents[i] for i in order]
+                keys = [keys[i] for i in order]
+            self._matches[cache_key] = (documents, keys)
+        return self._matches[cache_key]
+
+    def _documents(self, index_pattern):
+        patterns = (index_pattern or "*").split(",")
+        for name, documents in self.indices.items():
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                yield from documents
+
+def get_field(source, field):
+    # Dotted fields (value.mean) are looked up in nested objects
+    if field in source:
+        return source[field]
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def filter_source(source, includes):
+    if includes is None or includes is True:
+        return source
+    if isinstance(includes, dict):
+        includes = includes.get("includes", [])
+    return {field: source[field] for field in includes if field in source}
+
+def compile_query(query):
+    # Returns a predicate on a document's _source
+    if query is None or "match_all" in query:
+        return lambda source: True
+
+    (kind, spec), = query.items()
+    if kind == "bool":
+        must = [compile_query(clause) for clause in as_list(spec.get("must")) + as_list(spec.get("filter"))]
+        should = [compile_query(clause) for clause in as_list(spec.get("should"))]
+        must_not = [compile_query(clause) for clause in as_list(spec.get("must_not"))]
+        minimum_should_match = int(spec.get("minimum_should_match", 0 if must else 1)) if should else 0
+        return lambda source: (all(predicate(source) for predicate in must)
+                               and not any(predicate(source) for predicate in must_not)
+                               and sum(1 for predicate in should if predicate(source)) >= minimum_should_match)
+
+    (field, value), = spec.items()
+    if kind == "term":
+        value = value["value"] if isinstance(value, dict) else value
+        return lambda source: get_field(source, field) == value
+    if kind == "terms":
+        values = set(value)
+        return lambda source: get_field(source, field) in values
+    if kind == "wildcard":
+        pattern = re.compile(fnmatch.translate(value["value"] if isinstance(value, dict) else value))
+        return lambda source: get_field(source, field) is not None and pattern.match(str(get_field(source, field))) is not None
+    if kind == "range":
+        comparisons = {"gte": lambda a, b: a >= b, "gt": lambda a, b: a > b, "lte": lambda a, b: a <= b, "lt": lambda a, b: a < b}
+        bounds = [(comparisons[operator], bound) for operator, bound in value.items() if operator in comparisons]
+        return lambda source: get_field(source, field) is not None and all(compare(get_field(source, field), bound) for compare, bound in bounds)
+    if kind == "exists":
+        return lambda source: get_field(source, value) is not None
+
+    raise Exception(f"Query {kind} is not supported by FakeMDS")
+
+def as_list(clauses):
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+def parse_sort(sort):
+    fields = []
+    for clause in as_list(sort):
+        field, order = (clause, "asc") if isinstance(clause, str) else next(iter(clause.items()))
+        order = order.get("order", "asc") if isinstance(order, dict) else order
+        if order != "asc":
+            raise Exception("FakeMDS only sorts in ascending order")
+        fields.append(field)
+    return fields
+
+def get_sort_value(document, field):
+    if field in ("_id", "_shard_doc"):
+        return document[field]
+    return get_field(document["_source"], field)
+
+def parse_interval_ms(interval):
+    match = re.fullmatch(r"(\d+)(ms|s|m|h)", interval)
+    if match is None:
+        raise Exception(f"Interval {interval} is not supported by FakeMDS")
+    return int(match.group(1)) * INTERVAL_UNITS_MS[match.group(2)]
+
+def run_aggregations(documents, aggregations):
+    return {name: run_aggregation(documents, aggregation) for name, aggregation in aggregations.items()}
+
+def run_aggregation(documents, aggregation):
+    sub_aggregations = aggregation.get("aggs", aggregation.get("aggregations"))
+    if "filter" in aggregation:
+        predicate = compile_query(aggregation["filter"])
+        matched = [document for document in documents if predicate(document["_source"])]
+        result = {"doc_count": len(matched)}
+        if sub_aggregations:
+            result.update(run_aggregations(matched, sub_aggregations))
+        return result
+
+    if "terms" in aggregation:
+        field = aggregation["terms"]["field"]
+        size = aggregation["terms"].get("size", 10)
+        counts = {}
+        for document in documents:
+            value = get_field(document["_source"], field)
+            if value is not None:
+                counts[value] = counts.get(value, 0) + 1
+        ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": sum(count for key, count in ordered[size:]),
+            "buckets": [{"key": key, "doc_count": count} for key, count in ordered[:size]]
+        }
+
+    if "extended_stats" in aggregation:
+        field = aggregation["extended_stats"]["field"]
+        values = [value for value in (get_field(document["_source"], field) for document in documents) if isinstance(value, (int, float))]
+        if not values:
+            return {"count": 0, "min": None, "max": None, "avg": None, "sum": 0.0, "sum_of_squares": None, "variance": None, "std_deviation": None}
+        count = len(values)
+        mean = sum(values) / count
+        # extended_stats reports the population variance
+        variance = sum((value - mean) ** 2 for value in values) / count
+        return {
+            "count": count, "min": min(values), "max": max(values), "avg": mean, "sum": sum(values),
+            "sum_of_squares": sum(value * value for value in values), "variance": variance, "std_deviation": variance ** 0.5
+        }
+
+    if "composite" in aggregation:
+        return run_composite_aggregation(documents, aggregation["composite"], sub_aggregations)
+
+    if "top_hits" in aggregation:
+        spec = aggregation["top_hits"]
+        ordered = list(documents)
+        # Stable sorts from the last sort field to the first sort by all of them
+        for clause in reversed(as_list(spec.get("sort"))):
+            field, order = (clause, "asc") if isinstance(clause, str) else next(iter(clause.items()))
+            order = order.get("order", "asc") if isinstance(order, dict) else order
+            ordered.sort(key=lambda document: get_sort_value(document, field), reverse=order == "desc")
+        hits = [{"_index": document["_index"], "_id": document["_id"], "_source": filter_source(document["_source"], spec.get("_source"))}
+                for document in ordered[:spec.get("size", 3)]]
+        return {"hits": {"total": {"value": len(documents), "relation": "eq"}, "hits": hits}}
+
+    raise Exception(f"Aggregation {list(aggregation)} is not supported by FakeMDS")
+
+def run_composite_aggregation(documents, composite, sub_aggregations=None):
+    sources = []
+    for source in composite["sources"]:
+        (name, spec), = source.items()
+        if "terms" in spec:
+            sources.append((name, spec["terms"]["field"], None))
+        elif "date_histogram" in spec:
+            interval = spec["date_histogram"].get("fixed_interval", spec["date_histogram"].get("interval"))
+            sources.append((name, spec["date_histogram"]["field"], parse_interval_ms(interval)))
+        else:
+            raise Exception(f"Composite source {list(spec)} is not supported by FakeMDS")
+
+    bucket_documents = {}
+    for document in documents:
+        key = []
+        for name, field, interval_ms in sources:
+            value = get_field(document["_source"], field)
+            if value is None:
+                break
+            key.append(value - value % interval_ms if interval_ms else value)
+        else:
+            bucket_documents.setdefault(tuple(key), []).append(document)
+
+    keys = sorted(bucket_documents)
+    if "after" in composite:
+        after = tuple(composite["after"][name] for name, field, interval_ms in sources)
+        keys = keys[bisect.bisect_right(keys, after):]
+    keys = keys[:composite.get("size", 10)]
+
+    names = [name for name, field, interval_ms in sources]
+    buckets = []
+    for key in keys:
+        bucket = {"key": dict(zip(names, key)), "doc_count": len(bucket_documents[key])}
+        if sub_aggregations:
+            bucket.update(run_aggregations(bucket_documents[key], sub_aggregations))
+        buckets.append(bucket)
+    result = {"buckets": buckets}
+    if buckets:
+        result["after_key"] = buckets[-1]["key"]
+    return result
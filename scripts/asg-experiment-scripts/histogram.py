@@ -0,0 +1,169 @@
+import math
+import statistics
+
+from mds import DocumentStream, build_results_query
+
+METRICS_INDEX_PATTERN = 'benchmark-metrics-*'
+SAMPLE_NAMES = ["service_time", "latency"]
+SAMPLE_SOURCE_FIELDS = ["name", "test-execution-id", "value"]
+# Keys used by AveragedServiceTime and AveragedLatency and the percentile each one reports
+PERCENTILES = {"50_0": 50.0, "90_0": 90.0, "99_0": 99.0, "99_9": 99.9, "99_99": 99.99, "100_0": 100.0}
+
+RELATIVE_ACCURACY = 0.005
+MAX_BUCKETS = 4096
+
+class LatencySketch:
+    '''
+    Log-bucketed histogram (DDSketch) of positive samples. Every bucket covers values within
+    RELATIVE_ACCURACY of each other, so any percentile is reported within that relative error. Sketches
+    merge by adding bucket counts, which makes percentiles of merged nodes and rounds exact up to that
+    error instead of an average of percentiles. Once there are more than max_buckets buckets the lowest
+    ones are collapsed together, which keeps memory bounded and only costs accuracy at the fast end.
+    '''
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_buckets=MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise Exception("Cannot merge sketches with different relative accuracies")
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.count > 0:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile):
+        if self.count == 0:
+            return None
+        # The extremes are tracked exactly
+        if percentile >= 100:
+            return self.max
+        if percentile <= 0:
+            return self.min
+
+        rank = percentile / 100 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket in relative terms, clamped to what was actually seen
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            "relative-accuracy": self.relative_accuracy,
+            "max-buckets": self.max_buckets,
+            "buckets": {str(index): count for index, count in sorted(self.buckets.items())},
+            "zero-count": self.zero_count,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative-accuracy"], data["max-buckets"])
+        sketch.buckets = {int(index): count for index, count in data["buckets"].items()}
+        sketch.zero_count = data["zero-count"]
+        sketch.count = data["count"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+    def _collapse(self):
+        indexes = sorted(self.buckets)
+        lowest_kept = indexes[len(indexes) - self.max_buckets]
+        collapsed = sum(self.buckets.pop(index) for index in indexes if index < lowest_kept)
+        self.buckets[lowest_kept] += collapsed
+
+def build_samples_query(test_execution_id, names=SAMPLE_NAMES):
+    query = build_results_query(test_execution_id, names=names)
+    # Warmup samples are not part of the measurement
+    return {
+        "query": {
+            "bool": {
+                "must": [
+                    query["query"],
+                    {
+                        "term": {
+                            "sample-type": "normal"
+                        }
+                    }
+                ]
+            }
+        }
+    }
+
+def get_sketches(client, test_execution_id):
+    # Streams every raw sample and folds it into one sketch per test-execution-id (one per node or round),
+    # so memory depends on the number of ids and never on the number of samples
+    sketches = {name: {} for name in SAMPLE_NAMES}
+    query = build_samples_query(test_execution_id)
+    for document in DocumentStream(client, query, index_pattern=METRICS_INDEX_PATTERN, source_fields=SAMPLE_SOURCE_FIELDS, label=test_execution_id):
+        name = document['_source']['name']
+        document_id = document['_source']['test-execution-id']
+        if document_id not in sketches[name]:
+            sketches[name][document_id] = LatencySketch()
+        sketches[name][document_id].add(document['_source']['value'])
+
+    return sketches
+
+def merge_sketches(sketches):
+    merged = LatencySketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+def calculate_percentiles(sketch, percentiles_to_populate):
+    for metric in percentiles_to_populate:
+        if metric == "units":
+            continue
+        percentiles_to_populate[metric] = sketch.percentile(PERCENTILES[metric])
+    return percentiles_to_populate
+
+def build_percentiles_from_sketches(sketches):
+    # Flattens into [p50, p50_rsd, p90, p90_rsd, ...] in the field order of AveragedServiceTime and AveragedLatency.
+    # Each percentile comes from the merged sketch and its RSD from the spread of that percentile across the sketches.
+    merged = merge_sketches(sketches)
+    percentiles = []
+    for metric, percentile in PERCENTILES.items():
+        values = [sketch.percentile(percentile) for sketch in sketches]
+        # A single round has no spread to report
+        rsd = (statistics.stdev(values) / statistics.mean(values)) * 100 if len(values) > 1 else None
+        percentiles += [merged.percentile(percentile), rsd]
+
+    return percentiles
@@ -1,74 +1,106 @@
 import os
+import argparse
+import statistics
 
-import boto3
-from dotenv import load_dotenv
-
+from clients import load_environment, get_aws_client, print_aws_counters
 from asg_manager import list_asg_instances
+from ssm_commands import send_command_to_batches, wait_for_commands, get_invocation_outputs, DEFAULT_MAX_WORKERS, SUCCESS
+from tracing import span, trace_run, add_tracing_arguments
+
+DEFAULT_GRACE_SECONDS = 30
+# Seconds to wait for the processes to exit after SIGKILL
+KILL_TIMEOUT_SECONDS = 10
+DEFAULT_WAIT_TIMEOUT_SECONDS = 120
+SIGNAL_PREFIX = "signal:"
+QUIESCED_PREFIX = "quiesced-after:"
+OSB_PROCESSES = "pgrep -u ec2-user -f opensearch-benchmark > /dev/null"
+SLOWEST_INSTANCES = 10
 
-def kill_osb_on_asg(ssm_client, host, instance_ids):
-    # Define the shell script commands
+# Stops OSB on every instance and confirms that it is gone. Every instance gets SIGTERM first, so OSB can flush the
+# results of the samples it already has, and only the processes still running after grace_seconds get SIGKILL.
+# The command only succeeds on an instance once no opensearch-benchmark process is left, and it reports how long
+# that took. Returns {instance_id: seconds to quiesce}, with None for instances that did not confirm.
+def kill_osb_on_asg(ssm_client, instance_ids, grace_seconds=DEFAULT_GRACE_SECONDS, max_workers=DEFAULT_MAX_WORKERS, wait_timeout=DEFAULT_WAIT_TIMEOUT_SECONDS):
+    # Polls every 0.1s, so an instance reports as soon as its processes are gone instead of after a fixed sleep
     shell_script_commands = [
         '#!/bin/bash',
-        'runuser -l ec2-user -c "pkill -f -9 opensearch-benchmark"',
+        'start=$(date +%s.%N)',
+        'pkill -TERM -u ec2-user -f opensearch-benchmark && signal=TERM || signal=none',
+        f'for i in $(seq {grace_seconds * 10}); do {OSB_PROCESSES} || break; sleep 0.1; done',
+        f'if {OSB_PROCESSES}; then',
+        '    pkill -KILL -u ec2-user -f opensearch-benchmark; signal=KILL',
+        f'    for i in $(seq {KILL_TIMEOUT_SECONDS * 10}); do {OSB_PROCESSES} || break; sleep 0.1; done',
+        'fi',
+        f'echo "{SIGNAL_PREFIX} $signal"',
+        f'{OSB_PROCESSES} && {{ echo "opensearch-benchmark is still running"; exit 1; }}',
+        f'echo "{QUIESCED_PREFIX} $(awk "BEGIN {{ print $(date +%s.%N) - $start }}")"',
         ''
     ]
 
-    ### SSM has a max number of instances it can send commands to. Need to send them in batches
-    batches = []
-    batch = []
-    for instance_id in instance_ids:
-        if len(batch) == 50:
-            batches.append(batch)
-            batch = []
-            # Need to add current instance id still
-            batch.append(instance_id)
-        else:
-            batch.append(instance_id)
+    with span("kill_osb", instances=len(instance_ids)):
+        commands = send_command_to_batches(ssm_client, instance_ids, shell_script_commands, "Kill osb script on all ASG instances", max_workers)
+        print(f"Stopping OSB on {len(instance_ids)} instances, with SIGKILL after {grace_seconds}s")
+        statuses = wait_for_commands(ssm_client, commands, wait_timeout + grace_seconds + KILL_TIMEOUT_SECONDS)
+        outputs = get_invocation_outputs(ssm_client, commands)
 
-    # Add remainder if any
-    batches.append(batch)
+    return report_quiesce_times(statuses, outputs)
 
-    print("Number of batches: ", len(batches))
-    print("Batches: ", batches)
+def report_quiesce_times(statuses, outputs):
+    quiesce_times = {instance_id: None for instance_id in statuses}
+    signals = {}
+    for instance_id, output in outputs.items():
+        for line in output.splitlines():
+            if line.startswith(SIGNAL_PREFIX):
+                signals[instance_id] = line[len(SIGNAL_PREFIX):].strip()
+            elif line.startswith(QUIESCED_PREFIX) and statuses.get(instance_id) == SUCCESS:
+                try:
+                    quiesce_times[instance_id] = float(line[len(QUIESCED_PREFIX):].strip())
+                except ValueError:
+                    print(f"Unable to read time to quiesce of {instance_id}: {line}")
 
-    for batch in batches:
-        # Send the command to run the shell script
-        response = ssm_client.send_command(
-            InstanceIds=batch,
-            DocumentName="AWS-RunShellScript",
-            Comment="Kill osb script on all ASG instances",
-            Parameters={
-                'commands': shell_script_commands
-            }
-        )
+    confirmed = {instance_id: seconds for instance_id, seconds in quiesce_times.items() if seconds is not None}
+    unconfirmed = [instance_id for instance_id, seconds in quiesce_times.items() if seconds is None]
+    if confirmed:
+        print(f"OSB stopped on {len(confirmed)} of {len(quiesce_times)} instances. Time to quiesce: min {min(confirmed.values()):.1f}s, "
+              f"median {statistics.median(confirmed.values()):.1f}s, max {max(confirmed.values()):.1f}s")
+        slowest = sorted(confirmed.items(), key=lambda item: item[1], reverse=True)[:SLOWEST_INSTANCES]
+        print("Slowest to quiesce: ", [f"{instance_id}: {seconds:.1f}s ({signals.get(instance_id)})" for instance_id, seconds in slowest])
 
-        # Get the command ID
-        command_id = response['Command']['CommandId']
-        print(f"Killed OSB on {len(batch)} instances")
-        print(f"Command ID: {command_id}")
+    for signal in ["TERM", "KILL", "none"]:
+        instance_ids = [instance_id for instance_id, instance_signal in signals.items() if instance_signal == signal and instance_id in confirmed]
+        if instance_ids:
+            print(f"Stopped with SIG{signal}: {len(instance_ids)}" if signal != "none" else f"Not running OSB: {len(instance_ids)}")
+    killed = [instance_id for instance_id, signal in signals.items() if signal == "KILL"]
+    if killed:
+        print("Instances that needed SIGKILL, whose last results may not have been flushed: ", killed)
+    if unconfirmed:
+        print("OSB may still be running on: ", unconfirmed)
 
-if __name__ == "__main__":
-    load_dotenv()
+    return quiesce_times
 
-    session = boto3.Session(
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION')
-    )
-    ec2 = session.client('ec2')
-    autoscaling = session.client('autoscaling')
-    ssm_client = session.client('ssm')
+if __name__ == "__main__":
+    # Parsed even without options, so --help prints usage instead of killing OSB on the fleet
+    parser = argparse.ArgumentParser(description='Stop OSB on every ASG instance and confirm that it exited')
+    parser.add_argument('--grace-seconds', '-g', type=int, default=DEFAULT_GRACE_SECONDS, help=f'Seconds for OSB to exit after SIGTERM before it gets SIGKILL. Use 0 to send SIGKILL right away. Default: {DEFAULT_GRACE_SECONDS}')
+    parser.add_argument('--max-workers', '-w', type=int, default=DEFAULT_MAX_WORKERS, help=f'Max number of batches of instances to send the command to at the same time. Default: {DEFAULT_MAX_WORKERS}')
+    parser.add_argument('--wait-timeout', '-t', type=int, default=DEFAULT_WAIT_TIMEOUT_SECONDS, help=f'Seconds to wait for every instance to confirm, on top of the grace period. Default: {DEFAULT_WAIT_TIMEOUT_SECONDS}')
+    add_tracing_arguments(parser)
+    args = parser.parse_args()
 
-    host = ""
+    load_environment()
+    ec2 = get_aws_client('ec2')
+    autoscaling = get_aws_client('autoscaling')
+    ssm_client = get_aws_client('ssm')
 
     tags = [
         {
             'Key': 'aws:autoscaling:groupName',
-            'Value': 'scale_testing_demo',
+            'Value': os.getenv('AUTOSCALING_GROUP_NAME'),
             'PropagateAtLaunch': True
         }
     ]
-    instance_ids = list_asg_instances(ec2, autoscaling, tags)
-
-    kill_osb_on_asg(ssm_client, host, instance_ids)
+    with trace_run("kill-osb-on-asg", args.trace, args.profile):
+        instance_ids = list_asg_instances(ec2, autoscaling, tags)
 
+        kill_osb_on_asg(ssm_client, instance_ids, args.grace_seconds, args.max_workers, args.wait_timeout)
+    print_aws_counters()
@@ -0,0 +1,51 @@
+import statistics
+
+DEFAULT_Z_THRESHOLD = 3.5
+# Scales the MAD to the standard deviation of normally distributed values (Iglewicz and Hoaglin's modified z-score)
+MAD_SCALE = 0.6745
+# Scales the mean absolute deviation instead when more than half of the nodes have the median value and the MAD is 0
+MEAN_AD_SCALE = 0.7979
+# Per-node values that are checked for outliers: (results name, value key, direction). Only the slow side is an
+# outlier, so a direction of -1 flags low values and 1 flags high values.
+OUTLIER_METRICS = {
+    "throughput-mean": ("throughput", "mean", -1),
+    "service-time-p99": ("service_time", "99_0", 1),
+}
+
+def robust_z_scores(values):
+    # Returns the median, the MAD and {node: modified z-score} of {node: value}
+    median = statistics.median(values.values())
+    deviations = [abs(value - median) for value in values.values()]
+    mad = statistics.median(deviations)
+
+    if mad > 0:
+        scale = mad / MAD_SCALE
+    else:
+        scale = statistics.mean(deviations) / MEAN_AD_SCALE
+    z_scores = {node: (value - median) / scale if scale > 0 else 0.0 for node, value in values.items()}
+    return median, mad, z_scores
+
+def find_outlier_nodes(node_results, get_node_ip_address, z_threshold=DEFAULT_Z_THRESHOLD):
+    # node_results maps a results name (throughput, service_time) to {node: value} like filter_results returns.
+    # A node is an outlier when its modified z-score of any OUTLIER_METRICS value is beyond z_threshold in the slow
+    # direction, e.g. low throughput but not high throughput. The z-scores of every node are in the report.
+    report = {"z-threshold": z_threshold, "metrics": {}}
+    outlier_nodes = {}
+    for metric, (name, key, direction) in OUTLIER_METRICS.items():
+        values = {node: value[key] for node, value in node_results[name].items() if value.get(key) is not None}
+        # Three nodes are the fewest for which one of them can stand out
+        if len(values) < 3:
+            continue
+
+        median, mad, z_scores = robust_z_scores(values)
+        report["metrics"][metric] = {"median": median, "mad": mad, "z-scores": z_scores}
+        for node, z_score in z_scores.items():
+            if z_score * direction > z_threshold:
+                outlier_nodes.setdefault(node, {})[metric] = {"value": values[node], "z-score": z_score}
+
+    report["outlier-nodes"] = [
+        {"node": node, "ip": get_node_ip_address(node), "metrics": metrics} for node, metrics in sorted(outlier_nodes.items())
+    ]
+    for outlier in report["outlier-nodes"]:
+        print(f"Outlier node {outlier['ip']}: " + ", ".join(f"{metric} {values['value']:.3f} (z {values['z-score']:.1f})" for metric, values in outlier["metrics"].items()))
+    return report
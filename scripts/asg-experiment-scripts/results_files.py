@@ -0,0 +1,81 @@
+import os
+import re
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+# collect-nodes-results.py saves the --results-file of each node as <test-execution-id>.results
+RESULTS_SUFFIX = ".results"
+DEFAULT_MAX_WORKERS = 16
+THROUGHPUT_METRICS = {"Min Throughput": "min", "Mean Throughput": "mean", "Median Throughput": "median", "Max Throughput": "max"}
+PERCENTILE_PATTERN = re.compile(r"^([\d.]+)th percentile (latency|service time)$")
+PERCENTILE_NAMES = {"latency": "latency", "service time": "service_time"}
+
+def parse_results_file(text):
+    # Reads the summary OSB writes with --results-file, in its markdown (default) or csv format.
+    # Returns {name: value} for throughput, service_time and latency in the shape of the MDS documents,
+    # with the operation the values belong to.
+    results = {"throughput": {}, "service_time": {}, "latency": {}}
+    operation = None
+    for line in text.splitlines():
+        cells = parse_row(line)
+        if cells is None or len(cells) < 4:
+            continue
+
+        metric, task, value, unit = cells[:4]
+        try:
+            value = float(value)
+        except ValueError:
+            continue
+
+        if metric in THROUGHPUT_METRICS:
+            results["throughput"][THROUGHPUT_METRICS[metric]] = value
+            results["throughput"]["unit"] = unit
+        else:
+            match = PERCENTILE_PATTERN.match(metric)
+            if match is None:
+                continue
+            # 99.9th percentile -> 99_9, 50th percentile -> 50_0, like the keys in the MDS
+            percentile = str(float(match.group(1))).replace(".", "_")
+            results[PERCENTILE_NAMES[match.group(2)]][percentile] = value
+        operation = task or operation
+
+    for values in results.values():
+        if values:
+            values["operation"] = operation
+    return results
+
+def parse_row(line):
+    line = line.strip()
+    if line.startswith("|"):
+        # Skip the |---:|---:| separator under the header
+        if set(line) <= set("|-: "):
+            return None
+        return [cell.strip() for cell in line.strip("|").split("|")]
+    if "," in line:
+        return [cell.strip() for cell in line.split(",")]
+    return None
+
+def load_results_dir(folder, test_execution_id_pattern="*", max_workers=DEFAULT_MAX_WORKERS):
+    # Parses every <test-execution-id>.results file in folder matching the pattern on a bounded pool of workers.
+    # Returns throughput, service_time and latency as {test-execution-id: value}, like filter_results does for MDS documents.
+    paths = sorted(glob.glob(os.path.join(folder, f"{test_execution_id_pattern}{RESULTS_SUFFIX}")))
+
+    def parse_path(path):
+        with open(path) as results_file:
+            return os.path.basename(path)[:-len(RESULTS_SUFFIX)], parse_results_file(results_file.read())
+
+    throughput = {}
+    service_time = {}
+    latency = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for node_id, results in executor.map(parse_path, paths):
+            for name, node_results in [("throughput", throughput), ("service_time", service_time), ("latency", latency)]:
+                if results[name]:
+                    node_results[node_id] = results[name]
+
+    missing = [os.path.basename(path)[:-len(RESULTS_SUFFIX)] for path in paths if os.path.basename(path)[:-len(RESULTS_SUFFIX)] not in throughput]
+    print(f"Results files parsed: {len(paths)}")
+    if missing:
+        print("No throughput found in the results files of: ", missing)
+
+    return throughput, service_time, latency
@@ -1,68 +1,87 @@
 import os
+import time
 import argparse
+from datetime import datetime, timezone
 
-import boto3
-from dotenv import load_dotenv
-
+from clients import load_environment, get_aws_client, print_aws_counters
 from asg_manager import list_asg_instances
+from ssm_commands import send_command_to_batches, wait_for_commands, get_invocation_outputs, DEFAULT_MAX_WORKERS
+from tracing import trace_run, add_tracing_arguments
+
+# Seconds to wait on each node before checking that opensearch-benchmark started
+STARTUP_CHECK_SECONDS = 10
+DEFAULT_WAIT_TIMEOUT_SECONDS = 120
+START_OFFSET_PREFIX = "start-offset:"
+
+def run_osb_on_asg(ssm_client, host, instance_ids, test_execution_id, max_workers=DEFAULT_MAX_WORKERS, wait_timeout=DEFAULT_WAIT_TIMEOUT_SECONDS, start_delay=0, search_clients=1, sample_resources=False):
+    # With a start delay, every node waits until the same wall-clock time before starting the benchmark
+    start_at = None
+    if start_delay > 0:
+        start_at = int(time.time()) + start_delay
+        print(f"Starting OSB on all instances at {datetime.fromtimestamp(start_at, timezone.utc).isoformat()} (in {start_delay}s)")
 
-def run_osb_on_asg(ssm_client, host, instance_ids, test_execution_id):
     # Define the shell script commands
+    # screen returns right away, so check that opensearch-benchmark is actually running before reporting success
+    if start_at is None:
+        wait_for_startup = f"sleep {STARTUP_CHECK_SECONDS}"
+        report_start_offset = ''
+    else:
+        # Wait for the start time before checking, then report how late this node started
+        wait_for_startup = f"delay=$(( {start_at} - $(date +%s) + {STARTUP_CHECK_SECONDS} )); [ $delay -gt 0 ] && sleep $delay"
+        report_start_offset = f"echo \"{START_OFFSET_PREFIX} $(cat /home/ec2-user/{test_execution_id}-*.start-offset)\""
+
     shell_script_commands = [
         '#!/bin/bash',
-        f"runuser -l ec2-user -c \"screen -dmS SCALE_TESTING /home/ec2-user/run-osb-term-queries.sh {test_execution_id} {host}\"",
+        f"runuser -l ec2-user -c \"screen -dmS SCALE_TESTING /home/ec2-user/run-osb-term-queries.sh {test_execution_id} {host} {start_at or 0} {search_clients} {1 if sample_resources else 0}\"",
+        wait_for_startup,
+        'pgrep -u ec2-user -f opensearch-benchmark > /dev/null || { echo "opensearch-benchmark is not running"; exit 1; }',
+        report_start_offset,
         ''
     ]
 
-    ### SSM has a max number of instances it can send commands to. Need to send them in batches
-    batches = []
-    batch = []
-    for instance_id in instance_ids:
-        if len(batch) == 50:
-            batches.append(batch)
-            batch = []
-            # Need to add current instance id still
-            batch.append(instance_id)
-        else:
-            batch.append(instance_id)
+    commands = send_command_to_batches(ssm_client, instance_ids, shell_script_commands, "Run osb script on all ASG instances", max_workers)
+    print(f"Running OSB scripts on {len(instance_ids)} instances")
 
-    # Add remainder if any
-    batches.append(batch)
+    if wait_timeout > 0:
+        statuses = wait_for_commands(ssm_client, commands, wait_timeout + start_delay)
+        if start_at is not None:
+            report_start_offsets(get_invocation_outputs(ssm_client, commands))
+        return statuses
 
-    print("Number of batches: ", len(batches))
-    print("Batches: ", batches)
+def report_start_offsets(outputs):
+    offsets = {}
+    for instance_id, output in outputs.items():
+        for line in output.splitlines():
+            if line.startswith(START_OFFSET_PREFIX):
+                try:
+                    offsets[instance_id] = float(line[len(START_OFFSET_PREFIX):].strip())
+                except ValueError:
+                    print(f"Unable to read start offset of {instance_id}: {line}")
 
-    # Send the command to run the shell script
-    for batch in batches:
-        response = ssm_client.send_command(
-            InstanceIds=batch,
-            DocumentName="AWS-RunShellScript",
-            Comment="Run osb script on all ASG instances",
-            Parameters={
-                'commands': shell_script_commands
-            }
-        )
+    if not offsets:
+        print("No start offsets were reported")
+        return offsets
 
-    # Get the command ID
-        command_id = response['Command']['CommandId']
-        print(f"Running OSB scripts on {len(batch)} instances")
-        print(f"Command ID: {command_id}")
+    print(f"Start offsets from {len(offsets)} instances: min {min(offsets.values()):.3f}s, max {max(offsets.values()):.3f}s, skew {max(offsets.values()) - min(offsets.values()):.3f}s")
+    slowest = sorted(offsets.items(), key=lambda item: item[1], reverse=True)[:10]
+    print("Latest to start: ", [f"{instance_id}: {offset:.3f}s" for instance_id, offset in slowest])
+    return offsets
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Aggregate Results from MDS')
     parser.add_argument('--id', '-i', required=True, help='Test-execution-id to use for a round of experiments')
+    parser.add_argument('--max-workers', '-w', type=int, default=DEFAULT_MAX_WORKERS, help=f'Max number of batches of instances to send the command to at the same time. Default: {DEFAULT_MAX_WORKERS}')
+    parser.add_argument('--wait-timeout', '-t', type=int, default=DEFAULT_WAIT_TIMEOUT_SECONDS, help=f'Seconds to track whether OSB started on every instance. Use 0 to not wait. Default: {DEFAULT_WAIT_TIMEOUT_SECONDS}')
+    parser.add_argument('--start-delay', '-d', type=int, default=0, help='Start OSB on every instance at the same wall-clock time, this many seconds from now, and report how late each instance started. Use 0 to start as soon as the command lands. Default: 0')
+    parser.add_argument('--search-clients', '-c', type=int, default=1, help='Number of search clients on each instance. Default: 1')
+    parser.add_argument('--sample-resources', action='store_true', help='Sample CPU, network and sockets on every instance at 1s into <test-execution-id>.resources.csv next to the results file. Requires sample-lg-resources.sh on the AMI. Default: False')
+    add_tracing_arguments(parser)
     args = parser.parse_args()
 
-    load_dotenv()
-
-    session = boto3.Session(
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION')
-    )
-    ec2 = session.client('ec2')
-    autoscaling = session.client('autoscaling')
-    ssm_client = session.client('ssm')
+    load_environment()
+    ec2 = get_aws_client('ec2')
+    autoscaling = get_aws_client('autoscaling')
+    ssm_client = get_aws_client('ssm')
 
     host = os.getenv('TARGET_HOST')
 
@@ -73,6 +92,8 @@ if __name__ == "__main__":
             'PropagateAtLaunch': True
         }
     ]
-    instance_ids = list_asg_instances(ec2, autoscaling, tags)
+    with trace_run("run-osb-on-asg", args.trace, args.profile):
+        instance_ids = list_asg_instances(ec2, autoscaling, tags)
 
-    run_osb_on_asg(ssm_client, host, instance_ids, args.id)
+        run_osb_on_asg(ssm_client, host, instance_ids, args.id, args.max_workers, args.wait_timeout, args.start_delay, args.search_clients, args.sample_resources)
+    print_aws_counters()
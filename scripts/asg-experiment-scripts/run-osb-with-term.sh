@@ -1,6 +1,12 @@
 #!/bin/bash
 run_id=$1
 host=$2
+# Optional epoch seconds to start at, so every node in the fleet starts the benchmark at the same time. 0 starts right away
+start_at=$3
+# Optional number of search clients. Default: 1
+clients=${4:-1}
+# Optional. 1 samples CPU, network and sockets of this node next to the results file while the benchmark runs
+sample_resources=$5
 
 hostname=$(hostname -I)
 new_hostname=${hostname// }
@@ -8,5 +14,17 @@ new_hostname=${hostname// }
 # new_uuid=${uuid// }
 new_run_id="${run_id}-${new_hostname}"
 
+if [ -n "$start_at" ] && [ "$start_at" != "0" ]; then
+    delay=$(awk -v start_at="$start_at" -v now="$(date +%s.%N)" 'BEGIN { delay = start_at - now; print (delay > 0 ? delay : 0) }')
+    sleep "$delay"
+    # Seconds this node started after start_at, read back by run-osb-on-asg.py
+    awk -v start_at="$start_at" -v now="$(date +%s.%N)" 'BEGIN { printf "%.3f\n", now - start_at }' > /home/ec2-user/$new_run_id.start-offset
+fi
+
+if [ "$sample_resources" = "1" ]; then
+    # exec keeps this pid for opensearch-benchmark, so the sampler stops when the benchmark exits
+    /home/ec2-user/sample-lg-resources.sh /home/ec2-user/$new_run_id.resources.csv 1 $$ &
+fi
+
 # Fill out basic_auth_user and basic_auth_password first
-opensearch-benchmark execute-test --workload=big5 --pipeline=benchmark-only --target-hosts=$host --client-options="basic_auth_user:'',basic_auth_password:''" --workload-params=time_period:600,search_clients:1,target_throughput:"" --include-tasks=term --kill-running-processes --results-file=/home/ec2-user/$new_run_id --test-execution-id=$new_run_id
\ No newline at end of file
+exec opensearch-benchmark execute-test --workload=big5 --pipeline=benchmark-only --target-hosts=$host --client-options="basic_auth_user:'',basic_auth_password:''" --workload-params=time_period:600,search_clients:$clients,target_throughput:"" --include-tasks=term --kill-running-processes --results-file=/home/ec2-user/$new_run_id --test-execution-id=$new_run_id
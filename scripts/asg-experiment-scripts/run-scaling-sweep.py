@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from clients import load_environment, get_aws_client, print_aws_counters
+from asg_manager import update_asg, get_asg_sizes, describe_asg_instances, ASG_NAME_TAG
+from ssm_commands import (send_command_to_batches, wait_for_commands, get_invocation_outputs, split_into_batches,
+                          DEFAULT_MAX_WORKERS, SUCCESS)
+from convergence import check_convergence, print_convergence, DEFAULT_RSD_THRESHOLD, DEFAULT_CI_THRESHOLD
+from tracing import span, trace_run, add_tracing_arguments
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CAPACITIES = "5,10"
+DEFAULT_SEARCH_CLIENTS = "1"
+DEFAULT_ROUNDS = 3
+DEFAULT_OUTPUT_DIR = "sweep-results"
+# OSB runs for time_period:600 in run-osb-with-term.sh, plus warmup and publishing results to the MDS
+DEFAULT_ROUND_SECONDS = 660
+DEFAULT_SCALE_TIMEOUT_SECONDS = 1800
+DEFAULT_ROUND_TIMEOUT_SECONDS = 1800
+POLL_INTERVAL_SECONDS = 30
+RUNNING = "running"
+
+# Runs every cell of capacity x search clients for a number of rounds. The ASG is only resized when the capacity
+# changes, every round gets a deterministic test-execution-id, and the aggregation of a finished round runs in the
+# background while the next round is generating load. With max_rounds above rounds, a cell keeps adding rounds
+# until its throughput and p99 converge or max_rounds is reached. The ASG gets back its original desired capacity,
+# max and min size when the sweep ends, also when it fails.
+def run_scaling_sweep(host, asg_name, capacities, search_clients, rounds, prefix, output_dir, round_seconds,
+                      scale_timeout, round_timeout, start_delay, max_workers, aggregate_args, max_rounds=None,
+                      rsd_threshold=DEFAULT_RSD_THRESHOLD, ci_threshold=DEFAULT_CI_THRESHOLD, sample_resources=False):
+    ec2 = get_aws_client('ec2')
+    autoscaling = get_aws_client('autoscaling')
+    ssm_client = get_aws_client('ssm')
+    tags = [{'Key': ASG_NAME_TAG, 'Value': asg_name}]
+    run_osb_on_asg = load_script("run-osb-on-asg.py").run_osb_on_asg
+    max_rounds = max(max_rounds or rounds, rounds)
+
+    # A single worker runs the aggregations in the order they were queued, so a cell is only aggregated
+    # after all of its rounds, and only one aggregation queries the MDS at a time
+    aggregator = ThreadPoolExecutor(max_workers=1)
+    cell_futures = []
+    original_sizes = None
+    try:
+        for capacity in capacities:
+            # The ASG is resized the first time a round at this capacity has to run
+            instance_ids = None
+
+            for clients in search_clients:
+                cell_folder = get_cell_folder(output_dir, prefix, capacity, clients)
+                if os.path.exists(f"{cell_folder}.json"):
+                    print(f"{cell_folder} is already aggregated. Skipping.")
+                    continue
+
+                round_futures = []
+                for round_number in range(1, max_rounds + 1):
+                    output_name = get_round_output_name(output_dir, prefix, capacity, clients, round_number)
+                    if not os.path.exists(f"{output_name}-averaged.json"):
+                        if instance_ids is None:
+                            with span("scale_asg", capacity=capacity):
+                                if original_sizes is None:
+                                    original_sizes = get_asg_sizes(autoscaling, asg_name)
+                                # Min and max pinned to the capacity, so nothing else can scale the ASG during the rounds
+                                update_asg(autoscaling, asg_name, capacity, capacity, capacity)
+                                instance_ids = wait_for_capacity(ec2, autoscaling, ssm_client, tags, capacity, scale_timeout)
+
+                        test_execution_id = get_test_execution_id(prefix, capacity, clients, round_number)
+                        print(f"Running {test_execution_id}")
+                        with span("run_osb_on_asg", test_execution_id=test_execution_id):
+                            statuses = run_osb_on_asg(ssm_client, host, instance_ids, test_execution_id, max_workers,
+                                                      start_delay=start_delay, search_clients=clients,
+                                                      sample_resources=sample_resources)
+                        if statuses is not None:
+                            started = [instance_id for instance_id, status in statuses.items() if status == SUCCESS]
+                            print(f"OSB started on {len(started)} of {len(instance_ids)} instances")
+
+                        with span("wait_for_round", test_execution_id=test_execution_id):
+                            wait_for_round(ssm_client, instance_ids, round_seconds + start_delay, round_timeout, max_workers)
+                        round_futures.append(aggregator.submit(aggregate_round, test_execution_id, output_name, aggregate_args))
+
+                    if round_number < rounds or max_rounds == rounds:
+                        continue
+                    # Deciding whether another round is needed takes this round's results, so wait for its aggregation
+                    for future in round_futures:
+                        future.result()
+                    round_results = [load_json(f"{get_round_output_name(output_dir, prefix, capacity, clients, completed)}-averaged.json")
+                                     for completed in range(1, round_number + 1)]
+                    converged, summaries = check_convergence(round_results, rsd_threshold, ci_threshold)
+                    print_convergence(cell_folder, converged, summaries)
+                    if converged:
+                        break
+
+                cell_futures.append(aggregator.submit(aggregate_cell, round_futures, output_dir, prefix, capacity, clients, aggregate_args))
+
+        wait(cell_futures)
+    finally:
+        if original_sizes is not None:
+            desired_capacity, max_size, min_size = original_sizes
+            print(f"Restoring the ASG to desired capacity {desired_capacity}, max size {max_size} and min size {min_size}")
+            update_asg(autoscaling, asg_name, desired_capacity, max_size, min_size)
+        aggregator.shutdown(wait=True)
+
+    failed = [future.exception() for future in cell_futures if future.exception() is not None]
+    for exception in failed:
+        print("Aggregation failed: ", exception)
+    print(f"Sweep finished. Results are in {output_dir}")
+
+def get_test_execution_id(prefix, capacity, clients, round_number):
+    return f"{prefix}-{capacity}-nodes-{clients}-clients-{round_number}"
+
+def get_cell_folder(output_dir, prefix, capacity, clients):
+    return os.path.join(output_dir, f"{prefix}-{capacity}-nodes-{clients}-clients")
+
+def get_round_output_name(output_dir, prefix, capacity, clients, round_number):
+    return os.path.join(get_cell_folder(output_dir, prefix, capacity, clients), f"round-{round_number}")
+
+def wait_for_capacity(ec2_client, autoscaling_client, ssm_client, tags, capacity, timeout_seconds, poll_interval_seconds=POLL_INTERVAL_SECONDS):
+    # Waits until the ASG has exactly capacity instances that are InService, Healthy and online in SSM,
+    # so the round is not sent to instances that are still booting or being terminated
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        instances = describe_asg_instances(ec2_client, autoscaling_client, tags)
+        ready = [instance['InstanceId'] for instance in instances if instance['LifecycleState'] == 'InService' and instance['HealthStatus'] == 'Healthy']
+        online = get_ssm_online_instances(ssm_client, ready) if len(ready) == capacity else []
+        print(f"{len(ready)} of {capacity} instances in service, {len(online)} online in SSM")
+
+        if len(instances) == capacity and len(online) == capacity:
+            return sorted(online)
+        if time.monotonic() >= deadline:
+            raise Exception(f"ASG did not reach {capacity} in service instances online in SSM within {timeout_seconds}s")
+        time.sleep(poll_interval_seconds)
+
+def get_ssm_online_instances(ssm_client, instance_ids):
+    online = []
+    for batch in split_into_batches(instance_ids):
+        next_token = None
+        while True:
+            kwargs = {
+                'Filters': [{'Key': 'InstanceIds', 'Values': batch}],
+                'MaxResults': 50
+            }
+            if next_token is not None:
+                kwargs['NextToken'] = next_token
+            response = ssm_client.describe_instance_information(**kwargs)
+            online += [info['InstanceId'] for info in response['InstanceInformationList'] if info['PingStatus'] == 'Online']
+
+            next_token = response.get('NextToken')
+            if next_token is None:
+                break
+
+    return online
+
+def wait_for_round(ssm_client, instance_ids, round_seconds, timeout_seconds, max_workers=DEFAULT_MAX_WORKERS, poll_interval_seconds=POLL_INTERVAL_SECONDS):
+    # Sleeps for the expected length of the round, then polls until opensearch-benchmark has exited on every instance.
+    # Instances still running it after timeout_seconds are stopped and confirmed idle before returning.
+    print(f"Waiting {round_seconds}s for the round to finish")
+    time.sleep(round_seconds)
+
+    shell_script_commands = [
+        '#!/bin/bash',
+        f'pgrep -u ec2-user -f opensearch-benchmark > /dev/null && echo "{RUNNING}" || echo "idle"'
+    ]
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        commands = send_command_to_batches(ssm_client, instance_ids, shell_script_commands, "Check whether osb is running on ASG instances", max_workers)
+        wait_for_commands(ssm_client, commands, POLL_INTERVAL_SECONDS * 4)
+        outputs = get_invocation_outputs(ssm_client, commands)
+        running = [instance_id for instance_id, output in outputs.items() if output.strip() == RUNNING]
+
+        if not running:
+            return
+        print(f"OSB still running on {len(running)} instances")
+        if time.monotonic() >= deadline:
+            # Stop the stragglers, so the next round does not start while they are still generating load
+            print(f"Round did not finish within {timeout_seconds}s after the expected end. Stopping OSB on: ", running)
+            load_script("kill-osb-on-asg.py").kill_osb_on_asg(ssm_client, running, max_workers=max_workers)
+            return
+        time.sleep(poll_interval_seconds)
+
+def aggregate_round(test_execution_id, output_name, aggregate_args):
+    os.makedirs(os.path.dirname(output_name), exist_ok=True)
+    # Node ids are <test-execution-id>-<ip>, so the trailing dash keeps round 1 from matching round 10
+    with span("aggregate_round", test_execution_id=test_execution_id):
+        run_script("aggregate-nodes-results.py", ["-i", f"{test_execution_id}-*", "-n", output_name] + aggregate_args)
+
+def aggregate_cell(round_futures, output_dir, prefix, capacity, clients, aggregate_args):
+    for future in round_futures:
+        future.result()
+
+    rounds_args = ["--histograms"] if "--histograms" in aggregate_args else []
+    cell_folder = get_cell_folder(output_dir, prefix, capacity, clients)
+    with span("aggregate_cell", cell=cell_folder):
+        run_script("aggregate-rounds-results.py", ["-f", cell_folder, "-n", cell_folder] + rounds_args)
+
+def load_json(file_name):
+    with open(file_name) as file:
+        return json.load(file)
+
+def run_script(script_name, script_args):
+    # Aggregation scripts run in their own process so they read .env and create their clients like they do standalone
+    command = [sys.executable, os.path.join(SCRIPT_DIR, script_name)] + script_args
+    print("Running: ", " ".join(command))
+    subprocess.run(command, check=True)
+
+def load_script(script_name):
+    # Script names have dashes, so they cannot be imported with a regular import statement
+    spec = importlib.util.spec_from_file_location(script_name[:-3].replace("-", "_"), os.path.join(SCRIPT_DIR, script_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def comma_separated_ints(input: str):
+    return [int(value) for value in input.split(',')]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a scaling sweep of OSB rounds on an autoscaling group and aggregate them')
+    parser.add_argument('--prefix', '-p', required=True, help='Prefix of every test-execution-id in the sweep. Ids are <prefix>-<capacity>-nodes-<clients>-clients-<round>')
+    parser.add_argument('--capacities', '-c', type=comma_separated_ints, default=DEFAULT_CAPACITIES, help=f'Comma-separated ASG sizes to run. Default: {DEFAULT_CAPACITIES}')
+    parser.add_argument('--search-clients', '-s', type=comma_separated_ints, default=DEFAULT_SEARCH_CLIENTS, help=f'Comma-separated number of search clients on each instance. Default: {DEFAULT_SEARCH_CLIENTS}')
+    parser.add_argument('--rounds', '-r', type=int, default=DEFAULT_ROUNDS, help=f'Rounds to run for every capacity and search clients. Default: {DEFAULT_ROUNDS}')
+    parser.add_argument('--max-rounds', '-m', type=int, default=None, help='Keep adding rounds after --rounds until throughput and p99 converge, up to this many rounds. Default: --rounds')
+    parser.add_argument('--rsd-threshold', type=float, default=DEFAULT_RSD_THRESHOLD, help=f'Max RSD in percent of mean throughput and p99 service time for a configuration to converge. Default: {DEFAULT_RSD_THRESHOLD}')
+    parser.add_argument('--ci-threshold', type=float, default=DEFAULT_CI_THRESHOLD, help=f'Max half-width of the 95%% confidence interval, in percent of the mean, for a configuration to converge. Default: {DEFAULT_CI_THRESHOLD}')
+    parser.add_argument('--output-dir', '-o', default=DEFAULT_OUTPUT_DIR, help=f'Folder to write aggregated results to. Rounds already aggregated there are skipped. Default: {DEFAULT_OUTPUT_DIR}')
+    parser.add_argument('--round-seconds', type=int, default=DEFAULT_ROUND_SECONDS, help=f'Expected length of a round before checking whether OSB finished. Default: {DEFAULT_ROUND_SECONDS}')
+    parser.add_argument('--scale-timeout', type=int, default=DEFAULT_SCALE_TIMEOUT_SECONDS, help=f'Seconds to wait for the ASG to be in service after resizing it. Default: {DEFAULT_SCALE_TIMEOUT_SECONDS}')
+    parser.add_argument('--round-timeout', type=int, default=DEFAULT_ROUND_TIMEOUT_SECONDS, help=f'Seconds to wait for OSB to exit after the expected end of a round. Default: {DEFAULT_ROUND_TIMEOUT_SECONDS}')
+    parser.add_argument('--start-delay', '-d', type=int, default=0, help='Start every round at the same wall-clock time on all instances, this many seconds after sending the command. Default: 0')
+    parser.add_argument('--max-workers', '-w', type=int, default=DEFAULT_MAX_WORKERS, help=f'Max number of batches of instances to send commands to at the same time. Default: {DEFAULT_MAX_WORKERS}')
+    parser.add_argument('--aggregate-args', default="", help='Extra arguments for aggregate-nodes-results.py, e.g. "--server-side --histograms". Default: none')
+    parser.add_argument('--sample-resources', action='store_true', help='Sample CPU, network and sockets on every instance during each round. Default: False')
+    add_tracing_arguments(parser)
+    args = parser.parse_args()
+
+    load_environment()
+
+    host = os.getenv('TARGET_HOST')
+    asg_name = os.getenv('AUTOSCALING_GROUP_NAME')
+
+    with trace_run("run-scaling-sweep", args.trace, args.profile):
+        run_scaling_sweep(host, asg_name, args.capacities, args.search_clients, args.rounds, args.prefix, args.output_dir,
+                          args.round_seconds, args.scale_timeout, args.round_timeout, args.start_delay, args.max_workers,
+                          shlex.split(args.aggregate_args), args.max_rounds, args.rsd_threshold, args.ci_threshold,
+                          args.sample_resources)
+    print_aws_counters()
@@ -0,0 +1,36 @@
+#!/bin/bash
+# Samples CPU, run queue, network and TCP socket usage of this load generator from /proc into a CSV file
+output=$1
+# Seconds between samples. Default: 1
+interval=${2:-1}
+# Optional pid to sample for. Without it, sampling runs until this script is killed
+watch_pid=$3
+
+cpus=$(nproc)
+
+read_cpu() {
+    # Total and idle (idle + iowait) jiffies across all CPUs
+    awk '/^cpu / { total = 0; for (i = 2; i <= NF; i++) total += $i; print total, $5 + $6 }' /proc/stat
+}
+
+read_network() {
+    # Received and transmitted bytes of every interface except loopback
+    awk 'NR > 2 { sub(/^ +/, ""); split($0, parts, ":"); if (parts[1] == "lo") next; split(parts[2], values, " "); rx += values[1]; tx += values[9] } END { print rx + 0, tx + 0 }' /proc/net/dev
+}
+
+echo "timestamp,cpus,cpu_busy_percent,procs_running,rx_bytes,tx_bytes,tcp_sockets" > "$output"
+read -r previous_total previous_idle < <(read_cpu)
+
+while [ -z "$watch_pid" ] || kill -0 "$watch_pid" 2>/dev/null; do
+    sleep "$interval"
+    read -r total idle < <(read_cpu)
+    read -r rx_bytes tx_bytes < <(read_network)
+    # Leave out the awk process reading the count
+    procs_running=$(awk '/^procs_running/ { print $2 - 1 }' /proc/stat)
+    tcp_sockets=$(awk '/^TCP:/ { print $3 }' /proc/net/sockstat)
+    cpu_busy=$(awk -v total=$((total - previous_total)) -v idle=$((idle - previous_idle)) 'BEGIN { printf "%.1f", (total > 0 ? 100 * (total - idle) / total : 0) }')
+
+    echo "$(date +%s.%3N),$cpus,$cpu_busy,$procs_running,$rx_bytes,$tx_bytes,$tcp_sockets" >> "$output"
+    previous_total=$total
+    previous_idle=$idle
+done
@@ -0,0 +1,128 @@
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import span
+
+# SSM has a max number of instances it can send a command to at once
+BATCH_SIZE = 50
+DEFAULT_MAX_WORKERS = 8
+POLL_INTERVAL_SECONDS = 5
+
+PENDING = 'pending'
+SUCCESS = 'success'
+FAILED = 'failed'
+TIMED_OUT = 'timed out'
+# Status of a command invocation on one instance and how it is summarized
+INVOCATION_STATUSES = {
+    'Pending': PENDING,
+    'InProgress': PENDING,
+    'Delayed': PENDING,
+    'Success': SUCCESS,
+    'Failed': FAILED,
+    'Cancelled': FAILED,
+    'Cancelling': FAILED,
+    'Undeliverable': FAILED,
+    'Terminated': FAILED,
+    'TimedOut': TIMED_OUT
+}
+
+def split_into_batches(instance_ids, batch_size=BATCH_SIZE):
+    return [instance_ids[i:i + batch_size] for i in range(0, len(instance_ids), batch_size)]
+
+def send_command_to_batches(ssm_client, instance_ids, shell_script_commands, comment, max_workers=DEFAULT_MAX_WORKERS, **send_command_kwargs):
+    # Sends every batch at the same time on a bounded pool of workers and returns {command_id: batch}.
+    # send_command_kwargs are passed on to send_command, e.g. OutputS3BucketName. Throttled calls are retried by the
+    # adaptive retry mode of get_aws_client.
+    batches = split_into_batches(instance_ids)
+    print("Number of batches: ", len(batches))
+
+    def send_batch(batch):
+        with span("send_command", instances=len(batch)):
+            response = ssm_client.send_command(
+                InstanceIds=batch,
+                DocumentName="AWS-RunShellScript",
+                Comment=comment,
+                Parameters={
+                    'commands': shell_script_commands
+                },
+                **send_command_kwargs
+            )
+        command_id = response['Command']['CommandId']
+        print(f"Sent command {command_id} to {len(batch)} instances")
+        return command_id, batch
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        commands = dict(executor.map(send_batch, batches))
+
+    return commands
+
+def list_invocations(ssm_client, command_ids, details=False):
+    # Lists the invocations of each command by its CommandId. A command goes to one batch of at most BATCH_SIZE
+    # instances, so that is one call per command, however many other commands the account has.
+    for command_id in command_ids:
+        next_token = None
+        while True:
+            kwargs = {
+                'CommandId': command_id,
+                'Details': details,
+                'MaxResults': 50
+            }
+            if next_token is not None:
+                kwargs['NextToken'] = next_token
+            response = ssm_client.list_command_invocations(**kwargs)
+            yield from response['CommandInvocations']
+
+            next_token = response.get('NextToken')
+            if next_token is None:
+                break
+
+def get_invocation_statuses(ssm_client, commands, statuses=None):
+    # With the statuses of a previous poll, only the commands that still have pending instances are listed again
+    statuses = dict(statuses) if statuses is not None else {instance_id: PENDING for batch in commands.values() for instance_id in batch}
+    command_ids = [command_id for command_id, batch in commands.items() if any(statuses[instance_id] == PENDING for instance_id in batch)]
+    with span("get_invocation_statuses", instances=len(statuses), commands=len(command_ids)):
+        for invocation in list_invocations(ssm_client, command_ids):
+            if invocation['InstanceId'] in statuses:
+                statuses[invocation['InstanceId']] = INVOCATION_STATUSES.get(invocation['Status'], PENDING)
+
+    return statuses
+
+def get_invocation_outputs(ssm_client, commands):
+    # Returns {instance_id: output} of the shell script on each instance. SSM truncates this output to 2500 characters.
+    outputs = {}
+    with span("get_invocation_outputs") as counters:
+        for invocation in list_invocations(ssm_client, commands, details=True):
+            outputs[invocation['InstanceId']] = "".join(plugin.get('Output', '') for plugin in invocation.get('CommandPlugins', []))
+        counters["instances"] = len(outputs)
+
+    return outputs
+
+def wait_for_commands(ssm_client, commands, timeout_seconds, poll_interval_seconds=POLL_INTERVAL_SECONDS):
+    # Polls until every instance has finished its command or timeout_seconds have passed. Instances still pending
+    # after that are reported as timed out. Returns {instance_id: status}.
+    deadline = time.monotonic() + timeout_seconds
+    statuses = None
+    while True:
+        statuses = get_invocation_statuses(ssm_client, commands, statuses)
+        print_status_summary(statuses)
+
+        if PENDING not in statuses.values():
+            break
+        if time.monotonic() >= deadline:
+            statuses = {instance_id: TIMED_OUT if status == PENDING else status for instance_id, status in statuses.items()}
+            break
+        time.sleep(poll_interval_seconds)
+
+    for status in [FAILED, TIMED_OUT]:
+        instance_ids = [instance_id for instance_id, instance_status in statuses.items() if instance_status == status]
+        if instance_ids:
+            print(f"Instances {status}: ", instance_ids)
+
+    return statuses
+
+def print_status_summary(statuses):
+    counts = {status: 0 for status in [PENDING, SUCCESS, FAILED, TIMED_OUT]}
+    for status in statuses.values():
+        counts[status] += 1
+    print(f"[{datetime.now(timezone.utc).strftime('%H:%M:%S')}] " + ", ".join(f"{status}: {count}" for status, count in counts.items()))
@@ -0,0 +1,70 @@
+import pandas as pd
+
+from histogram import METRICS_INDEX_PATTERN, build_samples_query
+
+DEFAULT_BUCKET_SECONDS = 1
+COMPOSITE_PAGE_SIZE = 10000
+
+def get_request_counts(client, test_execution_id, bucket_seconds=DEFAULT_BUCKET_SECONDS, index_pattern=METRICS_INDEX_PATTERN):
+    # Counts the requests of every node per time bucket in the MDS with a composite aggregation, paged with after_key,
+    # instead of downloading every sample. Each request has one service_time sample.
+    query = build_samples_query(test_execution_id, names=["service_time"])
+    query["size"] = 0
+    query["aggs"] = {
+        "requests": {
+            "composite": {
+                "size": COMPOSITE_PAGE_SIZE,
+                "sources": [
+                    {"node": {"terms": {"field": "test-execution-id"}}},
+                    {"time": {"date_histogram": {"field": "@timestamp", "fixed_interval": f"{bucket_seconds}s"}}}
+                ]
+            }
+        }
+    }
+
+    rows = []
+    while True:
+        query_response = client.search(body=query, index=index_pattern)
+        composite = query_response['aggregations']['requests']
+        rows += [(bucket['key']['node'], bucket['key']['time'], bucket['doc_count']) for bucket in composite['buckets']]
+
+        if 'after_key' not in composite or len(composite['buckets']) == 0:
+            break
+        query["aggs"]["requests"]["composite"]["after"] = composite['after_key']
+
+    print(f"Number of node time buckets returned: {len(rows)}")
+    return pd.DataFrame(rows, columns=["node", "time", "requests"])
+
+def calculate_steady_state_throughput(request_counts, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    # The steady-state window is when every node in the round was generating load: from the latest first bucket
+    # to the earliest last bucket. Those edge buckets are partial for at least one node, so they are left out too.
+    per_node = request_counts.pivot_table(index="time", columns="node", values="requests", aggfunc="sum", fill_value=0).sort_index()
+    first_buckets = request_counts.groupby("node")["time"].min()
+    last_buckets = request_counts.groupby("node")["time"].max()
+    bucket_ms = bucket_seconds * 1000
+
+    window_start = first_buckets.max() + bucket_ms
+    window_end = last_buckets.min() - bucket_ms
+    if window_end < window_start:
+        raise Exception("No time bucket where all nodes were generating load. Check the start skew of the round or use smaller buckets.")
+
+    steady = per_node.loc[window_start:window_end].reindex(range(window_start, window_end + 1, bucket_ms), fill_value=0)
+    fleet_throughput = steady.sum(axis=1) / bucket_seconds
+    node_count = len(first_buckets)
+    per_node_throughput = fleet_throughput / node_count
+
+    return {
+        "min": float(per_node_throughput.min()),
+        "mean": float(per_node_throughput.mean()),
+        "median": float(per_node_throughput.median()),
+        "units": "ops/s"
+    }, {
+        "nodes": node_count,
+        "bucket-seconds": bucket_seconds,
+        "fleet-min": float(fleet_throughput.min()),
+        "fleet-mean": float(fleet_throughput.mean()),
+        "fleet-median": float(fleet_throughput.median()),
+        "window-seconds": float(window_end - window_start + bucket_ms) / 1000,
+        "trimmed-start-seconds": float(window_start - first_buckets.min()) / 1000,
+        "trimmed-end-seconds": float(last_buckets.max() - window_end) / 1000
+    }
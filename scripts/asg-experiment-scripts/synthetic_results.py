@@ -0,0 +1,127 @@
+import gzip
+import json
+import random
+import argparse
+from datetime import datetime, timezone
+
+RESULTS_INDEX = "benchmark-results-synthetic"
+METRICS_INDEX = "benchmark-metrics-synthetic"
+DEFAULT_PREFIX = "synthetic"
+DEFAULT_OPERATIONS = 1
+DEFAULT_ROUNDS = 3
+DEFAULT_SAMPLES_PER_NODE = 20
+# Matches time_period:600 in run-osb-with-term.sh
+ROUND_SECONDS = 600
+ROUND_SPACING_SECONDS = 900
+START_SKEW_SECONDS = 2.0
+BASE_TIMESTAMP_MS = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+PERCENTILES = ["50_0", "90_0", "99_0", "99_9", "99_99", "100_0"]
+# Each percentile relative to the median
+PERCENTILE_FACTORS = [1.0, 1.4, 2.2, 3.5, 5.0, 7.0]
+
+# Write realistic benchmark-results-* and benchmark-metrics-* documents for nodes x operations x rounds,
+# to run the aggregation scripts against FakeMDS without a live MDS
+def write_documents(output_path, nodes, operations=DEFAULT_OPERATIONS, rounds=DEFAULT_ROUNDS, samples_per_node=DEFAULT_SAMPLES_PER_NODE,
+                    prefix=DEFAULT_PREFIX, seed=0):
+    open_file = gzip.open if output_path.endswith(".gz") else open
+    count = 0
+    with open_file(output_path, "wt") as output_file:
+        for index, document in generate_documents(nodes, operations, rounds, samples_per_node, prefix, seed):
+            output_file.write(json.dumps({"_index": index, "_source": document}) + "\n")
+            count += 1
+
+    print(f"Wrote {count} documents for {nodes} nodes, {operations} operations and {rounds} rounds to {output_path}")
+    return count
+
+def get_round_id(prefix, nodes, round_number):
+    # Same shape as the test-execution-ids of run-scaling-sweep.py
+    return f"{prefix}-{nodes}-nodes-1-clients-{round_number}"
+
+def get_node_ip(node):
+    return f"10.{node // 65536 % 256}.{node // 256 % 256}.{node % 256}"
+
+def generate_documents(nodes, operations=DEFAULT_OPERATIONS, rounds=DEFAULT_ROUNDS, samples_per_node=DEFAULT_SAMPLES_PER_NODE,
+                       prefix=DEFAULT_PREFIX, seed=0):
+    # Yields (index, document). Raw samples are only generated for the first round, which keeps the metrics
+    # index at nodes x samples_per_node x 2 documents.
+    rng = random.Random(seed)
+    operation_names = ["term"] + [f"operation-{i}" for i in range(1, operations)]
+
+    for round_number in range(1, rounds + 1):
+        round_id = get_round_id(prefix, nodes, round_number)
+        round_start_ms = BASE_TIMESTAMP_MS + (round_number - 1) * ROUND_SPACING_SECONDS * 1000
+        timestamp = datetime.fromtimestamp(round_start_ms / 1000, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        # Some rounds are a little slower for every node
+        round_factor = rng.gauss(1.0, 0.03)
+
+        for node in range(nodes):
+            node_id = f"{round_id}-{get_node_ip(node)}"
+            # A few nodes are on a noisy neighbour
+            node_factor = rng.gauss(1.0, 0.05) * (0.6 if rng.random() < 0.01 else 1.0)
+
+            for operation in operation_names:
+                throughput = 10.0 * round_factor * node_factor
+                service_time_median = 1000.0 / throughput * 0.8
+                yield RESULTS_INDEX, build_result_document("throughput", node_id, timestamp, operation, {
+                    "min": throughput * rng.uniform(0.9, 0.97),
+                    "mean": throughput,
+                    "median": throughput * rng.uniform(0.99, 1.01),
+                    "max": throughput * rng.uniform(1.03, 1.1),
+                    "unit": "ops/s"
+                })
+                yield RESULTS_INDEX, build_result_document("service_time", node_id, timestamp, operation, build_percentiles(rng, service_time_median))
+                yield RESULTS_INDEX, build_result_document("latency", node_id, timestamp, operation, build_percentiles(rng, service_time_median * 1.05))
+
+            if round_number == 1:
+                node_start_ms = round_start_ms + rng.uniform(0, START_SKEW_SECONDS) * 1000
+                for sample in range(samples_per_node):
+                    sample_ms = int(node_start_ms + sample * ROUND_SECONDS * 1000 / samples_per_node)
+                    service_time = rng.lognormvariate(0, 0.4) * 80.0 / node_factor
+                    for name, value in [("service_time", service_time), ("latency", service_time * 1.05)]:
+                        yield METRICS_INDEX, {
+                            "@timestamp": sample_ms,
+                            "relative-time-ms": sample_ms - round_start_ms,
+                            "test-execution-id": node_id,
+                            "test-execution-timestamp": timestamp,
+                            "name": name,
+                            "value": value,
+                            "unit": "ms",
+                            "sample-type": "normal",
+                            "task": operation_names[0],
+                            "operation": operation_names[0],
+                            "operation-type": "search"
+                        }
+
+def build_result_document(name, node_id, timestamp, operation, value):
+    return {
+        "test-execution-id": node_id,
+        "test-execution-timestamp": timestamp,
+        "environment": "synthetic",
+        "workload": "big5",
+        "name": name,
+        "task": operation,
+        "operation": operation,
+        "operation-type": "search",
+        "value": value
+    }
+
+def build_percentiles(rng, median):
+    value = {percentile: median * factor * rng.uniform(0.97, 1.03) for percentile, factor in zip(PERCENTILES, PERCENTILE_FACTORS)}
+    # Percentiles never decrease
+    for previous, percentile in zip(PERCENTILES, PERCENTILES[1:]):
+        value[percentile] = max(value[percentile], value[previous])
+    value["unit"] = "ms"
+    return value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic MDS documents for aggregation benchmarks')
+    parser.add_argument('--output', '-o', required=True, help='JSON lines file to write, gzipped when it ends with .gz')
+    parser.add_argument('--nodes', '-n', type=int, required=True, help='Number of nodes in every round')
+    parser.add_argument('--operations', type=int, default=DEFAULT_OPERATIONS, help=f'Number of operations of every node. Default: {DEFAULT_OPERATIONS}')
+    parser.add_argument('--rounds', '-r', type=int, default=DEFAULT_ROUNDS, help=f'Number of rounds. Default: {DEFAULT_ROUNDS}')
+    parser.add_argument('--samples-per-node', type=int, default=DEFAULT_SAMPLES_PER_NODE, help=f'Raw service time and latency samples of every node in the first round. Default: {DEFAULT_SAMPLES_PER_NODE}')
+    parser.add_argument('--prefix', '-p', default=DEFAULT_PREFIX, help=f'Prefix of the test-execution-ids. Default: {DEFAULT_PREFIX}')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Default: 0')
+    args = parser.parse_args()
+
+    write_documents(args.output, args.nodes, args.operations, args.rounds, args.samples_per_node, args.prefix, args.seed)
@@ -0,0 +1,35 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from fake_mds import FakeMDS
+from synthetic_results import generate_documents
+
+NODES = 20
+OPERATIONS = 3
+ROUNDS = 2
+
+@pytest.fixture
+def mds():
+    # Several operations per node, so every node has more than one document of each result name
+    mds = FakeMDS()
+    for index, document in generate_documents(NODES, OPERATIONS, ROUNDS):
+        mds.index(index, document)
+    return mds
+
+@pytest.fixture
+def load_script():
+    # Script names have dashes, so they are loaded from their path (relative to this folder) with FakeMDS as their client
+    def load(script_name, mds):
+        module_name = os.path.basename(script_name)[:-3].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPT_DIR, script_name))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.create_opensearch_client = lambda *args, **kwargs: mds
+        return module
+    return load
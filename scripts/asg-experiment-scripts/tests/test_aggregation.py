@@ -0,0 +1,89 @@
+import json
+import statistics
+
+import pytest
+
+from cache import ResultCache
+from mds import DocumentStream, build_results_query
+from synthetic_results import RESULTS_INDEX, DEFAULT_PREFIX, get_round_id, get_node_ip, build_result_document
+from conftest import NODES, OPERATIONS
+
+ROUND_PATTERN = f"{get_round_id(DEFAULT_PREFIX, NODES, 1)}-*"
+
+def read_averaged(output_name):
+    with open(f"{output_name}-averaged.json") as averaged_file:
+        return json.load(averaged_file)
+
+def test_document_stream_pages_with_pit(mds):
+    query = build_results_query(ROUND_PATTERN)
+    expected = [hit["_id"] for hit in DocumentStream(mds, query)]
+    searches = mds.searches
+
+    stream = DocumentStream(mds, query, page_size=7)
+    paged = [hit["_id"] for hit in stream]
+
+    assert paged == expected == sorted(expected)
+    assert len(paged) == NODES * OPERATIONS * 3
+    # One search per full page plus the empty one that ends the stream
+    assert mds.searches - searches == len(paged) // 7 + 1
+    assert mds.pits == {}
+    # Without a PIT the stream sorts on _id instead of _shard_doc
+    assert [hit["_id"] for hit in DocumentStream(mds, query, page_size=7, use_pit=False)] == expected
+
+def test_server_side_matches_client_side(mds, load_script, tmp_path):
+    module = load_script("aggregate-nodes-results.py", mds)
+    module.aggregate_results({}, str(tmp_path / "client-side"), ROUND_PATTERN)
+    module.aggregate_results({}, str(tmp_path / "server-side"), ROUND_PATTERN, server_side=True)
+
+    assert read_averaged(tmp_path / "server-side") == read_averaged(tmp_path / "client-side")
+
+def test_lg_host_server_side_matches_client_side(mds, load_script, tmp_path):
+    module = load_script("../lg-host-experiment-scripts/aggregate-lg-host-results.py", mds)
+    module.aggregate_rounds_results({}, f"{DEFAULT_PREFIX}-*", str(tmp_path / "client-side"))
+    module.aggregate_rounds_results({}, f"{DEFAULT_PREFIX}-*", str(tmp_path / "server-side"), server_side=True)
+
+    with open(tmp_path / "client-side.json") as client_side_file, open(tmp_path / "server-side.json") as server_side_file:
+        client_side, server_side = json.load(client_side_file), json.load(server_side_file)
+    assert server_side["test_pattern"] == client_side["test_pattern"]
+    # The MDS sums in a different order, so the averages only match up to rounding
+    for result in ["averaged_throughput", "averaged_service_time", "averaged_latency"]:
+        assert server_side[result].pop("units") == client_side[result].pop("units")
+        assert server_side[result] == pytest.approx(client_side[result])
+
+    with pytest.raises(Exception, match="by operation"):
+        module.aggregate_rounds_results({}, f"{DEFAULT_PREFIX}-*", str(tmp_path / "by-operation"), server_side=True, by_operation=True)
+
+def test_cache_refetches_after_high_water_mark(mds, tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path))
+    query = build_results_query(f"{DEFAULT_PREFIX}-*")
+    assert len(list(cache.get_documents(mds, query))) == NODES * OPERATIONS * 3 * 2
+
+    # A late document of a round that settled long before the high-water mark is not fetched again,
+    # while a round that is still running is
+    mds.index(RESULTS_INDEX, build_result_document("throughput", f"{get_round_id(DEFAULT_PREFIX, NODES, 1)}-10.9.9.9", "20240101T000000Z", "term", {"mean": 1.0}))
+    mds.index(RESULTS_INDEX, build_result_document("throughput", f"{DEFAULT_PREFIX}-running-10.9.9.9", "29990101T000000Z", "term", {"mean": 1.0}))
+    hits = list(cache.get_documents(mds, query))
+
+    assert len(hits) == NODES * OPERATIONS * 3 * 2 + 1
+    assert f"{DEFAULT_PREFIX}-running-10.9.9.9" in {hit["_source"]["test-execution-id"] for hit in hits}
+
+def test_slow_outlier_is_excluded(load_script, tmp_path):
+    from fake_mds import FakeMDS
+
+    mds = FakeMDS()
+    throughputs = {get_node_ip(node): 10.0 + node % 3 * 0.1 for node in range(10)}
+    # Only the slow side is an outlier, so the fast node stays in the averages
+    throughputs["10.0.1.1"] = 2.0
+    throughputs["10.0.1.2"] = 30.0
+    for ip, throughput in throughputs.items():
+        node_id = f"outliers-1-{ip}"
+        mds.index(RESULTS_INDEX, build_result_document("throughput", node_id, "20240101T000000Z", "term", {"min": throughput, "mean": throughput, "median": throughput}))
+        mds.index(RESULTS_INDEX, build_result_document("service_time", node_id, "20240101T000000Z", "term", {"99_0": 100.0}))
+
+    module = load_script("aggregate-nodes-results.py", mds)
+    module.aggregate_results({}, str(tmp_path / "outliers"), "outliers-1-*", exclude_outliers=True)
+    averaged = read_averaged(tmp_path / "outliers")
+
+    assert [node["ip"] for node in averaged["outliers"]["excluded-nodes"]] == ["10.0.1.1"]
+    assert len(averaged["outliers"]["metrics"]["throughput-mean"]["z-scores"]) == len(throughputs)
+    assert averaged["averaged-throughput"]["mean"] == statistics.mean(throughput for ip, throughput in throughputs.items() if ip != "10.0.1.1")
@@ -1,7 +1,21 @@
+import os
+import re
+import glob
 import pandas as pd
 import argparse
 import numpy as np
 import json
+from concurrent.futures import ProcessPoolExecutor
+
+# Averaged metrics of a TestResult (aggregate-rounds-results.py, aggregate-lg-host-results.py) and of an -averaged.json
+# round (aggregate-nodes-results.py), and the column prefix they get in the wide table
+RESULT_METRICS = {
+    "throughput": ["averaged_throughput", "averaged-throughput"],
+    "service_time": ["averaged_service_time", "averaged-service-time"],
+    "latency": ["averaged_latency", "averaged-latency"]
+}
+CONFIGURATIONS = ["nodes", "clients"]
+FORMATS = ["csv", "parquet"]
 
 def main(filename, output_name):
     # Read the JSON file
@@ -32,10 +46,83 @@ def main(filename, output_name):
     df.to_csv(f"{output_name}.csv", index=False)
     print(f"Outputted to {output_name}.csv")
 
+def convert_batch(inputs, output_name, output_format="csv", decimals=None, max_workers=None):
+    # One row per configuration, with the node count and clients from its test pattern and one column per averaged
+    # value and RSD, e.g. throughput_mean and service_time_99_0_rsd
+    paths = expand_paths(inputs)
+    if not paths:
+        raise Exception(f"No JSON files found in {inputs}")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rows = [row for row in executor.map(build_row, paths, chunksize=16) if row is not None]
+    if not rows:
+        raise Exception(f"None of the {len(paths)} files is a TestResult or an -averaged.json round")
+
+    table = pd.DataFrame(rows)
+    if "throughput_mean" in table and table["nodes"].notna().any():
+        # Throughput is averaged per node, so the throughput of the whole fleet is that times the node count
+        table.insert(table.columns.get_loc("clients") + 1, "fleet_throughput_mean", table["throughput_mean"] * table["nodes"])
+    table = table.sort_values(CONFIGURATIONS + ["file"], na_position="first").reset_index(drop=True)
+    if decimals is not None:
+        table = table.round(decimals)
+
+    if output_format == "parquet":
+        table.to_parquet(f"{output_name}.parquet", index=False)
+    else:
+        table.to_csv(f"{output_name}.csv", index=False)
+    print(f"Converted {len(table)} of {len(paths)} files to {output_name}.{output_format}")
+    return table
+
+def build_row(path):
+    with open(path) as file:
+        data = json.load(file)
+
+    test_patterns = data.get("test_pattern", data.get("test-pattern"))
+    if test_patterns is None:
+        print(f"Skipping {path}: not a TestResult or an -averaged.json round")
+        return None
+    test_patterns = test_patterns if isinstance(test_patterns, list) else [test_patterns]
+
+    row = {"file": path, "test_pattern": ",".join(test_patterns), "rounds": len(test_patterns)}
+    for name in CONFIGURATIONS:
+        row[name] = parse_count(test_patterns, name)
+
+    for prefix, keys in RESULT_METRICS.items():
+        metrics = next((data[key] for key in keys if key in data), {})
+        for key, value in metrics.items():
+            if key != "units":
+                # TestResult fields are _50_0 because of the dataclass, -averaged.json keys are 50_0
+                row[f"{prefix}_{key.lstrip('_')}"] = value
+    return row
+
+def parse_count(test_patterns, name):
+    # Same <N>-nodes / <M>-clients convention as scalability.py, but a file without one (or with several) gets None
+    values = {int(match) for pattern in test_patterns for match in re.findall(rf"(\d+)-{re.escape(name)}", pattern)}
+    return values.pop() if len(values) == 1 else None
+
+def expand_paths(inputs):
+    # Only the top level of a folder is read. A run-scaling-sweep.py folder has the averaged rounds of every
+    # configuration there, and the -averaged.json of each round in a subfolder, which would count it twice.
+    paths = []
+    for input in inputs:
+        if os.path.isdir(input):
+            paths += sorted(glob.glob(os.path.join(input, "*.json")))
+        else:
+            paths += sorted(glob.glob(input))
+    return paths
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert Averaged Results to CSV')
-    parser.add_argument('--file', '-f', help='File of averaged results to convert to CSV')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--file', '-f', help='File of averaged results to convert to CSV')
+    group.add_argument('--batch', '-b', nargs='+', help='TestResult or -averaged.json files, globs or folders (top level only) of them to convert into one table with a row per configuration')
     parser.add_argument('--output-name', '-n', required=True, help='Output filename to use')
+    parser.add_argument('--format', choices=FORMATS, default="csv", help='Format of the --batch table. Default: csv')
+    parser.add_argument('--decimals', type=int, default=None, help='Round the values of the --batch table to this many decimals. Default: no rounding')
+    parser.add_argument('--max-workers', '-w', type=int, default=None, help='Max number of processes parsing --batch files. Default: number of CPUs')
     args = parser.parse_args()
 
-    main(args.file, args.output_name)
+    if args.batch:
+        convert_batch(args.batch, args.output_name, args.format, args.decimals, args.max_workers)
+    else:
+        main(args.file, args.output_name)
@@ -3,160 +3,118 @@ import argparse
 import re
 import json
 import statistics
+import queue
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 
 import pandas as pd
 import tabulate
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, exceptions
-import boto3
-from dotenv import load_dotenv
 
-from config import TestResult, AveragedThroughput, AveragedServiceTime, AveragedLatency
+from clients import load_client_details, create_opensearch_client
+from mds import DocumentStream, build_results_query, get_aggregated_results, sample_stdev, RESULT_METRIC_FIELDS
+from cache import ResultCache
+from histogram import get_sketches, build_percentiles_from_sketches
+from config import TestResult, AveragedThroughput, AveragedServiceTime, AveragedLatency, summarize_rounds, build_averaged_classes
+from lg_resources import load_resource_summaries, build_load_generator_report, DEFAULT_CPU_BOUND_PERCENT
+from tracing import span, trace_run, add_tracing_arguments
 
+# Number of test-execution-id patterns fetched from the MDS at the same time
+DEFAULT_MAX_CONCURRENCY = 8
+# Documents handed over at a time from a fetching thread, and how many of those chunks are buffered per pattern
+CHUNK_DOCUMENTS = 1000
+QUEUE_CHUNKS = 10
 
-def aggregate_rounds_results(client_details: dict, test_execution_id_pattern: str, output_name: str):
-    # Client Creation
-    client = create_opensearch_client(client_details)
-
-    # Since we're aggregating rounds of a specific test configuration, we should be using a pattern
-    documents = get_documents(client, test_execution_id_pattern)
 
-    # Filter the metrics and get a cumulative avg of all results
-    unique_test_ids, throughput_documents, service_time_documents, latency_documents = filter_documents(documents)
-    unique_test_ids = sorted(unique_test_ids)
+def aggregate_rounds_results(client_details: dict, test_execution_id_pattern: str, output_name: str, server_side: bool = False, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, cache: ResultCache = None, histograms: bool = False, by_operation: bool = False, resources: str = None, cpu_bound_percent: float = DEFAULT_CPU_BOUND_PERCENT):
+    # The MDS only returns averages over every operation, so per-operation files need the documents
+    if server_side and by_operation:
+        raise Exception("Results by operation can not be averaged server-side. Drop --server-side to use --by-operation")
 
-    # Get average throughput from all rounds
-    average_throughput_class = build_average_throughput_class(throughput_documents)
-    # print(asdict(average_throughput_class))
+    # Client Creation
+    client = create_opensearch_client(client_details, max_concurrency)
 
-    # Get average service time from all rounds
-    average_service_time_class = build_average_service_time_class(service_time_documents)
-    # print(asdict(average_service_time_class))
+    if server_side:
+        # Let the MDS compute the averages and deviations and only return the aggregated buckets
+        with span("build_average_classes_in_mds"):
+            unique_test_ids, average_throughput_class, average_service_time_class, average_latency_class = build_average_classes_in_mds(client, test_execution_id_pattern)
+    else:
+        # Since we're aggregating rounds of a specific test configuration, we should be using a pattern
+        with span("get_documents"):
+            documents = get_documents(client, test_execution_id_pattern, max_concurrency, cache)
+
+        # Filter the metrics and get a cumulative avg of all results. Documents are streamed, so the MDS pages are fetched inside this span.
+        with span("filter_documents") as counters:
+            unique_test_ids, throughput_documents, service_time_documents, latency_documents = filter_documents(documents)
+            counters["test_execution_ids"] = len(unique_test_ids)
+
+        # Get average throughput, service time and latency from all rounds in one pass
+        with span("build_averaged_classes"):
+            summary = summarize_rounds(throughput_documents, service_time_documents, latency_documents)
+            average_throughput_class, average_service_time_class, average_latency_class = build_averaged_classes(summary.iloc[0])
+
+        if by_operation:
+            write_operation_results(throughput_documents, service_time_documents, latency_documents, sorted(unique_test_ids), output_name)
+
+    if histograms:
+        # Replace the averaged percentiles with percentiles of the raw samples of every test execution merged together
+        with span("get_sketches"):
+            sketches = get_sketches(client, test_execution_id_pattern)
+        average_service_time_class = AveragedServiceTime(*build_percentiles_from_sketches(list(sketches["service_time"].values())), "ms")
+        average_latency_class = AveragedLatency(*build_percentiles_from_sketches(list(sketches["latency"].values())), "ms")
 
-    # Get average latency form all rounds
-    average_latency_class = build_average_latency_class(latency_documents)
-    # print(asdict(average_latency_class))
+    unique_test_ids = sorted(unique_test_ids)
 
     # Generate dataclass and save as a json
     test_result = TestResult(unique_test_ids, average_throughput_class, average_service_time_class, average_latency_class)
     test_result_dict = asdict(test_result)
     print(test_result_dict)
 
-    with open(f"{output_name}.json", "w") as file:
-        json.dump(test_result_dict, file, indent=4)
+    if resources is not None:
+        # Flag the rounds in which the LG host was CPU-bound, from the files written by sample-lg-resources.sh
+        patterns = test_execution_id_pattern if type(test_execution_id_pattern) == list else [test_execution_id_pattern]
+        test_result_dict["load-generators"] = build_load_generator_report(load_resource_summaries(resources, patterns), cpu_bound_percent)
+
+    with span("write_to_file") as counters:
+        formatted_test_result = json.dumps(test_result_dict, indent=4)
+        counters["bytes"] = len(formatted_test_result)
+        with open(f"{output_name}.json", "w") as file:
+            file.write(formatted_test_result)
 
     print(f"Outputted to file called {output_name}.json")
 
 
 
-def build_average_throughput_class(all_round_results):
-    MIN = "min"
-    MEAN = "mean"
-    MEDIAN = "median"
-    units = "ops/s"
-
-    cumulative_min = []
-    cumulative_mean = []
-    cumulative_median = []
-
-    for round_result in all_round_results:
-        cumulative_min.append(round_result[MIN])
-        cumulative_mean.append(round_result[MEAN])
-        cumulative_median.append(round_result[MEDIAN])
-
-    # print(cumulative_min, cumulative_mean, cumulative_median)
-    # print(all_round_results)
-
-    avg_min = statistics.mean(cumulative_min)
-    avg_mean = statistics.mean(cumulative_mean)
-    avg_median = statistics.mean(cumulative_median)
-
-    rsd_min = (statistics.stdev(cumulative_min) / avg_min) * 100
-    rsd_mean = (statistics.stdev(cumulative_mean) / avg_mean) * 100
-    rsd_median = (statistics.stdev(cumulative_median) / avg_median) * 100
-
-    return AveragedThroughput(avg_min, rsd_min, avg_mean, rsd_mean, avg_median, rsd_median, units)
-
-def build_average_service_time_class(all_round_results):
-    P50_SERVICE_TIME = "50_0"
-    P90_SERVICE_TIME = "90_0"
-    P99_SERVICE_TIME = "99_0"
-    P99_9_SERVICE_TIME = "99_9"
-    P99_99_SERVICE_TIME = "99_99"
-    P100_SERVICE_TIME = "100_0"
-    units = "ms"
-
-    cumulative_p50_service_time = []
-    cumulative_p90_service_time = []
-    cumulative_p99_service_time = []
-    cumulative_p99_9_service_time = []
-    cumulative_p99_99_service_time = []
-    cumulative_p100_service_time = []
-
-    for round_result in all_round_results:
-        cumulative_p50_service_time.append(round_result[P50_SERVICE_TIME])
-        cumulative_p90_service_time.append(round_result[P90_SERVICE_TIME])
-        cumulative_p99_service_time.append(round_result[P99_SERVICE_TIME])
-        cumulative_p99_9_service_time.append(round_result[P99_9_SERVICE_TIME])
-        cumulative_p99_99_service_time.append(round_result[P99_99_SERVICE_TIME])
-        cumulative_p100_service_time.append(round_result[P100_SERVICE_TIME])
-
-    avg_p50_service_time = statistics.mean(cumulative_p50_service_time)
-    avg_p90_service_time = statistics.mean(cumulative_p90_service_time)
-    avg_p99_service_time = statistics.mean(cumulative_p99_service_time)
-    avg_p99_9_service_time = statistics.mean(cumulative_p99_9_service_time)
-    avg_p99_99_service_time = statistics.mean(cumulative_p99_99_service_time)
-    avg_p100_service_time = statistics.mean(cumulative_p100_service_time)
-
-    rsd_p50_service_time = (statistics.stdev(cumulative_p50_service_time) / avg_p50_service_time) * 100
-    rsd_p90_service_time = (statistics.stdev(cumulative_p90_service_time) / avg_p90_service_time) * 100
-    rsd_p99_service_time = (statistics.stdev(cumulative_p99_service_time) / avg_p99_service_time) * 100
-    rsd_p99_9_service_time = (statistics.stdev(cumulative_p99_9_service_time) / avg_p99_9_service_time) * 100
-    rsd_p99_99_service_time = (statistics.stdev(cumulative_p99_99_service_time) / avg_p99_99_service_time) * 100
-    rsd_p100_service_time = (statistics.stdev(cumulative_p100_service_time) / avg_p100_service_time) * 100
-
-    return AveragedServiceTime(avg_p50_service_time, rsd_p50_service_time, avg_p90_service_time, rsd_p90_service_time, avg_p99_service_time, rsd_p99_service_time, avg_p99_9_service_time, rsd_p99_9_service_time, avg_p99_99_service_time, rsd_p99_99_service_time, avg_p100_service_time, rsd_p100_service_time, units)
-
-def build_average_latency_class(all_round_results):
-    P50_LATENCY = "50_0"
-    P90_LATENCY = "90_0"
-    P99_LATENCY = "99_0"
-    P99_9_LATENCY = "99_9"
-    P99_99_LATENCY = "99_99"
-    P100_LATENCY = "100_0"
-    units = "ms"
-
-    cumulative_p50_latency = []
-    cumulative_p90_latency = []
-    cumulative_p99_latency = []
-    cumulative_p99_9_latency = []
-    cumulative_p99_99_latency = []
-    cumulative_p100_latency = []
-
-    for round_result in all_round_results:
-        cumulative_p50_latency.append(round_result[P50_LATENCY])
-        cumulative_p90_latency.append(round_result[P90_LATENCY])
-        cumulative_p99_latency.append(round_result[P99_LATENCY])
-        cumulative_p99_9_latency.append(round_result[P99_9_LATENCY])
-        cumulative_p99_99_latency.append(round_result[P99_99_LATENCY])
-        cumulative_p100_latency.append(round_result[P100_LATENCY])
-
-    avg_p50_latency = statistics.mean(cumulative_p50_latency)
-    avg_p90_latency = statistics.mean(cumulative_p90_latency)
-    avg_p99_latency = statistics.mean(cumulative_p99_latency)
-    avg_p99_9_latency = statistics.mean(cumulative_p99_9_latency)
-    avg_p99_99_latency = statistics.mean(cumulative_p99_99_latency)
-    avg_p100_latency = statistics.mean(cumulative_p100_latency)
-
-    rsd_p50_latency = (statistics.stdev(cumulative_p50_latency) / avg_p50_latency) * 100
-    rsd_p90_latency = (statistics.stdev(cumulative_p90_latency) / avg_p90_latency) * 100
-    rsd_p99_latency = (statistics.stdev(cumulative_p99_latency) / avg_p99_latency) * 100
-    rsd_p99_9_latency = (statistics.stdev(cumulative_p99_9_latency) / avg_p99_9_latency) * 100
-    rsd_p99_99_latency = (statistics.stdev(cumulative_p99_99_latency) / avg_p99_99_latency) * 100
-    rsd_p100_latency = (statistics.stdev(cumulative_p100_latency) / avg_p100_latency) * 100
-
-    return AveragedLatency(avg_p50_latency, rsd_p50_latency, avg_p90_latency, rsd_p90_latency, avg_p99_latency, rsd_p99_latency, avg_p99_9_latency, rsd_p99_9_latency, avg_p99_99_latency, rsd_p99_99_latency, avg_p100_latency, rsd_p100_latency, units)
+def write_operation_results(throughput_documents, service_time_documents, latency_documents, unique_test_ids, output_name):
+    # Same averages as the overall result, but with one row and one output file per operation
+    summary = summarize_rounds(throughput_documents, service_time_documents, latency_documents, group_by="operation")
+    for operation, summary_row in summary.iterrows():
+        test_result = TestResult(unique_test_ids, *build_averaged_classes(summary_row))
+        with open(f"{output_name}-{operation}.json", "w") as file:
+            json.dump(asdict(test_result), file, indent=4)
+
+        print(f"Outputted {operation} to file called {output_name}-{operation}.json")
+
+def build_average_classes_in_mds(client, test_execution_id_pattern):
+    unique_test_ids, stats = get_aggregated_results(client, test_execution_id_pattern)
+
+    average_throughput_class = AveragedThroughput(*build_averages_from_stats(stats, "throughput"), "ops/s")
+    average_service_time_class = AveragedServiceTime(*build_averages_from_stats(stats, "service_time"), "ms")
+    average_latency_class = AveragedLatency(*build_averages_from_stats(stats, "latency"), "ms")
+
+    return unique_test_ids, average_throughput_class, average_service_time_class, average_latency_class
+
+def build_averages_from_stats(stats, name):
+    # Flattens extended_stats into [avg, rsd, avg, rsd, ...] in the field order of the averaged dataclasses
+    averages = []
+    for metric in RESULT_METRIC_FIELDS[name]:
+        avg = stats[name][metric]['avg']
+        # A single round has no spread to report
+        rsd = (sample_stdev(stats[name][metric]) / avg) * 100 if stats[name][metric]['count'] > 1 else None
+        averages += [avg, rsd]
+
+    return averages
 
 def filter_documents(documents):
     unique_test_ids = set()
@@ -172,6 +130,7 @@ def filter_documents(documents):
         operation_name = document["_source"]["name"]
         operation_test_id = document["_source"]["test-execution-id"]
         metrics = document["_source"]["value"]
+        metrics["operation"] = document["_source"].get("operation")
         if operation_name == THROUGHPUT:
             throughput_documents.append(metrics)
         elif operation_name == SERVICE_TIME:
@@ -184,84 +143,75 @@ def filter_documents(documents):
     return unique_test_ids, throughput_documents, service_time_documents, latency_documents
 
 
-def get_documents(client, test_execution_id_pattern):
-    INDEX_PATTERN = 'benchmark-results-*'
-    SIZE = 10000
+def get_documents(client, test_execution_id_pattern, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None):
     print(test_execution_id_pattern)
     # For regex patterns
     if "*" in test_execution_id_pattern:
-        query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {
-                            "terms": {
-                                "name": ["throughput", "service_time", "latency"]
-                            }
-                        },
-                        {
-                            "wildcard": {
-                                "test-execution-id": test_execution_id_pattern
-                            }
-                        }
-                    ]
-                }
-            }
-        }
-
-        query_response = client.search(body=query, index=INDEX_PATTERN, size=SIZE)
-        # print(query_response)
-        print("Number of documents returned: ", query_response['hits']['total']['value'])
-        documents = query_response['hits']['hits']
-
-        return documents
+        return fetch_pattern(client, test_execution_id_pattern, cache)
 
     elif type(test_execution_id_pattern) == list:
-
-        test_execution_id_patterns = test_execution_id_pattern
-        documents = []
-        for pattern in test_execution_id_patterns:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "terms": {
-                                    "name": ["throughput", "service_time", "latency"]
-                                }
-                            },
-                            {
-                                "wildcard": {
-                                    "test-execution-id": pattern
-                                }
-                            }
-                        ]
-                    }
-                }
-            }
-
-            query_response = client.search(body=query, index=INDEX_PATTERN, size=SIZE)
-            # print(query_response)
-            print(f"Number of docs received with {pattern}: {query_response['hits']['total']['value']}")
-            documents += query_response['hits']['hits']
-
-        print("Number of documents total: ", len(documents))
-        return documents
-
+        return stream_patterns(client, test_execution_id_pattern, max_concurrency, cache)
 
     else:
         raise Exception("Need pattern to test execution id to aggregate lg host results from all rounds. Example: use test-execution-id*")
 
-
-def create_opensearch_client(client_details):
-    client = OpenSearch(
-        hosts = [f'{host}:{port}'],
-        http_auth = (username, password),
-        use_ssl = True,
-        verify_certs = True,
-        connection_class = RequestsHttpConnection
-    )
-    return client
+def stream_patterns(client, test_execution_id_patterns, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None):
+    # Fetch the patterns concurrently over the shared client and yield them back in the order they were given,
+    # so the whole list takes about as long as the slowest pattern instead of the sum of all of them. Every pattern
+    # is handed over through a bounded queue as its pages arrive, so the first one is consumed while it is fetched.
+    # The others are paused once their queue is full, which holds at most max_concurrency * QUEUE_CHUNKS *
+    # CHUNK_DOCUMENTS documents plus one MDS page per pattern instead of every document of the patterns not yet
+    # yielded.
+    queues = [queue.Queue(maxsize=QUEUE_CHUNKS) for _ in test_execution_id_patterns]
+    stopped = threading.Event()
+    total_documents = 0
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [executor.submit(fetch_into_queue, client, pattern, cache, chunks, stopped) for pattern, chunks in zip(test_execution_id_patterns, queues)]
+        try:
+            for future, chunks in zip(futures, queues):
+                for chunk in iter(chunks.get, None):
+                    yield from chunk
+                    total_documents += len(chunk)
+                # Raises the error of a pattern that could not be fetched
+                future.result()
+        finally:
+            # Unblocks the fetching threads when the documents are not consumed to the end
+            stopped.set()
+            for future in futures:
+                future.cancel()
+
+    print("Number of documents total: ", total_documents)
+
+def fetch_into_queue(client, test_execution_id_pattern, cache, chunks, stopped):
+    # Ends with None, also when fetching fails, so the consumer never waits on a pattern that is gone
+    try:
+        chunk = []
+        for document in fetch_pattern(client, test_execution_id_pattern, cache):
+            chunk.append(document)
+            if len(chunk) == CHUNK_DOCUMENTS:
+                if not put_unless_stopped(chunks, chunk, stopped):
+                    return
+                chunk = []
+        if chunk:
+            put_unless_stopped(chunks, chunk, stopped)
+    finally:
+        put_unless_stopped(chunks, None, stopped)
+
+def put_unless_stopped(chunks, chunk, stopped):
+    while not stopped.is_set():
+        try:
+            chunks.put(chunk, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def fetch_pattern(client, test_execution_id_pattern, cache=None):
+    query = build_results_query(test_execution_id_pattern)
+    if cache is not None:
+        return cache.get_documents(client, query, label=test_execution_id_pattern)
+
+    return DocumentStream(client, query, label=test_execution_id_pattern)
 
 def comma_separated_list(input: str):
     return input.split(',')
@@ -273,26 +223,25 @@ if __name__ == "__main__":
     group.add_argument('--test-ids', '-ids', help='Test Execution IDs to include in the results. Example: id-1,id-2,id-3')
     parser.add_argument('--output-name', '-n', required=True, help='Output filename to use')
     parser.add_argument('--latency', '-l', action='store_true', help='Show latency. Default: False')
+    parser.add_argument('--server-side', '-s', action='store_true', help='Average results with an aggregation in the MDS instead of downloading every document. Default: False')
+    parser.add_argument('--max-concurrency', '-c', type=int, default=DEFAULT_MAX_CONCURRENCY, help=f'Max number of test-execution-id patterns to fetch at the same time. Default: {DEFAULT_MAX_CONCURRENCY}')
+    parser.add_argument('--cache', action='store_true', help='Keep fetched documents in a local cache and only fetch runs that are new or were still in progress. Default: False')
+    parser.add_argument('--offline', action='store_true', help='Only use documents from the local cache without contacting the MDS. Default: False')
+    parser.add_argument('--histograms', action='store_true', help='Report service time and latency percentiles from merged histograms of the raw samples instead of averaging percentiles. Default: False')
+    parser.add_argument('--by-operation', action='store_true', help='Also write one averaged result file per operation. Not available with --server-side. Default: False')
+    parser.add_argument('--resources', help='Folder of <test-execution-id>.resources.csv files from sample-lg-resources.sh. Flags the rounds in which the LG host was CPU-bound in the output. Default: none')
+    parser.add_argument('--cpu-bound-percent', type=float, default=DEFAULT_CPU_BOUND_PERCENT, help=f'Mean CPU busy percent from which the LG host counts as CPU-bound. Default: {DEFAULT_CPU_BOUND_PERCENT}')
+    add_tracing_arguments(parser)
     args = parser.parse_args()
-
-    load_dotenv()
-    host = os.getenv('MDS')
-    port = 443
-    region = os.getenv('AWS_REGION')
-    username = os.getenv('MDS_USERNAME')
-    password = os.getenv('MDS_PASSWORD')
-
-    client_details = {
-        "host": os.getenv('MDS'),
-        "port": 443,
-        "region": os.getenv('AWS_REGION'),
-        "username": os.getenv('MDS_USERNAME'),
-        "password": os.getenv('MDS_PASSWORD')
-    }
-
-    if args.test_id_pattern:
-        aggregate_rounds_results(client_details, args.test_id_pattern, args.output_name)
-    elif args.test_ids:
-        test_ids = args.test_ids.split(",")
-        aggregate_rounds_results(client_details, test_ids, args.output_name)
-
+    if args.server_side and args.by_operation:
+        parser.error("--by-operation needs the documents of every operation, so it can not be combined with --server-side")
+
+    client_details = load_client_details()
+
+    cache = ResultCache(offline=args.offline) if args.cache or args.offline else None
+    with trace_run("aggregate-lg-host-results", args.trace, args.profile):
+        if args.test_id_pattern:
+            aggregate_rounds_results(client_details, args.test_id_pattern, args.output_name, args.server_side, args.max_concurrency, cache, args.histograms, args.by_operation, args.resources, args.cpu_bound_percent)
+        elif args.test_ids:
+            test_ids = args.test_ids.split(",")
+            aggregate_rounds_results(client_details, test_ids, args.output_name, args.server_side, args.max_concurrency, cache, args.histograms, args.by_operation, args.resources, args.cpu_bound_percent)
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from mds import DocumentStream, RESULTS_INDEX_PATTERN
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mds-cache")
+# Runs use a 600s time_period, so anything that started in the last 30 minutes may still be publishing results
+SETTLE_SECONDS = 1800
+TIMESTAMP_FIELD = "test-execution-timestamp"
+# Format of test-execution-timestamp in OSB's results index template (basic_date_time_no_millis)
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+VALUE_PREFIX = "value."
+
+class ResultCache:
+    '''
+    Keeps the hits of each query in a Feather file under cache_dir, keyed by index pattern and query
+    (which includes the test-execution-id or pattern). Runs that started before the high-water mark had
+    finished when they were cached and are never downloaded again. Only documents at or after the
+    high-water mark are fetched and replace what was cached for them.
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, settle_seconds=SETTLE_SECONDS, offline=False):
+        self.cache_dir = cache_dir
+        self.settle_seconds = settle_seconds
+        self.offline = offline
+
+    def get_documents(self, client, query, index_pattern=RESULTS_INDEX_PATTERN, label=None):
+        key = cache_key(index_pattern, query)
+        cached_df, high_water_mark = self._load(key)
+
+        if self.offline:
+            if cached_df is None:
+                raise Exception(f"No cached documents for {label}. Run once without --offline to fill the cache.")
+            print(f"Using {len(cached_df)} cached documents for {label} without contacting the MDS")
+            return frame_to_hits(cached_df)
+
+        fetch_query = query
+        if cached_df is not None:
+            # Drop runs that may still have been in progress when they were cached, they are fetched again below
+            cached_df = cached_df[cached_df[TIMESTAMP_FIELD].fillna("") < high_water_mark]
+            fetch_query = with_minimum_timestamp(query, high_water_mark)
+
+        fetched_at = datetime.now(timezone.utc)
+        fetched_df = hits_to_frame(DocumentStream(client, fetch_query, index_pattern=index_pattern, label=label))
+        print(f"Using {0 if cached_df is None else len(cached_df)} cached documents and {len(fetched_df)} fetched from the MDS for {label}")
+
+        df = pd.concat([cached_df, fetched_df], ignore_index=True) if cached_df is not None else fetched_df
+        df = df.drop_duplicates(subset="_id", keep="last").reset_index(drop=True)
+        new_high_water_mark = (fetched_at - timedelta(seconds=self.settle_seconds)).strftime(TIMESTAMP_FORMAT)
+        self._save(key, df, new_high_water_mark, index_pattern, query)
+
+        return frame_to_hits(df)
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, f"{key}.feather"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key):
+        data_path, meta_path = self._paths(key)
+        if not (os.path.isfile(data_path) and os.path.isfile(meta_path)):
+            return None, None
+
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+
+        return pd.read_feather(data_path), meta["high-water-mark"]
+
+    def _save(self, key, df, high_water_mark, index_pattern, query):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+
+        df.to_feather(data_path)
+        meta = {
+            "index-pattern": index_pattern,
+            "query": query,
+            "high-water-mark": high_water_mark,
+            "documents": len(df)
+        }
+        with open(meta_path, "w") as meta_file:
+            json.dump(meta, meta_file, indent=4)
+
+def cache_key(index_pattern, query):
+    key_source = json.dumps({"index-pattern": index_pattern, "query": query}, sort_keys=True)
+    return hashlib.sha256(key_source.encode()).hexdigest()[:16]
+
+def with_minimum_timestamp(query, timestamp):
+    return {
+        "query": {
+            "bool": {
+                "must": [
+                    query["query"],
+                    {
+                        "range": {
+                            TIMESTAMP_FIELD: {
+                                "gte": timestamp
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+    }
+
+def hits_to_frame(hits):
+    # One row per hit with the nested value fields flattened into value.<metric> columns
+    rows = []
+    for hit in hits:
+        row = {"_id": hit["_id"]}
+        for field, field_value in hit["_source"].items():
+            if field == "value" and isinstance(field_value, dict):
+                for metric, metric_value in field_value.items():
+                    row[VALUE_PREFIX + metric] = metric_value
+            else:
+                row[field] = field_value
+        rows.append(row)
+
+    df = pd.DataFrame(rows, columns=None if rows else ["_id", TIMESTAMP_FIELD])
+    if TIMESTAMP_FIELD not in df.columns:
+        df[TIMESTAMP_FIELD] = None
+    return df
+
+def frame_to_hits(df):
+    hits = []
+    for row in df.to_dict("records"):
+        source = {}
+        value = {}
+        for column, column_value in row.items():
+            # Columns that only exist for some result names are NaN for the others
+            if column == "_id" or column_value is None or (isinstance(column_value, float) and column_value != column_value):
+                continue
+            if column.startswith(VALUE_PREFIX):
+                value[column[len(VALUE_PREFIX):]] = column_value
+            else:
+                source[column] = column_value
+        if value:
+            source["value"] = value
+        hits.append({"_id": row["_id"], "_source": source})
+
+    return hits
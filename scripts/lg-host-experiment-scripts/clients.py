@@ -0,0 +1,58 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from tracing import span, count
+
+MDS_PORT = 443
+
+# The MDS client is built from .env when it is needed. opensearchpy is imported inside the functions, so importing
+# this module stays cheap. The AWS clients are in asg-experiment-scripts/clients.py, since nothing here talks to AWS.
+@lru_cache(maxsize=None)
+def load_environment():
+    load_dotenv()
+
+def load_client_details():
+    load_environment()
+    return {
+        "host": os.getenv('MDS'),
+        "port": MDS_PORT,
+        "region": os.getenv('AWS_REGION'),
+        "username": os.getenv('MDS_USERNAME'),
+        "password": os.getenv('MDS_PASSWORD')
+    }
+
+def create_opensearch_client(client_details, pool_maxsize=None):
+    from opensearchpy import OpenSearch
+
+    options = {}
+    if pool_maxsize is not None:
+        # One pooled connection per concurrent fetch
+        options["pool_maxsize"] = pool_maxsize
+
+    client = OpenSearch(
+        hosts = [f"{client_details['host']}:{client_details['port']}"],
+        http_auth = (client_details['username'], client_details['password']),
+        use_ssl = True,
+        verify_certs = True,
+        connection_class = get_traced_connection_class(),
+        **options
+    )
+    return client
+
+@lru_cache(maxsize=None)
+def get_traced_connection_class():
+    # Times every MDS request and counts the bytes of its response. Decoding the JSON happens after this, so it
+    # shows up as the rest of the span the request is made in.
+    from opensearchpy import RequestsHttpConnection
+
+    class TracedConnection(RequestsHttpConnection):
+        def perform_request(self, method, url, *args, **kwargs):
+            with span("mds.request", method=method, url=url) as counters:
+                status, headers, data = super().perform_request(method, url, *args, **kwargs)
+                counters["bytes"] = len(data or "")
+            count(mds_requests=1, mds_bytes=len(data or ""))
+            return status, headers, data
+
+    return TracedConnection
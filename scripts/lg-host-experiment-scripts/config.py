@@ -1,6 +1,9 @@
 from dataclasses import dataclass, field
 from typing import Dict, List
 
+import numpy as np
+import pandas as pd
+
 @dataclass
 class AveragedThroughput:
     min: float
@@ -61,3 +64,49 @@ class TestResult:
             averaged_service_time=averaged_service_time,
             averaged_latency=averaged_latency
         )
+
+THROUGHPUT_METRICS = ["min", "mean", "median"]
+PERCENTILE_METRICS = ["50_0", "90_0", "99_0", "99_9", "99_99", "100_0"]
+AVERAGED_METRICS = {
+    "throughput": (THROUGHPUT_METRICS, AveragedThroughput, "ops/s"),
+    "service_time": (PERCENTILE_METRICS, AveragedServiceTime, "ms"),
+    "latency": (PERCENTILE_METRICS, AveragedLatency, "ms")
+}
+
+def summarize_rounds(throughput_results: List[Dict], service_time_results: List[Dict], latency_results: List[Dict], group_by: str = None) -> pd.DataFrame:
+    '''
+    Loads the results of every round into one DataFrame per metric, with a column per value (e.g. min or 99_0),
+    and computes the mean and RSD of every column in a single vectorized pass. Returns one row per group
+    (e.g. per operation when group_by="operation"), or a single row when group_by is None, with columns
+    named <metric>.<value> and <metric>.<value>_rsd. RSD is NaN when a group only has one round.
+    '''
+    summaries = []
+    for name, results in [("throughput", throughput_results), ("service_time", service_time_results), ("latency", latency_results)]:
+        metrics = AVERAGED_METRICS[name][0]
+        rounds = pd.DataFrame.from_records(results, columns=metrics + ([group_by] if group_by else []))
+        values = rounds[metrics].apply(pd.to_numeric, errors="coerce")
+        grouped = values.groupby(rounds[group_by] if group_by else np.zeros(len(rounds), dtype=int), dropna=False)
+
+        means = grouped.mean()
+        # pandas returns NaN for the sample standard deviation of a single round instead of raising like statistics.stdev
+        rsds = grouped.std(ddof=1) / means * 100
+
+        summary = pd.concat([means.add_prefix(f"{name}."), rsds.add_suffix("_rsd").add_prefix(f"{name}.")], axis=1)
+        summaries.append(summary)
+
+    return pd.concat(summaries, axis=1)
+
+def build_averaged_classes(summary_row: pd.Series):
+    # Builds AveragedThroughput, AveragedServiceTime and AveragedLatency from one row of summarize_rounds
+    averaged_classes = []
+    for name, (metrics, averaged_class, units) in AVERAGED_METRICS.items():
+        values = []
+        for metric in metrics:
+            values += [_to_float(summary_row[f"{name}.{metric}"]), _to_float(summary_row[f"{name}.{metric}_rsd"])]
+        averaged_classes.append(averaged_class(*values, units))
+
+    return tuple(averaged_classes)
+
+def _to_float(value):
+    # NaN is not valid JSON, so undefined values are written as null
+    return None if pd.isna(value) else float(value)
@@ -0,0 +1,69 @@
+import os
+import glob
+import math
+
+# sample-lg-resources.sh writes <test-execution-id>.resources.csv next to the --results-file of each node
+RESOURCES_SUFFIX = ".resources.csv"
+DEFAULT_CPU_BOUND_PERCENT = 90.0
+
+def read_resource_samples(path):
+    # pandas is imported here so collect-nodes-results.py can use RESOURCES_SUFFIX without loading it
+    import pandas as pd
+
+    return pd.read_csv(path).sort_values("timestamp")
+
+def summarize_resource_samples(samples):
+    # Network counters are cumulative, so rates come from the difference between consecutive samples
+    seconds = samples["timestamp"].diff()
+    rx_mbps = samples["rx_bytes"].diff() * 8 / 1e6 / seconds
+    tx_mbps = samples["tx_bytes"].diff() * 8 / 1e6 / seconds
+
+    return {
+        "samples": len(samples),
+        "cpus": int(samples["cpus"].iloc[0]),
+        "cpu-busy-mean": _to_float(samples["cpu_busy_percent"].mean()),
+        "cpu-busy-p95": _to_float(samples["cpu_busy_percent"].quantile(0.95)),
+        "procs-running-mean": _to_float(samples["procs_running"].mean()),
+        "procs-running-max": _to_float(samples["procs_running"].max()),
+        "rx-mbps-mean": _to_float(rx_mbps.mean()),
+        "tx-mbps-mean": _to_float(tx_mbps.mean()),
+        "tcp-sockets-max": _to_float(samples["tcp_sockets"].max())
+    }
+
+def is_cpu_bound(summary, cpu_bound_percent=DEFAULT_CPU_BOUND_PERCENT):
+    # A node is CPU-bound when its CPUs were busy most of the run, or more processes were runnable than it has CPUs
+    return summary["cpu-busy-mean"] >= cpu_bound_percent or summary["procs-running-mean"] > summary["cpus"]
+
+def load_resource_summaries(folder, test_execution_id_patterns=None):
+    # Returns {test-execution-id: summary} for every resources file in folder whose test-execution-id matches one of the
+    # patterns, or for every resources file without patterns
+    paths = set()
+    for pattern in test_execution_id_patterns or ["*"]:
+        paths.update(glob.glob(os.path.join(folder, f"{pattern}{RESOURCES_SUFFIX}")))
+
+    summaries = {}
+    for path in sorted(paths):
+        node_id = os.path.basename(path)[:-len(RESOURCES_SUFFIX)]
+        samples = read_resource_samples(path)
+        if len(samples) < 2:
+            print(f"Skipping {path}: not enough samples")
+            continue
+        summaries[node_id] = summarize_resource_samples(samples)
+
+    print(f"Resource samples found for {len(summaries)} nodes")
+    return summaries
+
+def build_load_generator_report(summaries, cpu_bound_percent=DEFAULT_CPU_BOUND_PERCENT):
+    cpu_bound_nodes = sorted(node_id for node_id, summary in summaries.items() if is_cpu_bound(summary, cpu_bound_percent))
+    if cpu_bound_nodes:
+        print(f"CPU-bound load generators ({len(cpu_bound_nodes)}): ", cpu_bound_nodes)
+
+    return {
+        "cpu-bound-percent": cpu_bound_percent,
+        "cpu-bound-nodes": cpu_bound_nodes,
+        "nodes": summaries
+    }
+
+def _to_float(value):
+    # NaN is not valid JSON, so undefined values are written as null
+    return None if value is None or math.isnan(value) else float(value)
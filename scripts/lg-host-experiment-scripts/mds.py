@@ -0,0 +1,265 @@
+import math
+
+from opensearchpy import exceptions
+
+from tracing import span, count
+
+RESULTS_INDEX_PATTERN = 'benchmark-results-*'
+RESULT_NAMES = ["throughput", "service_time", "latency"]
+# Only the fields the aggregation scripts read from each result document, plus the timestamp the local cache pages on
+RESULT_SOURCE_FIELDS = ["name", "test-execution-id", "test-execution-timestamp", "operation", "value"]
+# Fields under `value` that the scripts average for each result name
+RESULT_METRIC_FIELDS = {
+    "throughput": ["min", "mean", "median"],
+    "service_time": ["50_0", "90_0", "99_0", "99_9", "99_99", "100_0"],
+    "latency": ["50_0", "90_0", "99_0", "99_9", "99_99", "100_0"]
+}
+
+# 10,000 is the default index.max_result_window, so it is the largest page we can ask for
+PAGE_SIZE = 10000
+KEEP_ALIVE = "5m"
+# Within a PIT, _shard_doc orders hits by shard and Lucene doc id. It is unique and needs no fielddata, so it is
+# the cheapest search_after tiebreaker. It only exists in a PIT, so searches without one sort on _id instead.
+PIT_SORT = [{"_shard_doc": "asc"}]
+DEFAULT_SORT = [{"_id": "asc"}]
+# Test-execution-ids per page of get_latest_results
+NODE_PAGE_SIZE = 1000
+
+def build_results_query(test_execution_id, names=RESULT_NAMES):
+    name_filter = {
+        "terms": {
+            "name": names
+        }
+    }
+
+    if test_execution_id is None or len(test_execution_id) == 0:
+        return {"query": name_filter}
+
+    # For a list of patterns, match documents from any of them
+    if type(test_execution_id) == list:
+        id_filter = {
+            "bool": {
+                "should": [{"wildcard": {"test-execution-id": pattern}} for pattern in test_execution_id],
+                "minimum_should_match": 1
+            }
+        }
+    # For regex patterns
+    elif "*" in test_execution_id:
+        id_filter = {
+            "wildcard": {
+                "test-execution-id": test_execution_id
+            }
+        }
+    else:
+        id_filter = {
+            "term": {
+                "test-execution-id": test_execution_id
+            }
+        }
+
+    return {
+        "query": {
+            "bool": {
+                "must": [name_filter, id_filter]
+            }
+        }
+    }
+
+def build_results_aggregation_query(test_execution_id, max_test_execution_ids=PAGE_SIZE):
+    # Returns only aggregated buckets: the matching test-execution-ids and, for every result name,
+    # extended_stats (count, avg, variance, ...) over each of its value fields
+    query = build_results_query(test_execution_id)
+    query["size"] = 0
+    query["track_total_hits"] = True
+    query["aggs"] = {
+        "test-execution-ids": {
+            "terms": {
+                "field": "test-execution-id",
+                "size": max_test_execution_ids
+            }
+        }
+    }
+
+    for name, metric_fields in RESULT_METRIC_FIELDS.items():
+        query["aggs"][name] = {
+            "filter": {
+                "term": {
+                    "name": name
+                }
+            },
+            "aggs": {metric: {"extended_stats": {"field": f"value.{metric}"}} for metric in metric_fields}
+        }
+
+    return query
+
+def build_latest_results_query(test_execution_id, page_size=NODE_PAGE_SIZE, after=None):
+    # One bucket per test-execution-id with the document of the last operation (by name) of every result name in it.
+    # aggregate-nodes-results.py keeps the same one of each node when a node has one per operation, so this is the
+    # same document without fetching the others.
+    query = build_results_query(test_execution_id)
+    query["size"] = 0
+    composite = {
+        "size": page_size,
+        "sources": [{"test-execution-id": {"terms": {"field": "test-execution-id"}}}]
+    }
+    if after is not None:
+        composite["after"] = after
+
+    query["aggs"] = {
+        "nodes": {
+            "composite": composite,
+            "aggs": {
+                name: {
+                    "filter": {
+                        "term": {
+                            "name": name
+                        }
+                    },
+                    "aggs": {"latest": {"top_hits": {"size": 1, "sort": [{"operation": {"order": "desc"}}], "_source": RESULT_SOURCE_FIELDS}}}
+                } for name in RESULT_NAMES
+            }
+        }
+    }
+    return query
+
+def get_latest_results(client, test_execution_id, index_pattern=RESULTS_INDEX_PATTERN, page_size=NODE_PAGE_SIZE):
+    # Yields hits like DocumentStream, but only the one document per node and result name picked in the MDS.
+    # The nodes are paged with the composite aggregation, so any number of them fits.
+    after = None
+    while True:
+        with span("mds.latest_results_page", label=str(test_execution_id)) as counters:
+            query_response = client.search(body=build_latest_results_query(test_execution_id, page_size, after), index=index_pattern)
+            nodes = query_response['aggregations']['nodes']
+            counters["nodes"] = len(nodes['buckets'])
+        count(documents=sum(len(bucket[name]['latest']['hits']['hits']) for bucket in nodes['buckets'] for name in RESULT_NAMES))
+
+        for bucket in nodes['buckets']:
+            for name in RESULT_NAMES:
+                yield from bucket[name]['latest']['hits']['hits']
+
+        after = nodes.get('after_key')
+        if after is None or len(nodes['buckets']) < page_size:
+            return
+
+def get_aggregated_results(client, test_execution_id, index_pattern=RESULTS_INDEX_PATTERN):
+    query = build_results_aggregation_query(test_execution_id)
+    query_response = client.search(body=query, index=index_pattern)
+    aggregations = query_response['aggregations']
+
+    if aggregations['test-execution-ids']['sum_other_doc_count'] > 0:
+        print("WARNING: More test-execution-ids matched than were returned. The list of ids is incomplete.")
+    test_execution_ids = [bucket['key'] for bucket in aggregations['test-execution-ids']['buckets']]
+
+    stats = {}
+    for name, metric_fields in RESULT_METRIC_FIELDS.items():
+        stats[name] = {metric: aggregations[name][metric] for metric in metric_fields}
+        stats[name]["doc_count"] = aggregations[name]['doc_count']
+
+    print("Number of documents aggregated in the MDS: ", query_response['hits']['total']['value'])
+    return test_execution_ids, stats
+
+def sample_stdev(metric_stats):
+    # extended_stats reports the population variance, statistics.stdev uses the sample variance
+    count = metric_stats['count']
+    if count < 2:
+        raise Exception(f"Need at least two values to calculate a standard deviation, got {count}")
+
+    return math.sqrt(metric_stats['variance'] * count / (count - 1))
+
+class DocumentStream:
+    '''
+    Iterates over every hit matching a query, page by page, with a point in time (PIT) and search_after
+    instead of a single capped search. Hits are yielded as soon as each page arrives. Once the stream is
+    exhausted, `fetched` and `total` hold the number of hits received and the number the MDS reported.
+    Without a sort, pages are sorted on _shard_doc in a PIT and on _id without one.
+    '''
+    def __init__(self, client, query, index_pattern=RESULTS_INDEX_PATTERN, source_fields=RESULT_SOURCE_FIELDS,
+                 page_size=PAGE_SIZE, keep_alive=KEEP_ALIVE, sort=None, label=None, use_pit=True):
+        self.client = client
+        self.query = query
+        self.index_pattern = index_pattern
+        self.source_fields = source_fields
+        self.page_size = page_size
+        self.keep_alive = keep_alive
+        self.sort = sort
+        self.label = label if label is not None else index_pattern
+        # Clusters limit how many PITs can be open at once, so many streams consumed side by side can page without one
+        self.use_pit = use_pit
+        self.fetched = 0
+        self.total = None
+
+    def __iter__(self):
+        self.fetched = 0
+        self.total = None
+        pit_id = self._create_pit()
+
+        try:
+            search_after = None
+            while True:
+                with span("mds.search_page", index=self.index_pattern, label=str(self.label)) as counters:
+                    response = self._search_page(pit_id, search_after)
+                    counters["hits"] = len(response['hits']['hits'])
+                if self.total is None:
+                    self.total = response['hits']['total']['value']
+
+                # The PIT id can change between pages and the latest one must be used
+                pit_id = response.get('pit_id', pit_id)
+                hits = response['hits']['hits']
+                count(documents=len(hits))
+                for hit in hits:
+                    yield hit
+                self.fetched += len(hits)
+
+                if len(hits) < self.page_size:
+                    break
+                search_after = hits[-1]['sort']
+        finally:
+            self._delete_pit(pit_id)
+
+        self.report()
+
+    def report(self):
+        print(f"Number of documents returned for {self.label}: {self.fetched} of {self.total}")
+        if self.total is not None and self.fetched != self.total:
+            print(f"WARNING: Fetched {self.fetched} documents but the MDS reported {self.total} for {self.label}. Results are incomplete.")
+
+    def _search_page(self, pit_id, search_after):
+        body = dict(self.query)
+        body["size"] = self.page_size
+        if self.sort is not None:
+            body["sort"] = self.sort
+        else:
+            body["sort"] = DEFAULT_SORT if pit_id is None else PIT_SORT
+        # Without this, hits.total stops counting at 10,000
+        body["track_total_hits"] = True
+        if self.source_fields is not None:
+            body["_source"] = self.source_fields
+        if search_after is not None:
+            body["search_after"] = search_after
+
+        if pit_id is None:
+            return self.client.search(body=body, index=self.index_pattern)
+
+        body["pit"] = {"id": pit_id, "keep_alive": self.keep_alive}
+        return self.client.search(body=body)
+
+    def _create_pit(self):
+        if not self.use_pit:
+            return None
+
+        # Clusters older than OpenSearch 2.4 have no PIT API. Results of completed runs do not change,
+        # so plain search_after still pages through them consistently.
+        try:
+            return self.client.create_pit(index=self.index_pattern, keep_alive=self.keep_alive)['pit_id']
+        except (exceptions.NotFoundError, exceptions.RequestError) as e:
+            print("Unable to create point in time, paging without one: ", e)
+            return None
+
+    def _delete_pit(self, pit_id):
+        if pit_id is None:
+            return
+
+        try:
+            self.client.delete_pit(body={"pit_id": [pit_id]})
+        except exceptions.TransportError as e:
+            print("Unable to delete point in time: ", e)
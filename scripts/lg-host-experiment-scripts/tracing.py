@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+PROFILE_TOP_FUNCTIONS = 20
+PROFILE_TOP_ALLOCATIONS = 10
+
+class Tracer:
+    '''
+    Records the phases of a run as spans with their wall time, thread and counters (documents, bytes, API calls,
+    retries, ...), and writes them in the Chrome trace format that chrome://tracing and ui.perfetto.dev open.
+    Spans nest per thread, and counters added with count() roll up into every span open on the thread, so a
+    phase reports the bytes and retries of the requests made inside it. Nothing is recorded until it is enabled.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread_ids = {}
+
+    @contextmanager
+    def span(self, name, **args):
+        # Yields the span's args, so the caller can add counters that are only known at the end
+        if not self.enabled:
+            yield args
+            return
+
+        stack = self._stack()
+        stack.append(args)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self._lock:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": round((start - self._origin) * 1e6, 1),
+                    "dur": round((end - start) * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": self._thread_ids.setdefault(threading.get_ident(), len(self._thread_ids)),
+                    "args": args
+                })
+
+    def count(self, **counters):
+        if not self.enabled:
+            return
+        for args in self._stack():
+            for counter, value in counters.items():
+                args[counter] = args.get(counter, 0) + value
+
+    def write(self, path):
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, trace_file)
+        print(f"Wrote {len(self.events)} spans to {path}")
+
+    def summarize(self):
+        # Returns {span name: {"count", "total-ms", <counter>: sum}} over every recorded span
+        summary = {}
+        for event in self.events:
+            totals = summary.setdefault(event["name"], {"count": 0, "total-ms": 0.0})
+            totals["count"] += 1
+            totals["total-ms"] += event["dur"] / 1000
+            for counter, value in event["args"].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[counter] = totals.get(counter, 0) + value
+        return summary
+
+    def print_summary(self):
+        summary = sorted(self.summarize().items(), key=lambda item: item[1]["total-ms"], reverse=True)
+        print("Phase timings:")
+        for name, totals in summary:
+            counters = ", ".join(f"{counter}: {value}" for counter, value in totals.items() if counter not in ["count", "total-ms"])
+            print(f"  {name}: {totals['total-ms']:.1f} ms over {totals['count']} span(s)" + (f" ({counters})" if counters else ""))
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+TRACER = Tracer()
+
+def span(name, **args):
+    return TRACER.span(name, **args)
+
+def count(**counters):
+    TRACER.count(**counters)
+
+@contextmanager
+def trace_run(name, trace_path=None, profile=False):
+    # Wraps a whole run of a script in a root span. With trace_path the spans are written there as a Chrome trace.
+    # With profile the run is also profiled with cProfile, which only sees the main thread, and tracemalloc.
+    # The stats go to <name>.prof, and the slowest functions and largest allocations are printed.
+    TRACER.enabled = trace_path is not None or profile
+    profiler = None
+    if profile:
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        with span(name):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            print_profile(profiler, name)
+        if TRACER.enabled:
+            TRACER.print_summary()
+        if trace_path is not None:
+            TRACER.write(trace_path)
+
+def print_profile(profiler, name):
+    import pstats
+    import tracemalloc
+
+    profiler.dump_stats(f"{name}.prof")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    print(f"Wrote cProfile stats to {name}.prof")
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Python allocations: {current / 1e6:.1f} MB at the end, {peak / 1e6:.1f} MB at the peak")
+    for statistic in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+        print(f"  {statistic}")
+
+def add_tracing_arguments(parser):
+    parser.add_argument('--trace', help='Write the wall time, documents, bytes and API retries of every phase to this file as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev). Default: none')
+    parser.add_argument('--profile', action='store_true', help='Also profile the run with cProfile and tracemalloc, and write the cProfile stats to <script>.prof. Default: False')
@@ -1,32 +1,166 @@
+import os
 import re
+import glob
+import gzip
+import mmap
 import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import tabulate
+
+JOIN_MARKER = b"reached join point"
+# benchmark.log lines start with "%Y-%m-%d %H:%M:%S,<msecs> " in UTC. msecs are not zero-padded.
+JOIN_PATTERN = re.compile(rb"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d+) .*?Worker\[(\d+)\] reached join point (?:at|for) index \[?(\d+)")
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+DEFAULT_SLOWEST_WORKERS = 10
 
 '''
-Prerequisites: Cat a benchmark.log file and grep for "reached join point for index". Copy the output for the workers that relate to a specific time or test and paste it into a file. Then run the script.
+Finds the "Worker[N] reached join point at index [K]" lines in OSB benchmark.log files and reports how far apart
+the workers of each node arrived at each join point, and which workers were the slowest. No need to grep the
+logs first: every log is read in one pass and the logs of many nodes are read in parallel.
 '''
-def sort_log_file(input_file, output_file):
-    with open(input_file, 'r') as file:
-        log_lines = file.readlines()
+def analyze_join_points(paths, output_name=None, sorted_output=None, max_workers=None, since=None, until=None, slowest_workers=DEFAULT_SLOWEST_WORKERS):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        scans = list(executor.map(scan_log, paths))
+
+    events = []
+    for path, (node_events, skipped_lines) in zip(paths, scans):
+        node = get_node_name(path, paths)
+        print(f"{node}: {len(node_events)} join point events" + (f", {skipped_lines} without a timestamp" if skipped_lines else ""))
+        events += [(node, *event) for event in node_events]
+
+    if sorted_output is not None:
+        # The output of the old grep-and-sort workflow: the join point lines ordered by node and worker
+        write_sorted_lines(events, sorted_output)
+
+    events = pd.DataFrame(events, columns=["node", "timestamp", "worker", "join_index", "line"]).drop(columns="line")
+    if since is not None:
+        events = events[events["timestamp"] >= since.timestamp()]
+    if until is not None:
+        events = events[events["timestamp"] <= until.timestamp()]
+    if events.empty:
+        print("No join point events found")
+        return None, None
+
+    join_points, workers = summarize_join_points(events)
+
+    print(tabulate.tabulate(join_points, headers='keys', tablefmt='grid', showindex=False))
+    print(f"Slowest {slowest_workers} workers by mean arrival lag:")
+    print(tabulate.tabulate(workers.head(slowest_workers), headers='keys', tablefmt='grid', showindex=False))
+
+    if output_name is not None:
+        events.assign(time=pd.to_datetime(events["timestamp"], unit="s", utc=True)).to_csv(f"{output_name}-events.csv", index=False)
+        join_points.to_csv(f"{output_name}-join-points.csv", index=False)
+        workers.to_csv(f"{output_name}-workers.csv", index=False)
+        print(f"Outputted to {output_name}-events.csv, {output_name}-join-points.csv and {output_name}-workers.csv")
+
+    return join_points, workers
+
+def scan_log(path):
+    # Returns ([(timestamp, worker, join index, line)], lines without a timestamp). Plain logs are memory-mapped
+    # and searched for JOIN_MARKER, so only the join point lines are decoded. Gzipped logs are read in chunks.
+    events = []
+    skipped_lines = 0
+    for line in find_join_lines(path):
+        match = JOIN_PATTERN.search(line)
+        if match is None:
+            skipped_lines += 1
+            continue
+        seconds = datetime.strptime(match.group(1).decode(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        events.append((seconds + int(match.group(2)) / 1000, int(match.group(3)), int(match.group(4)), line.decode(errors="replace")))
+
+    return events, skipped_lines
+
+def find_join_lines(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as log_file:
+            remainder = b""
+            while True:
+                chunk = log_file.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                lines = (remainder + chunk).split(b"\n")
+                remainder = lines.pop()
+                yield from (line for line in lines if JOIN_MARKER in line)
+            if JOIN_MARKER in remainder:
+                yield remainder
+        return
+
+    with open(path, "rb") as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            position = log.find(JOIN_MARKER)
+            while position != -1:
+                start = log.rfind(b"\n", 0, position) + 1
+                end = log.find(b"\n", position)
+                end = len(log) if end == -1 else end
+                yield log[start:end]
+                position = log.find(JOIN_MARKER, end)
+
+def summarize_join_points(events):
+    # A worker reaches each join index once per test execution, so a repeated (node, worker, index) starts a new run
+    events = events.sort_values("timestamp").copy()
+    events["run"] = events.groupby(["node", "worker", "join_index"]).cumcount() + 1
+    groups = events.groupby(["node", "run", "join_index"])
+    events["lag_ms"] = (events["timestamp"] - groups["timestamp"].transform("min")) * 1000
+    events["last"] = events["lag_ms"] == groups["lag_ms"].transform("max")
+
+    join_points = groups.agg(
+        workers=("worker", "count"),
+        first_arrival=("timestamp", "min"),
+        skew_ms=("lag_ms", "max"),
+        median_lag_ms=("lag_ms", "median")
+    ).reset_index()
+    join_points["first_arrival"] = pd.to_datetime(join_points["first_arrival"], unit="s", utc=True)
+    join_points["slowest_worker"] = events.loc[groups["lag_ms"].idxmax().values, "worker"].values
+    join_points = join_points.sort_values(["node", "first_arrival"])
+
+    workers = events.groupby(["node", "worker"]).agg(
+        join_points=("join_index", "count"),
+        mean_lag_ms=("lag_ms", "mean"),
+        max_lag_ms=("lag_ms", "max"),
+        times_last=("last", "sum")
+    ).reset_index().sort_values("mean_lag_ms", ascending=False)
+
+    return join_points, workers
 
-    pattern = r'Worker\[(\d+)\]'
+def write_sorted_lines(events, output_file):
+    with open(output_file, "w") as file:
+        for node, timestamp, worker, join_index, line in sorted(events, key=lambda event: (event[0], event[2], event[1])):
+            file.write(line + "\n")
+    print(f"Wrote {len(events)} join point lines sorted by worker to {output_file}")
 
-    log_entries = []
-    for line in log_lines:
-        match = re.search(pattern, line)
-        if match:
-            worker_number = int(match.group(1))
-            log_entries.append((worker_number, line))
+def get_node_name(path, paths):
+    # Logs in a single folder are one node each (e.g. <ip>.log). Otherwise every folder is a node, so the rotated
+    # logs of a node (benchmark.log, benchmark.log.1.gz, ...) are read as one.
+    if len({os.path.dirname(os.path.abspath(other)) for other in paths}) == 1:
+        return os.path.basename(path)
+    return os.path.relpath(os.path.dirname(os.path.abspath(path)))
 
-    log_entries.sort(key=lambda x: x[0])
+def expand_paths(paths):
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded += sorted(glob.glob(os.path.join(path, "**", "benchmark.log*"), recursive=True))
+        else:
+            expanded += sorted(glob.glob(path)) or [path]
+    return expanded
 
-    with open(output_file, 'w') as file:
-        for worker_number, line in log_entries:
-            file.write(line)
+def parse_utc_time(input: str):
+    return datetime.fromisoformat(input).replace(tzinfo=timezone.utc)
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Sort log file based on Worker number')
-    parser.add_argument('-f', '--file', type=str, required=True, help='Input log file')
-    parser.add_argument('-o', '--output', type=str, required=True, help='Output sorted log file')
+    parser = argparse.ArgumentParser(description='Report the arrival skew of workers at the join points in OSB benchmark.log files')
+    parser.add_argument('-f', '--file', nargs='+', required=True, help='benchmark.log files (plain or .gz), globs, or folders to search for benchmark.log* files, one per node')
+    parser.add_argument('-n', '--output-name', help='Write the events, join points and workers to <output-name>-events.csv, -join-points.csv and -workers.csv. Default: none')
+    parser.add_argument('-o', '--output', help='Also write the join point lines sorted by node and worker to this file. Default: none')
+    parser.add_argument('-w', '--max-workers', type=int, default=None, help='Max number of logs to read at the same time. Default: number of CPUs')
+    parser.add_argument('--since', type=parse_utc_time, help='Only use join points at or after this UTC time, e.g. "2024-05-02 18:00:00". Default: none')
+    parser.add_argument('--until', type=parse_utc_time, help='Only use join points at or before this UTC time. Default: none')
+    parser.add_argument('--slowest-workers', type=int, default=DEFAULT_SLOWEST_WORKERS, help=f'Number of slowest workers to print. Default: {DEFAULT_SLOWEST_WORKERS}')
     args = parser.parse_args()
 
-    sort_log_file(args.file, args.output)
+    analyze_join_points(expand_paths(args.file), args.output_name, args.output, args.max_workers, args.since, args.until, args.slowest_workers)
@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+import time
+import runpy
+import argparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ASG_DIR = os.path.join(SCRIPTS_DIR, "asg-experiment-scripts")
+LG_HOST_DIR = os.path.join(SCRIPTS_DIR, "lg-host-experiment-scripts")
+DEFAULT_REPEATS = 5
+DEFAULT_SLOWEST_IMPORTS = 5
+
+# Subcommand: (folder, script, help). A script is only loaded when its subcommand runs, so every subcommand only
+# imports what its own script needs. kill-osb-on-asg.py never loads pandas, numpy or tabulate.
+COMMANDS = {
+    "asg": (ASG_DIR, "asg_manager.py", "Create, update or delete an Auto Scaling Group, or list its instances"),
+    "run": (ASG_DIR, "run-osb-on-asg.py", "Run a round of OSB on every ASG instance"),
+    "kill": (ASG_DIR, "kill-osb-on-asg.py", "Stop OSB on every ASG instance and confirm that it exited"),
+    "collect": (ASG_DIR, "collect-nodes-results.py", "Collect the results files of a round from every ASG instance"),
+    "sweep": (ASG_DIR, "run-scaling-sweep.py", "Run and aggregate a scaling sweep on the ASG"),
+    "aggregate nodes": (ASG_DIR, "aggregate-nodes-results.py", "Aggregate the results of every node in a round"),
+    "aggregate rounds": (ASG_DIR, "aggregate-rounds-results.py", "Average the aggregated rounds in a folder"),
+    "aggregate fleet-timeseries": (ASG_DIR, "aggregate-fleet-timeseries.py", "Build the fleet-wide throughput time series of a round"),
+    "aggregate lg-host": (LG_HOST_DIR, "aggregate-lg-host-results.py", "Aggregate the rounds of an LG host"),
+    "convert": (SCRIPTS_DIR, "convert-to-csv.py", "Convert averaged results, or a whole sweep of them, to CSV or Parquet"),
+    "plot": (SCRIPTS_DIR, "plot.py", "Plot columns of one or more CSVs, with groups, error bars and log axes"),
+    "scalability": (SCRIPTS_DIR, "scalability.py", "Fit Amdahl's law and the USL to the throughput of a sweep"),
+    "join-points": (SCRIPTS_DIR, "order-log-workers.py", "Report worker arrival skew at the join points in benchmark.log files"),
+    "benchmark aggregation": (ASG_DIR, "benchmark-aggregation.py", "Benchmark the aggregation scripts against a fake MDS"),
+}
+STARTUP_BENCHMARK = "benchmark startup"
+
+def run_command(command, argv):
+    # Runs the script of a subcommand as if it was started directly, with the rest of the arguments
+    folder, script_name, _ = COMMANDS[command]
+    # Scripts import their shared modules (mds.py, config.py, ...) from their own folder. Both experiment folders have
+    # modules with the same names, so the folder of the script has to come first.
+    script_path = os.path.join(folder, script_name)
+    sys.path.insert(0, folder)
+    sys.argv = [script_path] + argv
+    runpy.run_path(script_path, run_name="__main__")
+
+def benchmark_startup(commands, repeats=DEFAULT_REPEATS, standalone=False, slowest_imports=DEFAULT_SLOWEST_IMPORTS):
+    # Times `<subcommand> --help` in a fresh interpreter, which is the import and argument parsing cost a subcommand
+    # pays before it does any work. With standalone, the script is also timed when run directly.
+    # Imported here, like in the helpers below, so that other commands do not pay for them
+    import tabulate
+
+    rows = [{"command": "(none)", **time_startup([sys.executable, os.path.abspath(__file__), "--help"], repeats)}]
+    for command in commands:
+        folder, script_name, _ = COMMANDS[command]
+        print(f"Timing {command}")
+        row = {"command": command, **time_startup([sys.executable, os.path.abspath(__file__), *command.split(), "--help"], repeats)}
+        if standalone:
+            standalone_times = time_startup([sys.executable, os.path.join(folder, script_name), "--help"], repeats)
+            row["standalone-median-ms"] = standalone_times["median-ms"]
+        if slowest_imports > 0:
+            row["slowest-imports"] = ", ".join(f"{module} {ms:.0f}ms" for module, ms in get_slowest_imports(command, slowest_imports))
+        rows.append(row)
+
+    print(tabulate.tabulate(rows, headers='keys', tablefmt='grid'))
+    return rows
+
+def time_startup(command_line, repeats):
+    import statistics
+    import subprocess
+
+    times_ms = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        completed = subprocess.run(command_line, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times_ms.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+            raise Exception(f"{' '.join(command_line)} failed: {completed.stderr.strip()}")
+
+    return {"median-ms": round(statistics.median(times_ms), 1), "min-ms": round(min(times_ms), 1)}
+
+def get_slowest_imports(command, count):
+    import subprocess
+
+    # -X importtime prints "import time: self [us] | cumulative [us] | package" for every import. Top-level
+    # packages are the ones without indentation.
+    completed = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), *command.split(), "--help"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", line)
+        if match:
+            imports.append((match.group(2), int(match.group(1)) / 1000))
+
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+def comma_separated_commands(input: str):
+    commands = [command.strip() for command in input.split(',')]
+    unknown = [command for command in commands if command not in COMMANDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown commands {unknown}. Choose from {list(COMMANDS)}")
+    return commands
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run the OSB experiment scripts. Options after a command are passed to its script, e.g. `aggregate nodes --help`')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    groups = {}
+    for command in list(COMMANDS) + [STARTUP_BENCHMARK]:
+        help = COMMANDS[command][2] if command in COMMANDS else "Time the startup of every command"
+        if " " not in command:
+            # The script parses its own options, including --help
+            subparsers.add_parser(command, help=help, add_help=False).set_defaults(run=command)
+            continue
+
+        group, name = command.split(" ", 1)
+        if group not in groups:
+            group_parser = subparsers.add_parser(group, help=f"{group.capitalize()} commands")
+            groups[group] = group_parser.add_subparsers(dest='subcommand', required=True)
+        groups[group].add_parser(name, help=help, add_help=False).set_defaults(run=command)
+
+    return parser
+
+def build_startup_benchmark_parser():
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(__file__)} {STARTUP_BENCHMARK}", description='Time how long every command takes to start, from imports to parsing its options')
+    parser.add_argument('--commands', '-c', type=comma_separated_commands, default=list(COMMANDS), help=f'Comma-separated commands to time. Default: {",".join(COMMANDS)}')
+    parser.add_argument('--repeats', '-r', type=int, default=DEFAULT_REPEATS, help=f'Times to start every command. Default: {DEFAULT_REPEATS}')
+    parser.add_argument('--standalone', action='store_true', help='Also time running each script directly. Default: False')
+    parser.add_argument('--slowest-imports', type=int, default=DEFAULT_SLOWEST_IMPORTS, help=f'Number of slowest top-level imports to list for every command, from python -X importtime. Use 0 to skip. Default: {DEFAULT_SLOWEST_IMPORTS}')
+    return parser
+
+if __name__ == "__main__":
+    args, rest = build_parser().parse_known_args()
+
+    if args.run == STARTUP_BENCHMARK:
+        benchmark_args = build_startup_benchmark_parser().parse_args(rest)
+        benchmark_startup(benchmark_args.commands, benchmark_args.repeats, benchmark_args.standalone, benchmark_args.slowest_imports)
+    else:
+        run_command(args.run, rest)
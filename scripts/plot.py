@@ -1,39 +1,221 @@
+import os
+import glob
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
+from scalability import fit_model, plot_fits, MODELS
 
-def main(filename, output_name, x_metrics, y_metrics):
-    # Read the CSV file
-    data = pd.read_csv(filename)
-    print(data)
+# 150 dpi keeps a single 600,000-point series under half a second; pass --dpi 300 for print
+DEFAULT_DPI = 150
+# Default resolution of figures drawn as one LineCollection, e.g. a series per node. Rasterizing a thousand lines at
+# 300 dpi takes seconds and the lines are indistinguishable anyway.
+MANY_SERIES_DPI = 100
+# Series with more points than this are drawn without markers, and figures with more series than this get no legend
+MAX_MARKER_POINTS = 100
+MAX_LEGEND_ENTRIES = 20
 
-    # Extract the values from columns A and B
-    x_values = data[x_metrics]
-    y_values = data[y_metrics]
-    print(y_values)
 
-    # Create a line plot
-    plt.figure(figsize=(10, 6))  # Set the figure size (width, height) in inches
-    plt.plot(x_values, y_values, marker='o', markersize=4, markerfacecolor='black', markeredgecolor='black')
+def main(filenames, output_name, x_metrics, y_metrics, fits=None, group_by=None, error_bars=False, log_x=False, log_y=False,
+         max_points=None, combine=False, dpi=None, max_workers=None):
+    # One figure per CSV, rendered in parallel when there are several. With combine, every CSV is drawn on one
+    # figure, grouped by the file it came from unless another group_by column is given.
+    paths = expand_paths(filenames)
+    if not paths:
+        raise Exception(f"No CSV files found in {filenames}")
 
-    # Add labels and title
-    plt.xlabel(x_metrics)
-    plt.ylabel(y_metrics)
-    plt.title(f"{x_metrics} vs {y_metrics}")
+    options = dict(x_metrics=x_metrics, y_metrics=y_metrics, fits=fits, error_bars=error_bars, log_x=log_x, log_y=log_y,
+                   max_points=max_points, dpi=dpi)
+    if combine:
+        data = pd.concat([pd.read_csv(path).assign(source=get_stem(path)) for path in paths], ignore_index=True)
+        render_figure(data, f"{output_name}.png", group_by=group_by or "source", **options)
+        return
 
-    # Save the plot as a PNG image
-    plt.savefig(f"{output_name}.png", dpi=300, bbox_inches='tight')
-    print(f"Outputted {output_name}.png")
+    if len(paths) == 1:
+        render_figure(pd.read_csv(paths[0]), f"{output_name}.png", group_by=group_by, **options)
+        return
+
+    output_paths = [f"{output_name}-{get_stem(path)}.png" for path in paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(render_file, path, output_path, group_by=group_by, **options) for path, output_path in zip(paths, output_paths)]
+        for future in futures:
+            future.result()
+
+def render_file(path, output_path, **options):
+    render_figure(pd.read_csv(path), output_path, title_suffix=f" ({get_stem(path)})", **options)
+
+def render_figure(data, output_path, x_metrics, y_metrics, fits=None, group_by=None, error_bars=False, log_x=False, log_y=False,
+                  max_points=None, dpi=None, title_suffix=""):
+    fits = fits or []
+    missing = [column for column in [x_metrics, *y_metrics, group_by] if column is not None and column not in data]
+    if missing:
+        raise Exception(f"Columns {missing} are not in the CSV. Choose from {list(data.columns)}")
+    print(f"Plotting {len(data)} rows to {output_path}")
+
+    # Sorted once, then every series is an array of row positions, which is much cheaper than a DataFrame per group
+    # when there is a series per node
+    numeric_x = pd.api.types.is_numeric_dtype(data[x_metrics])
+    if numeric_x:
+        data = data.sort_values(x_metrics, kind="stable")
+    x_values = data[x_metrics].to_numpy()
+    # Non-numeric x values (e.g. timestamps as text) are evenly spaced in the CSV, so their position stands in for them
+    x_numbers = x_values.astype(float) if numeric_x else np.arange(len(data), dtype=float)
+    groups = data.groupby(group_by, sort=True).indices if group_by is not None else {None: np.arange(len(data))}
+    series_count = len(groups) * len(y_metrics)
+    many_series = series_count > MAX_LEGEND_ENTRIES and numeric_x and not error_bars and not fits
+    dpi = dpi or (MANY_SERIES_DPI if many_series else DEFAULT_DPI)
+
+    # A figure of its own instead of the pyplot state machine, so it can be closed and nothing is kept between figures
+    figure, axes = plt.subplots(figsize=(10, 6))  # Set the figure size (width, height) in inches
+    # Every series gets about one point per pixel column of the axes. More points only draw vertical strokes over
+    # each other, which is where Agg spends its time.
+    series_points = max(max_points or int(axes.get_position().width * figure.get_figwidth() * dpi), 2)
+
+    series = []
+    for y_metric in y_metrics:
+        y_values = data[y_metric].to_numpy(dtype=float)
+        positions = [indices[~np.isnan(y_values[indices])] for indices in groups.values()]
+        lengths = [len(indices) for indices in positions]
+        if max(lengths) > series_points:
+            kept = downsample_lttb(x_numbers[np.concatenate(positions)], y_values[np.concatenate(positions)], lengths, series_points)
+            print(f"Downsampled {y_metric} from {sum(lengths)} to {sum(len(indices) for indices in kept)} points in {len(positions)} series")
+            positions = [indices[kept_indices] for indices, kept_indices in zip(positions, kept)]
+        for group, indices in zip(groups, positions):
+            label = ", ".join(str(part) for part in [group, y_metric if len(y_metrics) > 1 or group is None else None] if part is not None)
+            series.append((label, y_metric, indices))
+
+    if many_series:
+        # One collection draws much faster than a line per node. Rasterized, so a vector output would not get every
+        # segment either.
+        colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        segments = [np.column_stack([x_numbers[indices], data[y_metric].to_numpy(dtype=float)[indices]]) for label, y_metric, indices in series]
+        collection = LineCollection(segments, colors=[colors[number % len(colors)] for number in range(len(segments))], linewidths=1)
+        collection.set_rasterized(True)
+        axes.add_collection(collection)
+        axes.autoscale()
+    else:
+        for label, y_metric, indices in series:
+            plot_series(axes, data.iloc[indices], x_values[indices], y_metric, label, fits, error_bars)
+
+    if log_x:
+        axes.set_xscale("log")
+    if log_y:
+        axes.set_yscale("log")
+    axes.set_xlabel(x_metrics)
+    axes.set_ylabel(", ".join(y_metrics))
+    axes.set_title(f"{x_metrics} vs {', '.join(y_metrics)}{title_suffix}")
+    if 1 < series_count <= MAX_LEGEND_ENTRIES or fits:
+        axes.legend()
+
+    figure.savefig(output_path, dpi=dpi, bbox_inches='tight')
+    plt.close(figure)
+    print(f"Outputted {output_path}")
+
+def plot_series(axes, data, x_values, y_metric, label, fits, error_bars):
+    y_values = data[y_metric].to_numpy(dtype=float)
+    marker = dict(marker='o', markersize=4) if len(data) <= MAX_MARKER_POINTS else {}
+    rsd_column = f"{y_metric}_rsd"
+    if error_bars and rsd_column in data:
+        # RSDs are percentages of the value
+        axes.errorbar(x_values, y_values, yerr=y_values * data[rsd_column].fillna(0).to_numpy(dtype=float) / 100, capsize=3, label=label, **marker)
+    else:
+        if error_bars:
+            print(f"No {rsd_column} column, plotting {y_metric} without error bars")
+        axes.plot(x_values, y_values, label=label, **marker)
+
+    # Overlay scalability models fitted to the plotted points
+    if fits:
+        fitted = {model: fit_model(x_values.astype(float), y_values, model) for model in fits}
+        plot_fits(axes, x_values.astype(float), fitted, label_prefix=f"{label} " if label != y_metric else "")
+
+def downsample_lttb(x_values, y_values, lengths, max_points):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points, and from every bucket in between the point
+    # that makes the largest triangle with the point kept before it and the average of the next bucket. Peaks and
+    # dips survive, unlike with every n-th point. x_values and y_values are series one after the other, with the
+    # given lengths. The buckets of every series are picked at the same time, so a thousand node series take about
+    # as long as one. Returns the kept positions within each series.
+    lengths = np.asarray(lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    kept = [np.arange(length) for length in lengths]
+    long_series = np.flatnonzero(lengths > max_points)
+    if len(long_series) == 0:
+        return kept
+    if max_points < 3:
+        # No bucket between the first and last points
+        for series in long_series:
+            kept[series] = np.array([0, lengths[series] - 1])
+        return kept
+
+    # Relative to the first point of each series, so the prefix sums of large timestamps keep their precision
+    x_values = x_values - np.repeat(x_values[starts], lengths)
+    y_values = y_values - np.repeat(y_values[starts], lengths)
+    x_sums = np.concatenate([[0], np.cumsum(x_values)])
+    y_sums = np.concatenate([[0], np.cumsum(y_values)])
+
+    first = starts[long_series]
+    bucket_size = (lengths[long_series] - 2) / (max_points - 2)
+    window = np.arange(int(np.ceil(bucket_size.max())) + 1)
+    rows = np.arange(len(long_series))
+    selected = np.empty((len(long_series), max_points), dtype=np.int64)
+    selected[:, 0] = first
+    selected[:, -1] = first + lengths[long_series] - 1
+    previous = first
+    for bucket in range(max_points - 2):
+        start = first + (bucket * bucket_size).astype(np.int64) + 1
+        end = first + ((bucket + 1) * bucket_size).astype(np.int64) + 1
+        next_end = np.minimum(first + ((bucket + 2) * bucket_size).astype(np.int64) + 1, selected[:, -1] + 1)
+        next_x = (x_sums[next_end] - x_sums[end]) / (next_end - end)
+        next_y = (y_sums[next_end] - y_sums[end]) / (next_end - end)
+
+        candidates = start[:, None] + window
+        outside = candidates >= end[:, None]
+        candidates = np.minimum(candidates, len(x_values) - 1)
+        previous_x = x_values[previous][:, None]
+        previous_y = y_values[previous][:, None]
+        areas = np.abs((previous_x - next_x[:, None]) * (y_values[candidates] - previous_y) -
+                       (previous_x - x_values[candidates]) * (next_y[:, None] - previous_y))
+        areas[outside] = -1
+        previous = candidates[rows, np.argmax(areas, axis=1)]
+        selected[:, bucket + 1] = previous
+
+    for row, series in enumerate(long_series):
+        kept[series] = selected[row] - starts[series]
+    return kept
+
+def get_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def expand_paths(inputs):
+    paths = []
+    for input in inputs:
+        if os.path.isdir(input):
+            paths += sorted(glob.glob(os.path.join(input, "*.csv")))
+        else:
+            paths += sorted(glob.glob(input)) or [input]
+    return paths
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Plot points of two columns in a CSV')
-    parser.add_argument('--filename', '-f', required=True, help='File of averaged results to convert to CSV')
+    parser = argparse.ArgumentParser(description='Plot columns of one or more CSVs')
+    parser.add_argument('--filename', '-f', nargs='+', required=True, help='CSV files, globs or folders of CSVs. Every CSV gets its own figure, <output-name>-<CSV name>.png, when there is more than one')
     parser.add_argument('--output-name', '-n', required=True, help='Output filename')
     parser.add_argument('-x', required=True, help='Column for x-axis')
-    parser.add_argument('-y', required=True, help='Column for y-axis')
+    parser.add_argument('-y', nargs='+', required=True, help='Columns for y-axis, one series each')
+    parser.add_argument('--group-by', '-g', help='Draw a series per value of this column, e.g. an instance type column. Default: none')
+    parser.add_argument('--combine', action='store_true', help='Draw every CSV on one figure, <output-name>.png, grouped by CSV unless --group-by is given. Default: False')
+    parser.add_argument('--error-bars', '-e', action='store_true', help='Draw error bars from the <y>_rsd column of every y column. Default: False')
+    parser.add_argument('--log-x', action='store_true', help='Use a log scale for the x-axis. Default: False')
+    parser.add_argument('--log-y', action='store_true', help='Use a log scale for the y-axis. Default: False')
+    parser.add_argument('--max-points', type=int, default=None, help='Points to draw of every series. Longer series are downsampled with LTTB, which keeps peaks and dips. Default: the width of the axes in pixels, e.g. 1162 at 150 dpi')
+    parser.add_argument('--dpi', type=int, default=None, help=f'Resolution of the PNGs. Default: {DEFAULT_DPI}, or {MANY_SERIES_DPI} for figures with more than {MAX_LEGEND_ENTRIES} series')
+    parser.add_argument('--max-workers', '-w', type=int, default=None, help='Max number of figures rendered at the same time. Default: number of CPUs')
+    parser.add_argument('--fit', nargs='+', choices=MODELS, default=None, help='Overlay the fit of Amdahl\'s law and/or the Universal Scalability Law to the points of every series, for throughput over nodes or clients. Default: none')
     args = parser.parse_args()
 
-    main(args.filename, args.output_name, args.x, args.y)
-
+    main(args.filename, args.output_name, args.x, args.y, args.fit, args.group_by, args.error_bars, args.log_x, args.log_y,
+         args.max_points, args.combine, args.dpi, args.max_workers)
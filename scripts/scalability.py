@@ -0,0 +1,240 @@
+import os
+import re
+import glob
+import json
+import argparse
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+DEFAULT_KNEE_EFFICIENCY = 0.5
+CONFIDENCE_DRAWS = 2000
+GAUSS_NEWTON_ITERATIONS = 50
+MODELS = ["amdahl", "usl"]
+
+# Fit Amdahl's law and the Universal Scalability Law to the throughput of a sweep of TestResult JSONs, one per
+# configuration, and report the predicted peak and knee of each fit.
+# USL: X(N) = λN / (1 + σ(N - 1) + κN(N - 1)), with contention σ and coherency κ. Amdahl's law is USL with κ = 0.
+def analyze_scalability(paths, output_name, x_name, y_metric, multiply_by_x, knee_efficiency=DEFAULT_KNEE_EFFICIENCY):
+    points = load_points(paths, x_name, y_metric, multiply_by_x)
+    if len(points) < 3:
+        raise Exception(f"Need results for at least 3 values of {x_name} to fit, found {len(points)}")
+
+    x_values = np.array([x for x, y in points], dtype=float)
+    y_values = np.array([y for x, y in points], dtype=float)
+    print(f"Fitting {len(points)} points: ", points)
+
+    fits = {}
+    for model in MODELS:
+        if model == "usl" and len(points) < 4:
+            print("Need results for at least 4 values to fit USL, skipping it")
+            continue
+        fits[model] = fit_model(x_values, y_values, model, knee_efficiency)
+        print_fit(model, fits[model])
+
+    with open(f"{output_name}.json", "w") as output_json:
+        json.dump({"x": x_name, "y": y_metric, "points": points, "knee-efficiency": knee_efficiency, "fits": fits}, output_json, indent=4)
+    print(f"Outputted to file called {output_name}.json")
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(x_values, y_values, 'o', markersize=4, color='black', label='measured')
+    plot_fits(plt.gca(), x_values, fits)
+    plt.xlabel(x_name)
+    plt.ylabel(f"throughput {y_metric}" + (f" x {x_name}" if multiply_by_x else ""))
+    plt.title(f"Scalability over {x_name}")
+    plt.legend()
+    plt.savefig(f"{output_name}.png", dpi=300, bbox_inches='tight')
+    print(f"Outputted {output_name}.png")
+
+    return fits
+
+def parse_configuration(test_patterns, name):
+    # Test patterns look like <prefix>-<N>-nodes-<M>-clients-<round>, so "nodes" and "clients" read N and M.
+    # Every round of a configuration has the same value.
+    values = set()
+    for pattern in test_patterns:
+        match = re.search(rf"(\d+)-{re.escape(name)}", pattern)
+        if match:
+            values.add(int(match.group(1)))
+
+    if len(values) != 1:
+        raise Exception(f"Expected one value of {name} in test patterns {test_patterns}, found {sorted(values)}")
+    return values.pop()
+
+def load_points(paths, x_name, y_metric, multiply_by_x):
+    # Returns sorted [(x, throughput)] with one point per TestResult
+    points = []
+    for path in paths:
+        with open(path) as file:
+            data = json.load(file)
+        if "test_pattern" not in data:
+            print(f"Skipping {path}: not a TestResult")
+            continue
+
+        x = parse_configuration(data["test_pattern"], x_name)
+        y = data["averaged_throughput"][y_metric]
+        if y is None:
+            print(f"Skipping {path}: no throughput {y_metric}")
+            continue
+        # aggregate-nodes-results.py averages throughput across nodes, so the fleet's throughput is that times the node count
+        points.append((x, y * x if multiply_by_x else y))
+
+    return sorted(points)
+
+def usl(n, parameters):
+    throughput_one, sigma, kappa = parameters
+    return throughput_one * n / (1 + sigma * (n - 1) + kappa * n * (n - 1))
+
+def fit_model(x_values, y_values, model, knee_efficiency=DEFAULT_KNEE_EFFICIENCY):
+    parameters, covariance = fit_usl(x_values, y_values, fix_kappa=(model == "amdahl"))
+    peak_x, peak_y = find_peak(parameters)
+    knee_x = find_knee(parameters, knee_efficiency, max(x_values.max(), peak_x or 0) * 4)
+
+    # Confidence intervals of the peak and knee come from drawing parameters from their fitted distribution
+    rng = np.random.default_rng(0)
+    draws = rng.multivariate_normal(parameters, covariance, size=CONFIDENCE_DRAWS, check_valid="ignore")
+    draws = draws[(draws[:, 0] > 0) & (draws[:, 1] >= 0) & (draws[:, 2] >= 0)]
+    peak_draws = [find_peak(draw) for draw in draws]
+    # Each draw is searched up to its own peak, which can be far from the fitted one
+    knee_draws = [find_knee(draw, knee_efficiency, max(x_values.max(), draw_peak_x or 0) * 4) for draw, (draw_peak_x, _) in zip(draws, peak_draws)]
+
+    standard_errors = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    residuals = y_values - usl(x_values, parameters)
+    total = ((y_values - y_values.mean()) ** 2).sum()
+    return {
+        "throughput-one": confidence_interval_of_parameter(parameters[0], standard_errors[0]),
+        "sigma": confidence_interval_of_parameter(parameters[1], standard_errors[1]),
+        "kappa": confidence_interval_of_parameter(parameters[2], standard_errors[2]),
+        "r-squared": float(1 - (residuals ** 2).sum() / total) if total > 0 else None,
+        "peak-x": confidence_interval_of_draws(peak_x, [draw[0] for draw in peak_draws]),
+        "peak-throughput": confidence_interval_of_draws(peak_y, [draw[1] for draw in peak_draws]),
+        "knee-x": confidence_interval_of_draws(knee_x, knee_draws)
+    }
+
+def fit_usl(x_values, y_values, fix_kappa=False):
+    # N/X(N) = 1/λ + (σ/λ)(N - 1) + (κ/λ)N(N - 1) is linear in its coefficients, so a linear least squares fit gives
+    # the starting point. Gauss-Newton then minimizes the squared error of the throughput itself.
+    columns = [np.ones_like(x_values), x_values - 1] + ([] if fix_kappa else [x_values * (x_values - 1)])
+    design = np.column_stack(columns)
+    coefficients = np.linalg.lstsq(design, x_values / y_values, rcond=None)[0]
+    throughput_one = 1 / coefficients[0] if coefficients[0] > 0 else y_values[0] / x_values[0]
+    parameters = np.array([throughput_one, max(coefficients[1] * throughput_one, 0), 0 if fix_kappa else max(coefficients[2] * throughput_one, 0)])
+
+    free = [0, 1] if fix_kappa else [0, 1, 2]
+    for iteration in range(GAUSS_NEWTON_ITERATIONS):
+        jacobian = usl_jacobian(x_values, parameters)[:, free]
+        residuals = y_values - usl(x_values, parameters)
+        step = np.linalg.lstsq(jacobian, residuals, rcond=None)[0]
+        updated = parameters.copy()
+        updated[free] += step
+        # Contention and coherency are not negative, and a step that does not improve the fit is halved
+        updated[1:] = np.clip(updated[1:], 0, None)
+        while ((y_values - usl(x_values, updated)) ** 2).sum() > (residuals ** 2).sum() and np.abs(step).max() > 1e-12:
+            step /= 2
+            updated = parameters.copy()
+            updated[free] += step
+            updated[1:] = np.clip(updated[1:], 0, None)
+        if np.allclose(updated, parameters, rtol=1e-10, atol=1e-14):
+            parameters = updated
+            break
+        parameters = updated
+
+    jacobian = usl_jacobian(x_values, parameters)[:, free]
+    residuals = y_values - usl(x_values, parameters)
+    degrees_of_freedom = max(len(x_values) - len(free), 1)
+    covariance = np.zeros((3, 3))
+    covariance[np.ix_(free, free)] = np.linalg.pinv(jacobian.T @ jacobian) * (residuals ** 2).sum() / degrees_of_freedom
+    return parameters, covariance
+
+def usl_jacobian(n, parameters):
+    throughput_one, sigma, kappa = parameters
+    denominator = 1 + sigma * (n - 1) + kappa * n * (n - 1)
+    return np.column_stack([
+        n / denominator,
+        -throughput_one * n * (n - 1) / denominator ** 2,
+        -throughput_one * n * n * (n - 1) / denominator ** 2
+    ])
+
+def find_peak(parameters):
+    # Throughput peaks at N = sqrt((1 - σ) / κ). Amdahl's law and USL with σ >= 1 have no peak.
+    throughput_one, sigma, kappa = parameters
+    if kappa <= 0 or sigma >= 1:
+        return None, None
+    peak_x = float(np.sqrt((1 - sigma) / kappa))
+    return peak_x, float(usl(peak_x, parameters))
+
+def find_knee(parameters, knee_efficiency, max_x):
+    # The knee is the first N at which adding one more node or client adds less than knee_efficiency
+    # of what the first one did. The marginal gain of USL only falls as N grows, so the knee is found by bisection
+    # over N from 1 to max_x in O(log max_x) evaluations. A grid of every N would take seconds and gigabytes for the
+    # nearly linear fits with a tiny κ, whose peak is millions of nodes away.
+    threshold = knee_efficiency * parameters[0]
+    def is_below(n):
+        return usl(n + 1, parameters) - usl(n, parameters) < threshold
+
+    low, high = 1, int(np.ceil(max(max_x, 2))) - 1
+    if not is_below(high):
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        if is_below(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return float(low)
+
+def confidence_interval_of_parameter(value, standard_error):
+    return {"value": float(value), "low": float(value - 1.96 * standard_error), "high": float(value + 1.96 * standard_error)}
+
+def confidence_interval_of_draws(value, draws):
+    draws = [draw for draw in draws if draw is not None]
+    if value is None or not draws:
+        return {"value": value, "low": None, "high": None}
+    return {"value": value, "low": float(np.percentile(draws, 2.5)), "high": float(np.percentile(draws, 97.5))}
+
+def print_fit(model, fit):
+    def format_interval(interval):
+        if interval["value"] is None:
+            return "none"
+        if interval["low"] is None:
+            return f"{interval['value']:.4g}"
+        return f"{interval['value']:.4g} (95% CI {interval['low']:.4g} - {interval['high']:.4g})"
+
+    print(f"{model}: R^2 {fit['r-squared']:.4f}" if fit['r-squared'] is not None else f"{model}:")
+    for key in ["throughput-one", "sigma", "kappa", "peak-x", "peak-throughput", "knee-x"]:
+        print(f"  {key}: {format_interval(fit[key])}")
+
+def plot_fits(axes, x_values, fits, label_prefix=""):
+    # Draws the fitted curves past the last measured point, far enough to show the peak when there is one
+    peaks = [fit["peak-x"]["value"] for fit in fits.values() if fit["peak-x"]["value"] is not None]
+    curve_x = np.linspace(1, max([x_values.max() * 1.5] + [peak * 1.2 for peak in peaks]), 200)
+    for model, fit in fits.items():
+        parameters = [fit["throughput-one"]["value"], fit["sigma"]["value"], fit["kappa"]["value"]]
+        line = axes.plot(curve_x, usl(curve_x, parameters), '--', label=f"{label_prefix}{model} fit")[0]
+        if fit["peak-x"]["value"] is not None:
+            axes.axvline(fit["peak-x"]["value"], color=line.get_color(), linestyle=':', label=f"{label_prefix}{model} peak")
+        if fit["knee-x"]["value"] is not None:
+            axes.plot(fit["knee-x"]["value"], usl(fit["knee-x"]["value"], parameters), 'x', color=line.get_color(), markersize=8, label=f"{label_prefix}{model} knee")
+
+def expand_paths(inputs):
+    paths = []
+    for input in inputs:
+        if os.path.isdir(input):
+            paths += sorted(glob.glob(os.path.join(input, "*.json")))
+        else:
+            paths += sorted(glob.glob(input))
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit Amdahl\'s law and the Universal Scalability Law to the throughput of a sweep')
+    parser.add_argument('--files', '-f', nargs='+', required=True, help='TestResult JSONs, globs or folders of them, one per configuration')
+    parser.add_argument('--output-name', '-n', required=True, help='Output filename to use for the fit JSON and plot')
+    parser.add_argument('-x', default='nodes', help='Configuration to scale over, read from test patterns like <N>-nodes or <N>-clients. Default: nodes')
+    parser.add_argument('-y', default='mean', help='Throughput value to fit (min, mean or median). Default: mean')
+    parser.add_argument('--per-node', action='store_true', help='Fit the averaged throughput as is instead of multiplying it by the node count. Only applies to -x nodes. Default: False')
+    parser.add_argument('--knee-efficiency', type=float, default=DEFAULT_KNEE_EFFICIENCY, help=f'The knee is where one more node or client adds less than this fraction of the first one\'s throughput. Default: {DEFAULT_KNEE_EFFICIENCY}')
+    args = parser.parse_args()
+
+    analyze_scalability(expand_paths(args.files), args.output_name, args.x, args.y, args.x == "nodes" and not args.per_node, args.knee_efficiency)